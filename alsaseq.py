@@ -0,0 +1,284 @@
+"""
+Alsa sequencer input : read the events of a sequencer port
+(hardware port, virtual port, software synth, DAW...) already decoded
+by alsa, through a ctypes binding to libasound
+
+A port is given as a device : seq:client:port, e.g. seq:20:0
+or seq:"Keystation 49":0 (see `aconnect -l` or `midiev.py --list`).
+SeqDevice has the MidiDevice interface, so MidiKeyboard reads it
+as the raw midi devices.
+"""
+import ctypes
+import ctypes.util
+import logging
+import select
+from midiev import NOTEOFF, NOTEON, AFTERTOUCH, CONTROLLER, PATCHCHANGE
+from midiev import PRESSURE, PITCHBEND, SYSEX, SYSEX_END
+from options import SEQ_PREFIX
+
+SND_SEQ_OPEN_INPUT = 2
+SND_SEQ_NONBLOCK = 1
+SND_SEQ_PORT_CAP_READ = 1 << 0
+SND_SEQ_PORT_CAP_WRITE = 1 << 1
+SND_SEQ_PORT_CAP_SUBS_READ = 1 << 5
+SND_SEQ_PORT_CAP_SUBS_WRITE = 1 << 6
+SND_SEQ_PORT_TYPE_MIDI_GENERIC = 1 << 1
+SND_SEQ_PORT_TYPE_APPLICATION = 1 << 20
+SND_SEQ_CLIENT_SYSTEM = 0
+SND_SEQ_PORT_SYSTEM_ANNOUNCE = 1
+EAGAIN = 11
+ENOSPC = 28
+
+# event types (snd_seq_event_type)
+SND_SEQ_EVENT_NOTEON = 6
+SND_SEQ_EVENT_NOTEOFF = 7
+SND_SEQ_EVENT_KEYPRESS = 8
+SND_SEQ_EVENT_CONTROLLER = 10
+SND_SEQ_EVENT_PGMCHANGE = 11
+SND_SEQ_EVENT_CHANPRESS = 12
+SND_SEQ_EVENT_PITCHBEND = 13
+SND_SEQ_EVENT_CLIENT_EXIT = 61
+SND_SEQ_EVENT_PORT_EXIT = 64
+SND_SEQ_EVENT_SYSEX = 130
+
+
+class SeqAddr(ctypes.Structure):
+    """snd_seq_addr_t"""
+    _fields_ = [('client', ctypes.c_ubyte), ('port', ctypes.c_ubyte)]
+
+
+class SeqNote(ctypes.Structure):
+    """snd_seq_ev_note_t"""
+    _fields_ = [('channel', ctypes.c_ubyte), ('note', ctypes.c_ubyte),
+                ('velocity', ctypes.c_ubyte), ('off_velocity', ctypes.c_ubyte),
+                ('duration', ctypes.c_uint)]
+
+
+class SeqCtrl(ctypes.Structure):
+    """snd_seq_ev_ctrl_t"""
+    _fields_ = [('channel', ctypes.c_ubyte), ('unused', ctypes.c_ubyte * 3),
+                ('param', ctypes.c_uint), ('value', ctypes.c_int)]
+
+
+class SeqExt(ctypes.Structure):
+    """snd_seq_ev_ext_t"""
+    _pack_ = 1
+    _fields_ = [('len', ctypes.c_uint), ('ptr', ctypes.c_void_p)]
+
+
+class SeqEventData(ctypes.Union):
+    """data of snd_seq_event_t"""
+    _fields_ = [('note', SeqNote), ('control', SeqCtrl), ('ext', SeqExt),
+                ('addr', SeqAddr), ('raw', ctypes.c_ubyte * 12)]
+
+
+class SeqEvent(ctypes.Structure):
+    """snd_seq_event_t"""
+    _fields_ = [('type', ctypes.c_ubyte), ('flags', ctypes.c_ubyte),
+                ('tag', ctypes.c_ubyte), ('queue', ctypes.c_ubyte),
+                ('time', ctypes.c_uint * 2),
+                ('source', SeqAddr), ('dest', SeqAddr),
+                ('data', SeqEventData)]
+
+
+class PollFd(ctypes.Structure):
+    """struct pollfd"""
+    _fields_ = [('fd', ctypes.c_int), ('events', ctypes.c_short),
+                ('revents', ctypes.c_short)]
+
+
+_LIBASOUND = []
+
+
+def libasound():
+    """libasound : the library, loaded on the first call, None if missing"""
+    if not _LIBASOUND:
+        name = ctypes.util.find_library('asound')
+        lib = None
+        try:
+            lib = ctypes.CDLL(name or 'libasound.so.2')
+        except OSError:
+            logging.error("libasound not found, "
+                          "alsa sequencer ports can not be read")
+        if lib is not None:
+            lib.snd_seq_event_input.argtypes = [
+                ctypes.c_void_p, ctypes.POINTER(ctypes.POINTER(SeqEvent))]
+            lib.snd_seq_port_info_get_name.restype = ctypes.c_char_p
+            lib.snd_seq_client_info_get_name.restype = ctypes.c_char_p
+        _LIBASOUND.append(lib)
+    return _LIBASOUND[0]
+
+
+def open_seq(lib, client_name=b'midievk'):
+    """open_seq : a sequencer handle opened for input, without blocking
+
+    :param lib: libasound()
+    :param client_name:
+    """
+    handle = ctypes.c_void_p()
+    if lib.snd_seq_open(ctypes.byref(handle), b'default',
+                        SND_SEQ_OPEN_INPUT, SND_SEQ_NONBLOCK) < 0:
+        raise IOError('Can not open the alsa sequencer')
+    lib.snd_seq_set_client_name(handle, client_name)
+    return handle
+
+
+def to_bytes(message):
+    """to_bytes : midi bytes of a message (for recorders)
+
+    :param message:
+    """
+    if message[0] == SYSEX:
+        return bytes([SYSEX]) + message[1] + bytes([SYSEX_END])
+    return bytes(message)
+
+
+class SeqDevice(object):
+    """SeqDevice : an alsa sequencer port read without blocking,
+    with the interface of midiev.MidiDevice"""
+
+    def __init__(self, path, recorder=None):
+        self.path = path
+        self._recorder = recorder
+        self._lib = lib = libasound()
+        if lib is None:
+            raise IOError('libasound not found')
+        self._handle = handle = open_seq(lib)
+        self._source = SeqAddr()
+        try:
+            port = lib.snd_seq_create_simple_port(
+                handle, b'input',
+                SND_SEQ_PORT_CAP_WRITE | SND_SEQ_PORT_CAP_SUBS_WRITE,
+                SND_SEQ_PORT_TYPE_MIDI_GENERIC | SND_SEQ_PORT_TYPE_APPLICATION)
+            if port < 0:
+                raise IOError('Can not create a sequencer port')
+            if lib.snd_seq_parse_address(
+                    handle, ctypes.byref(self._source),
+                    path[len(SEQ_PREFIX):].encode()) < 0:
+                raise IOError('Unknown sequencer port %s' % path)
+            if lib.snd_seq_connect_from(
+                    handle, port,
+                    self._source.client, self._source.port) < 0:
+                raise IOError('Can not subscribe to %s' % path)
+            # to know when the port disappears
+            lib.snd_seq_connect_from(handle, port, SND_SEQ_CLIENT_SYSTEM,
+                                     SND_SEQ_PORT_SYSTEM_ANNOUNCE)
+            pollfd = PollFd()
+            lib.snd_seq_poll_descriptors(
+                handle, ctypes.byref(pollfd), 1, select.POLLIN)
+            self._fd = pollfd.fd
+        except IOError:
+            lib.snd_seq_close(handle)
+            raise
+        self._event = ctypes.POINTER(SeqEvent)()
+
+    def fileno(self):
+        """fileno"""
+        return self._fd
+
+    def read(self):
+        """read : return available messages, None if the port is gone"""
+        messages = []
+        while True:
+            result = self._lib.snd_seq_event_input(
+                self._handle, ctypes.byref(self._event))
+            if result == -EAGAIN:
+                break
+            if result == -ENOSPC:
+                logging.warning("Sequencer events lost: %s", self.path)
+                continue
+            if result < 0:
+                return None
+            event = self._event.contents
+            if event.type in (SND_SEQ_EVENT_PORT_EXIT,
+                              SND_SEQ_EVENT_CLIENT_EXIT):
+                addr = event.data.addr
+                if (addr.client == self._source.client and
+                        (event.type == SND_SEQ_EVENT_CLIENT_EXIT or
+                         addr.port == self._source.port)):
+                    return None
+                continue
+            message = self.decode(event)
+            if message is not None:
+                messages.append(message)
+        if self._recorder is not None and messages:
+            self._recorder(self.path, b''.join(map(to_bytes, messages)))
+        return messages
+
+    @staticmethod
+    def decode(event):
+        """decode : midi message tuple of a sequencer event,
+        as returned by midiev.MidiParser, None for other events
+
+        :param event: SeqEvent
+        """
+        evtype = event.type
+        if evtype in (SND_SEQ_EVENT_NOTEON, SND_SEQ_EVENT_NOTEOFF,
+                      SND_SEQ_EVENT_KEYPRESS):
+            note = event.data.note
+            status = {SND_SEQ_EVENT_NOTEON: NOTEON,
+                      SND_SEQ_EVENT_NOTEOFF: NOTEOFF,
+                      SND_SEQ_EVENT_KEYPRESS: AFTERTOUCH}[evtype]
+            return (status | note.channel, note.note, note.velocity)
+        if evtype == SND_SEQ_EVENT_CONTROLLER:
+            control = event.data.control
+            return (CONTROLLER | control.channel,
+                    control.param & 0x7F, control.value & 0x7F)
+        if evtype in (SND_SEQ_EVENT_PGMCHANGE, SND_SEQ_EVENT_CHANPRESS):
+            control = event.data.control
+            status = (PATCHCHANGE if evtype == SND_SEQ_EVENT_PGMCHANGE
+                      else PRESSURE)
+            return (status | control.channel, control.value & 0x7F)
+        if evtype == SND_SEQ_EVENT_PITCHBEND:
+            control = event.data.control
+            value = control.value + 0x2000
+            return (PITCHBEND | control.channel,
+                    value & 0x7F, (value >> 7) & 0x7F)
+        if evtype == SND_SEQ_EVENT_SYSEX:
+            ext = event.data.ext
+            data = ctypes.string_at(ext.ptr, ext.len) if ext.ptr else b''
+            return (SYSEX, data.strip(bytes([SYSEX, SYSEX_END])))
+        return None
+
+    def close(self):
+        """close"""
+        if self._handle is not None:
+            self._lib.snd_seq_close(self._handle)
+            self._handle = None
+
+
+def list_ports():
+    """list_ports : readable sequencer ports, [(seq:client:port, name)]"""
+    lib = libasound()
+    if lib is None:
+        return []
+    try:
+        handle = open_seq(lib, b'midievk-list')
+    except IOError:
+        return []
+    cinfo = ctypes.c_void_p()
+    pinfo = ctypes.c_void_p()
+    lib.snd_seq_client_info_malloc(ctypes.byref(cinfo))
+    lib.snd_seq_port_info_malloc(ctypes.byref(pinfo))
+    wanted = SND_SEQ_PORT_CAP_READ | SND_SEQ_PORT_CAP_SUBS_READ
+    ports = []
+    lib.snd_seq_client_info_set_client(cinfo, -1)
+    while lib.snd_seq_query_next_client(handle, cinfo) >= 0:
+        client = lib.snd_seq_client_info_get_client(cinfo)
+        if client == SND_SEQ_CLIENT_SYSTEM:
+            continue
+        lib.snd_seq_port_info_set_client(pinfo, client)
+        lib.snd_seq_port_info_set_port(pinfo, -1)
+        while lib.snd_seq_query_next_port(handle, pinfo) >= 0:
+            if lib.snd_seq_port_info_get_capability(pinfo) & wanted != wanted:
+                continue
+            ports.append((
+                '%s%d:%d' % (SEQ_PREFIX, client,
+                             lib.snd_seq_port_info_get_port(pinfo)),
+                '%s - %s' % (
+                    lib.snd_seq_client_info_get_name(cinfo).decode(),
+                    lib.snd_seq_port_info_get_name(pinfo).decode())))
+    lib.snd_seq_client_info_free(cinfo)
+    lib.snd_seq_port_info_free(pinfo)
+    lib.snd_seq_close(handle)
+    return ports
@@ -0,0 +1,205 @@
+"""
+Chords and sequences of notes bound to their own keybinds
+
+A chord is a set of notes pressed within a time window : its keybind
+is held down until one of its notes is released, and its notes send
+nothing. The notes which may start a chord are held back until the chord
+is complete or the window is over (then they are sent as usual).
+
+A sequence is a list of notes pressed one after the other, each one
+within a gap after the previous one : its keybind is sent with the last
+note. The notes of a sequence are also sent as usual.
+
+Configured next to the keytable :
+    "chords": [{"notes": [60, 64, 67], "keybind": "Ctrl+c"}],
+    "sequences": [{"notes": [60, 62, 64], "keybind": "Ctrl+z"}],
+    "chord-window": 50, "sequence-gap": 1000   (milliseconds)
+"""
+import logging
+from itertools import combinations
+from midiev import NOTEON, NOTEOFF, MIDITYPE, CHANNEL
+from keytable import UNDEFINED_KEYBIND
+
+CHORD_WINDOW = 50      # ms
+SEQUENCE_GAP = 1000    # ms
+# bounds of the memory used while matching
+MAX_CHORD_NOTES = 8
+MAX_CURSORS = 16
+
+
+def check_chord(values):
+    """check_chord : a chord or sequence entry of a config file,
+    None if it can not be used (no notes, no keybind)
+    (see keytable.check_entry)
+
+    :param values: {notes, keybind}
+    """
+    if not isinstance(values, dict):
+        return None
+    notes = values.get('notes')
+    keybind = values.get('keybind')
+    if not isinstance(notes, list) or not notes:
+        return None
+    if not all(isinstance(note, int) and 0 <= note < 128 for note in notes):
+        return None
+    if not isinstance(keybind, str) or keybind in ('', UNDEFINED_KEYBIND):
+        return None
+    return {'notes': notes, 'keybind': keybind}
+
+
+class ChordMatcher(object):
+    """ChordMatcher : between MidiToXdo.parse_command and send_keystroke,
+    the work for each note is linear in the number of pending notes
+    and of sequences being matched (both bounded)"""
+
+    def __init__(self, send, inject, chords=(), sequences=(),
+                 window=CHORD_WINDOW, gap=SEQUENCE_GAP):
+        """__init__
+
+        :param send: function(command, hexcode) sending a note as usual
+        :param inject: function(keyevt, action) sending a keybind
+        :param chords: [(notes, action)]
+        :param sequences: [(notes, action)]
+        :param window: chord window in ms
+        :param gap: maximum interval between two notes of a sequence in ms
+        """
+        self._send = send
+        self._inject = inject
+        self.window = window / 1000.0
+        self.gap = gap / 1000.0
+        self._chords = {}         # frozenset of notes -> action
+        self._partial = {}        # frozenset -> is a part of a larger chord
+        for (notes, action) in chords:
+            notes = frozenset(notes)
+            if not 1 < len(notes) <= MAX_CHORD_NOTES:
+                logging.warning("Chord ignored: %s", sorted(notes))
+                continue
+            self._chords[notes] = action
+            for size in range(1, len(notes) + 1):
+                for part in combinations(sorted(notes), size):
+                    part = frozenset(part)
+                    self._partial[part] = (self._partial.get(part, False) or
+                                           part != notes)
+        self._trie = {}           # note -> node, None -> action of a node
+        for (notes, action) in sequences:
+            node = self._trie
+            for note in notes:
+                node = node.setdefault(note, {})
+            node[None] = action
+        self._pending = []        # (command, hexcode) held back
+        self._pending_notes = frozenset()
+        self._pending_since = 0
+        self._held = {}           # note -> notes of the chord held down
+        self._cursors = []        # trie nodes reached by the last notes
+        self._last_note = 0
+
+    def deadline(self):
+        """deadline : time when the pending notes have to be sent,
+        None if no note is pending"""
+        if self._pending:
+            return self._pending_since + self.window
+        return None
+
+    def feed(self, command, hexcode, now):
+        """feed
+
+        :param command: note-on or note-off (see MidiToXdo.parse_command)
+        :param hexcode:
+        :param now: time.perf_counter()
+        """
+        note = command[CHANNEL]
+        if command[MIDITYPE] == NOTEOFF:
+            if note in self._held:
+                chord = self._held.pop(note)
+                if chord is not None:
+                    self._release_chord(chord)
+                return
+            if note in self._pending_notes:
+                self.flush()
+                if note in self._held:
+                    # the pending notes made a chord : released at once
+                    self._release_chord(self._held.pop(note))
+                    return
+            self._send(command, hexcode)
+            return
+        if command[MIDITYPE] != NOTEON:
+            self._send(command, hexcode)
+            return
+        if self._trie:
+            self._advance(note, now)
+        if not self._partial:
+            self._send(command, hexcode)
+            return
+        if self._pending and now > self._pending_since + self.window:
+            self.flush()
+        notes = self._pending_notes | {note}
+        if notes not in self._partial:
+            self.flush()
+            notes = frozenset((note,))
+            if notes not in self._partial:
+                self._send(command, hexcode)
+                return
+        if not self._pending:
+            self._pending_since = now
+        self._pending.append((command, hexcode))
+        self._pending_notes = notes
+        if not self._partial[notes]:
+            self.flush()  # a complete chord, not part of a larger one
+
+    def flush(self, now=None):
+        """flush : send the pending notes, as a chord if they make one
+
+        :param now: only if their window is over, when given
+        """
+        if not self._pending:
+            return
+        if now is not None and now <= self._pending_since + self.window:
+            return
+        chord = self._pending_notes
+        pending = self._pending
+        self._pending = []
+        self._pending_notes = frozenset()
+        if chord in self._chords:
+            for note in chord:
+                self._held[note] = chord
+            self._inject('keydown', self._chords[chord])
+            return
+        for (command, hexcode) in pending:
+            self._send(command, hexcode)
+
+    def _release_chord(self, chord):
+        """_release_chord : keyup of a chord, its other notes send nothing
+
+        :param chord: notes of the chord
+        """
+        for note in chord:
+            if note in self._held:
+                self._held[note] = None  # until the note is released
+        self._inject('keyup', self._chords[chord])
+
+    def _advance(self, note, now):
+        """_advance : move the sequence cursors with a note-on
+
+        :param note:
+        :param now:
+        """
+        cursors = []
+        if now - self._last_note <= self.gap:
+            cursors = [node[note] for node in self._cursors if note in node]
+        self._last_note = now
+        if note in self._trie:
+            cursors.append(self._trie[note])
+        self._cursors = cursors[-MAX_CURSORS:]
+        for node in self._cursors:
+            if None in node:
+                self._inject('key', node[None])
+
+    def release(self):
+        """release : keyup of the held chords, forget pending notes
+        and sequences (e.g. the device is unplugged)"""
+        for chord in set(c for c in self._held.values() if c is not None):
+            self._inject('keyup', self._chords[chord])
+        self._held.clear()
+        self._pending = []
+        self._pending_notes = frozenset()
+        self._cursors = []
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""
+Compact binary config format, registered in options.CONFIG_LOADER
+as 'mevk' : same interface as the json module (load / dump)
+
+The keytable is loaded with integer keys, ready for MidiToXdo,
+instead of hex strings to convert and check one by one.
+
+Layout (little endian) :
+    MAGIC
+    I  size, then the other settings as json (ctl-steps, device...)
+    H  number of strings, then for each : H size, utf-8 bytes
+    I  number of keys, then for each ENTRY :
+       hexcode, type string, keybind string, channel, mode
+
+Usage : ./configbin.py config.json config.mevk (or the opposite) converts
+a config from a format to another.
+"""
+import sys
+import json
+import struct
+from keytable import check_entry
+
+MAGIC = b'MEVK\x01'
+SIZE = struct.Struct('<I')
+STRING_COUNT = struct.Struct('<H')
+ENTRY = struct.Struct('<IHHBB')
+NO_STRING = 0xFFFF
+# open the config files in binary mode
+BINARY = True
+
+
+def dump(settings, output, **kwargs):
+    """dump
+
+    :param settings: as returned by options.get_options, with a keytable
+                     {hex string or int: {type, channel, keybind, mode}},
+                     the entries refused by keytable.check_entry are left out
+    :param output: binary file
+    :param kwargs: json.dump arguments, unused
+    """
+    others = dict((k, v) for (k, v) in settings.items() if k != 'keytable')
+    strings = {}
+    entries = []
+    for (hexkey, values) in settings.get('keytable', {}).items():
+        values = check_entry(values)
+        if values is None:
+            continue
+        key = hexkey if isinstance(hexkey, int) else int(hexkey, 16)
+        entries.append((
+            key,
+            strings.setdefault(values['type'], len(strings)),
+            strings.setdefault(values['keybind'], len(strings)),
+            values['channel'], values['mode']))
+    header = json.dumps(others, sort_keys=True).encode()
+    data = [MAGIC, SIZE.pack(len(header)), header,
+            STRING_COUNT.pack(len(strings))]
+    for string in strings:  # dicts keep the insertion order
+        encoded = string.encode()
+        data.append(STRING_COUNT.pack(len(encoded)))
+        data.append(encoded)
+    data.append(SIZE.pack(len(entries)))
+    data.extend(ENTRY.pack(*entry) for entry in sorted(entries))
+    output.write(b''.join(data))
+
+
+def load(config):
+    """load
+
+    :param config: binary file
+    :return: settings, the keytable has integer keys
+    """
+    data = config.read()
+    if not data.startswith(MAGIC):
+        raise ValueError('not a binary midievk config')
+    offset = len(MAGIC)
+    (size,) = SIZE.unpack_from(data, offset)
+    offset += SIZE.size
+    settings = json.loads(data[offset:offset + size].decode())
+    offset += size
+    (count,) = STRING_COUNT.unpack_from(data, offset)
+    offset += STRING_COUNT.size
+    strings = {NO_STRING: None}
+    for index in range(count):
+        (size,) = STRING_COUNT.unpack_from(data, offset)
+        offset += STRING_COUNT.size
+        strings[index] = data[offset:offset + size].decode()
+        offset += size
+    (count,) = SIZE.unpack_from(data, offset)
+    offset += SIZE.size
+    end = offset + count * ENTRY.size
+    settings['keytable'] = dict(
+        (key, {'type': strings[keytype], 'channel': channel,
+               'keybind': strings[keybind],
+               'mode': mode})
+        for (key, keytype, keybind, channel, mode)
+        in ENTRY.iter_unpack(data[offset:end]))
+    return settings
+
+
+def main():
+    """main"""
+    from options import load_config, save_config
+    if len(sys.argv) != 3:
+        print('Usage : %s <from config> <to config>' % sys.argv[0])
+        sys.exit(1)
+    save_config(load_config(sys.argv[1]), sys.argv[2])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+"""
+Fake midi devices : fifos in /tmp/fakemidi* (accepted as devices
+by options.parse_argv) to run midievk without any midi keyboard.
+
+Usage : ./fakemidi.py /tmp/fakemidi1 /tmp/fakemidi2 ...
+then type lines like `1 90 3c 64` (device number, then hex bytes).
+
+Record the bytes sent by midi devices, until Ctrl+C :
+    ./fakemidi.py --record session.rec /dev/midi1 ...
+Replay them into /tmp/fakemidi1 ... (as fast as possible with --fast) :
+    ./fakemidi.py --replay session.rec [--fast] [/tmp/fakemidi1 ...]
+"""
+import os
+import sys
+import time
+import struct
+
+try:
+    input = raw_input
+except NameError:
+    pass
+
+FAKE_DEVICE = '/tmp/fakemidi'
+
+# recording : magic, then records made of a header and the bytes read
+RECORD_MAGIC = b'MIDIREC1'
+# microseconds since the previous record, device number, data size
+RECORD_HEADER = struct.Struct('<IBH')
+# device number of the records declaring a device (data is its path)
+RECORD_DEVICE = 0xFF
+
+
+def make_fifo(path=FAKE_DEVICE):
+    """make_fifo : (re)create a fifo usable as a fake midi device
+
+    :param path:
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    os.mkfifo(path)
+    return path
+
+
+class FakeMidi(object):
+    """FakeMidi : write midi messages into a fifo"""
+
+    def __init__(self, path=FAKE_DEVICE):
+        self.path = make_fifo(path)
+        self._midioutput = None
+
+    def open(self):
+        """open : block until a reader opened the fifo"""
+        self._midioutput = open(self.path, 'wb', buffering=0)
+
+    def send(self, *messages):
+        """send
+
+        :param messages: midi messages, e.g. (0x90, 60, 100)
+        """
+        if self._midioutput is None:
+            self.open()
+        self._midioutput.write(b''.join(bytes(m) for m in messages))
+
+    def close(self):
+        """close : the reader sees the end of file, as an unplugged device"""
+        if self._midioutput is not None:
+            self._midioutput.close()
+            self._midioutput = None
+
+    def remove(self):
+        """remove"""
+        self.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def unplug(self):
+        """unplug : as an unplugged usb device, the device disappears
+        (before the reader sees the end of file, so that it can not open
+        the fifo again)"""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.close()
+
+    def replug(self):
+        """replug : the device is back, block until it is read again"""
+        make_fifo(self.path)
+        self.open()
+
+
+class MidiRecorder(object):
+    """MidiRecorder : write the bytes read by a MidiKeyboard
+    into a file, with their time (see MidiKeyboard.set_recorder)"""
+
+    def __init__(self, file_name):
+        self._output = open(file_name, 'wb')
+        self._output.write(RECORD_MAGIC)
+        self._devices = {}
+        self._last = time.perf_counter()
+
+    def _write(self, number, data):
+        """_write
+
+        :param number: device number
+        :param data:
+        """
+        now = time.perf_counter()
+        delay = min(int((now - self._last) * 1e6), 0xFFFFFFFF)
+        self._last = now
+        self._output.write(RECORD_HEADER.pack(delay, number, len(data)))
+        self._output.write(data)
+
+    def __call__(self, path, data):
+        """__call__
+
+        :param path: device path
+        :param data: bytes read
+        """
+        number = self._devices.get(path)
+        if number is None:
+            number = self._devices[path] = len(self._devices)
+            self._write(RECORD_DEVICE, path.encode())
+        self._write(number, data)
+
+    def close(self):
+        """close"""
+        self._output.close()
+
+
+def read_records(file_name):
+    """read_records : iterate over the records of a MidiRecorder file
+
+    :param file_name:
+    :return: (seconds since the beginning, device number, bytes)
+    """
+    with open(file_name, 'rb') as record:
+        if record.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+            raise ValueError('%s is not a midi recording' % file_name)
+        elapsed = 0
+        header = record.read(RECORD_HEADER.size)
+        while len(header) == RECORD_HEADER.size:
+            (delay, number, size) = RECORD_HEADER.unpack(header)
+            elapsed += delay
+            data = record.read(size)
+            if number != RECORD_DEVICE:
+                yield (elapsed / 1e6, number, data)
+            header = record.read(RECORD_HEADER.size)
+
+
+def replay(file_name, fakes, speed=1.0):
+    """replay : send recorded bytes to fake devices
+
+    :param file_name: MidiRecorder file
+    :param fakes: FakeMidi for each recorded device (in order of appearance)
+    :param speed: 1.0 is real time, 0 is as fast as possible
+    :return: number of bytes sent
+    """
+    sent = 0
+    start = time.perf_counter()
+    for (elapsed, number, data) in read_records(file_name):
+        if speed:
+            delay = start + elapsed / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        fakes[number % len(fakes)].send(data)
+        sent += len(data)
+    return sent
+
+
+def record(file_name, paths):
+    """record : record midi devices until Ctrl+C
+
+    :param file_name:
+    :param paths: devices
+    """
+    from midiev import MidiKeyboard
+    recorder = MidiRecorder(file_name)
+    midikb = MidiKeyboard()
+    midikb.set_device(paths)
+    midikb.set_recorder(recorder)
+    midikb.start_thread()
+    print('recording %s into %s' % (' '.join(paths), file_name))
+    try:
+        while True:
+            midikb.read(None)
+    except KeyboardInterrupt:
+        pass
+    midikb.stop_thread()
+    recorder.close()
+
+
+def main():
+    """main"""
+    if sys.argv[1:2] == ['--record'] and len(sys.argv) > 3:
+        record(sys.argv[2], sys.argv[3:])
+        return
+    if sys.argv[1:2] == ['--replay'] and len(sys.argv) > 2:
+        args = sys.argv[3:]
+        speed = 1.0
+        if args[:1] == ['--fast']:
+            (speed, args) = (0, args[1:])
+        fakes = [FakeMidi(path) for path in args or [FAKE_DEVICE + '1']]
+        print('replay %s into %s' % (sys.argv[2], ' '.join(
+            fake.path for fake in fakes)))
+        try:
+            print('%d bytes sent' % replay(sys.argv[2], fakes, speed))
+        except KeyboardInterrupt:
+            pass
+        for fake in fakes:
+            fake.remove()
+        return
+    paths = sys.argv[1:] or [FAKE_DEVICE]
+    fakes = [FakeMidi(path) for path in paths]
+    print('waiting for readers on %s' % ' '.join(paths))
+    for fake in fakes:
+        fake.open()
+    try:
+        while True:
+            line = input().split()
+            if not line or line[0] == 'q':
+                break
+            fakes[int(line[0]) - 1].send([int(i, 16) for i in line[1:]])
+    except (EOFError, KeyboardInterrupt):
+        pass
+    for fake in fakes:
+        fake.remove()
+
+
+if __name__ == '__main__':
+    main()
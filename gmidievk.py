@@ -4,12 +4,14 @@ Gtk GUI to configure midievk
 Require xdotool, python3-tk
 """
 import logging
+from bisect import bisect_left
 from math import floor, log10
 from midiev import (MidiKeyboard, MIDITYPE,
                     CONTROLLER, NOTEON, NOTEOFF, CHANNEL)
 from midievk import MidiToXdo
-from options import (OPTIONS, NB_CTL_STEPS_IDX, get_all_midi_devices, DEVICE,
-                     CONFIG_FILE, CONFIG_FORMAT, CONFIG_LOADER, TITLE,
+import options
+from options import (OPTIONS, NB_CTL_STEPS_IDX, get_all_midi_devices,
+                     CONFIG_LOADER, TITLE,
                      NOTE_PRESSURE_MIDDLE_DELTA, NOTE_PRESSURE_STRONG_DELTA,
                      CTL_DECREASING)
 
@@ -34,16 +36,32 @@ GUI_DESC_MODE = {
 }
 
 
+# rows added to the treeview at each idle time, after a config is read
+RENDER_CHUNK = 200
+
+
 class TkWindow(tk.Frame):
-    """TkWindow"""
+    """TkWindow
+
+    The rows of the treeview are kept sorted in _rows (by channel, then
+    type), so that a new or changed row is moved to its place alone.
+    After a config is read, the rows are added to the treeview by chunks
+    at idle time (see _render_rows).
+    """
     _tree_selection = None
-    _tree_sort_order = [(0,False), (1,False)]
+    _tree_sort_columns = (1, 0)
+    _notify_fd = None
     midikb = None
 
     def __init__(self, parent):
         tk.Frame.__init__(self, parent)
         self.parent = parent
         self.midixdo = MidiToXdo()
+        self._rows = []         # sorted (values of sort columns..., midikey)
+        self._row_keys = {}     # midikey -> its item of _rows
+        self._row_values = {}   # midikey -> values shown in the treeview
+        self._rendered = 0      # rows of _rows already in the treeview
+        self._loading = False   # rows rendered after the configs are read
         self._programming_mode = tk.IntVar()
         # self._programming_mode_live = False
         self.init_gui()
@@ -110,7 +128,7 @@ class TkWindow(tk.Frame):
                 values=device_options,
             )
             cbox.pack(side='left', padx=5, pady=5)
-            cbox.set(DEVICE or device_options.split()[0])
+            cbox.set(options.DEVICE or device_options[0])
             cbox.bind("<<ComboboxSelected>>", self.connect_to_device)
         except IndexError:
             messagebox.showwarning(
@@ -133,52 +151,118 @@ class TkWindow(tk.Frame):
 
     def connect_to_device(self, event):
         """connect_to_device"""
+        previous = self.midikb
+        if previous is not None:
+            self._unwatch_midi_device()
+            previous.stop_thread()
         self.midikb = MidiKeyboard(self._cbox_device.get())
         self.midixdo.set_midi_device(self.midikb)
+        if previous is not None:
+            self.after(500, self.check_midi_device)
+
+    def _unwatch_midi_device(self):
+        """_unwatch_midi_device : stop waiting for the midi events"""
+        if self._notify_fd is not None:
+            self.tk.deletefilehandler(self._notify_fd)
+            self._notify_fd = None
 
-    def read_configs(self, file_format=CONFIG_FORMAT, file_name=CONFIG_FILE):
+    def read_configs(self, file_format=None, file_name=None):
         """read_configs
 
-        :param file_format:
+        :param file_format: CONFIG_LOADER key, from the extension by default
         :param file_name:
         """
-        if file_format in CONFIG_LOADER:
-            conf_exists = self.midixdo.read_configs(
-                file_format,
-                file_name,
-                config_line_process=self._gui_insert
-            )
+        if file_format is None or file_format in CONFIG_LOADER:
+            self._loading = True
+            try:
+                conf_exists = self.midixdo.read_configs(
+                    file_format,
+                    file_name,
+                    config_line_process=self._gui_insert
+                )
+            finally:
+                self._loading = False
             if not conf_exists:
                 self._programming_mode.set(1)
             else:
-                self.sort_treeview()
+                self.after_idle(self._render_rows)
 
-    def save_configs(self, file_format=CONFIG_FORMAT, file_name=CONFIG_FILE):
+    def save_configs(self, file_format=None, file_name=None):
         """save_configs
 
-        :param file_format:
+        :param file_format: CONFIG_LOADER key, from the extension by default
         :param file_name:
         """
         self.midixdo.save_configs(file_format, file_name)
 
-    def sort_treeview(self):
-        for i, r in self._tree_sort_order:
-            self.sort_treeview_column(i, reverse=r)
+    def _place(self, midikey, values):
+        """_place : put a row at its place in _rows
 
-    def sort_treeview_column(self, column, reverse=False):
-        """sort_treeview
+        :param midikey:
+        :param values: values shown in the treeview
+        :return: new index of the row, None if it did not move
+        """
+        self._row_values[midikey] = values
+        key = tuple(str(values[column])
+                    for column in self._tree_sort_columns) + (midikey,)
+        old = self._row_keys.get(midikey)
+        if old == key:
+            return None
+        if old is not None:
+            del self._rows[bisect_left(self._rows, old)]
+        index = bisect_left(self._rows, key)
+        self._rows.insert(index, key)
+        self._row_keys[midikey] = key
+        return index
+
+    def _render_rows(self, count=RENDER_CHUNK):
+        """_render_rows : add rows of _rows to the treeview, in order,
+        then go on at the next idle time
+
+        This is not a virtual list : ttk.Treeview has no virtual mode, and
+        rendering only the visible rows would break its scrollbar and see.
+        Every row ends in the treeview ; the window is shown after the first
+        chunk and stays responsive while the others are added.
+
+        :param count: number of rows, None for all the remaining rows
+        """
+        end = len(self._rows) if count is None else self._rendered + count
+        for key in self._rows[self._rendered:end]:
+            midikey = key[-1]
+            self._tree.insert('', 'end', midikey, tags=midikey,
+                              values=self._row_values[midikey])
+        self._rendered = min(end, len(self._rows))
+        if self._rendered < len(self._rows):
+            self.after_idle(self._render_rows)
+
+    def _set_row(self, midikey, values):
+        """_set_row : show a new or changed row at its place
 
-        :param column:
-        :param reverse:
+        :param midikey:
+        :param values:
         """
-        new_treeview = [
-            (self._tree.set(child, column), child)
-            for child in self._tree.get_children('')]
-        new_treeview.sort(reverse=reverse)
+        if self._rendered < len(self._rows):
+            self._render_rows(None)
+        exists = midikey in self._row_keys
+        index = self._place(midikey, values)
+        if not exists:
+            self._tree.insert('', index, midikey, tags=midikey, values=values)
+            self._rendered += 1
+            return
+        self._tree.item(midikey, values=values)
+        if index is not None:
+            self._tree.move(midikey, '', index)
 
-        # rearrange items in sorted positions
-        for index, (_, child) in enumerate(new_treeview):
-            self._tree.move(child, '', index)
+    def _set_cell(self, midikey, column, value):
+        """_set_cell
+
+        :param midikey:
+        :param column:
+        :param value:
+        """
+        values = list(self._row_values[midikey])
+        values[column] = value
+        self._set_row(midikey, tuple(values))
 
     def selected_item(self, tree_item):
         """selected_item
@@ -206,14 +290,12 @@ class TkWindow(tk.Frame):
             val = keybind_tab[-1]
         mod = mod or ''
         val = val or '<Undefined>'
-        self._tree.insert(
-            '', 'end', midikey, tags=midikey,
-            values="{} {} {} {}".format(
-                typ, key_note,
-                mod + val,
-                GUI_DESC_MODE[typ][keymode] if typ in GUI_DESC_MODE else ''
-            )
-        )
+        values = (typ, key_note, mod + val,
+                  GUI_DESC_MODE[typ][keymode] if typ in GUI_DESC_MODE else '')
+        if self._loading:
+            self._place(midikey, values)
+        else:
+            self._set_row(midikey, values)
 
     def _ins(self, midikey, values):
         """_ins
@@ -256,7 +338,7 @@ class TkWindow(tk.Frame):
             if keytype in GUI_DESC_MODE:
                 keyoption = self.midixdo.get_key_mode(key)
                 keyoption = int(not (keyoption or 0))
-                self._tree.set(tree_item, 3, GUI_DESC_MODE[keytype][keyoption])
+                self._set_cell(key, 3, GUI_DESC_MODE[keytype][keyoption])
                 self.midixdo.set_key_mode(key, keyoption)
 
     def _on_mouse_click(self, event):
@@ -311,11 +393,9 @@ class TkWindow(tk.Frame):
         :param modifier:
         :param key:
         """
-        self._tree.set(self._tree_selection, 2, modifier+key)
-        self.midixdo.set_keybind(
-            int(self._tree.item(self._tree_selection, option="tag")[0]),
-            modifier + key
-        )
+        midikey = int(self._tree.item(self._tree_selection, option="tag")[0])
+        self._set_cell(midikey, 2, modifier + key)
+        self.midixdo.set_keybind(midikey, modifier + key)
 
     def _update_type(self, midikey, name):
         """set_current_key
@@ -323,7 +403,7 @@ class TkWindow(tk.Frame):
         :param modifier:
         :param key:
         """
-        self._tree.set(midikey, 0, name)
+        self._set_cell(midikey, 0, name)
         self.midixdo.set_key_type(midikey, name)
 
     def update_keys_list(self, command, midikey):
@@ -359,30 +439,38 @@ class TkWindow(tk.Frame):
         else:
             self._update_type(midikey, name)
 
-        self.sort_treeview()
-
     def check_midi_device(self):
-        """check_midi_device"""
+        """check_midi_device : wait for the reader thread, then for midi
+        events (see on_midi_events)"""
         if self.midikb:
-            if self.midikb.is_running():
-                self.after(1, self.check_midi_device)
-            else:
+            if not self.midikb.is_running():
                 print("Midi device is currently not monitored")
                 self.after(1000, self.check_midi_device)
                 return
         else:
             print("Midi device disappeared")
             exit()
-        (command, key) = self.midixdo.parse_midi()
-        if key is not None:
+        self._unwatch_midi_device()
+        self._notify_fd = self.midikb.notify_fd()
+        self.tk.createfilehandler(
+            self._notify_fd, tk.READABLE, self.on_midi_events)
+        self.on_midi_events()
+
+    def on_midi_events(self, fd=None, mask=None):
+        """on_midi_events : handle every waiting midi event
+
+        :param fd: notify fd of the midi keyboard
+        :param mask:
+        """
+        self.midikb.clear_notify()
+        shown = None
+        for command in self.midikb.read_many(0):
+            (command, key) = self.midixdo.parse_command(command)
+            if key is None:
+                continue
             if self._programming_mode.get():
-                # print key, command
                 self.update_keys_list(command, key)
-                idx = self._tree.index(key)
-                treeitem = self._tree.get_children()
-                movement = float((idx - 5) / len(treeitem))
-                self._tree.yview('moveto', movement)
-                self._tree.selection_set(key)
+                shown = key
             else:
                 try:
                     self._tree.selection_set(key)
@@ -390,17 +478,26 @@ class TkWindow(tk.Frame):
                     pass
                 self.midixdo.send_keystroke(command, key)
             logging.debug('Key: %s %s', key, command)
+        if shown is not None:
+            # scroll once for a burst of events
+            idx = bisect_left(self._rows, self._row_keys[shown])
+            movement = float((idx - 5) / len(self._rows))
+            self._tree.yview('moveto', movement)
+            self._tree.selection_set(shown)
 
     def on_closing(self):
         """on_closing"""
         logging.debug('User want to close the app')
+        self._unwatch_midi_device()
         self.after(500, self.midikb.stop_thread)
+        self.after(500, self.midixdo.injector.close)
         self.after(1000, self.parent.destroy)
         logging.debug('Thanks for using this app :)')
 
 
 def main():
     """main"""
+    options.parse_argv()
     # logging.basicConfig(level=logging.DEBUG)
     logging.basicConfig(level=logging.INFO)
     root = tk.Tk()
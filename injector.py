@@ -0,0 +1,678 @@
+"""
+Keystroke injectors used by MidiToXdo.send_keystroke
+
+An injector receives a key event ('key', 'keydown' or 'keyup')
+and a keybind (e.g. 'Ctrl+a') and makes the system believe
+that the keyboard sent it.
+
+Keybinds are given to resolve once, when the keytable is compiled ;
+inject receives what resolve returned (the keybind itself for xdotool,
+key codes for XTest and uinput, None when the keybind is unknown).
+inject_many sends several key events, in order, with one call
+(see BatchInjector).
+"""
+import os
+import time
+import select
+import fcntl
+import struct
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import subprocess
+
+
+class XdoInjector(object):
+    """XdoInjector : run one xdotool process per key event"""
+
+    def __init__(self, command=('xdotool',)):
+        self._command = list(command)
+
+    def resolve(self, keybind):
+        """resolve
+
+        :param keybind: e.g. Ctrl+a
+        """
+        return keybind
+
+    def inject(self, keyevt, keybind):
+        """inject
+
+        :param keyevt: key, keydown or keyup
+        :param keybind:
+        """
+        try:
+            subprocess.Popen(self._command + [keyevt, keybind])
+        except OSError:
+            logging.error("Can't run %s", self._command[0])
+
+    def inject_many(self, events):
+        """inject_many : one xdotool process, commands are chained
+
+        :param events: [(keyevt, keybind)]
+        """
+        arguments = []
+        for event in events:
+            arguments.extend(event)
+        try:
+            subprocess.Popen(self._command + arguments)
+        except OSError:
+            logging.error("Can't run %s", self._command[0])
+
+    def close(self):
+        """close"""
+        pass
+
+
+# a line which makes xdotool write a line, sent by XdoPipeInjector
+# to check that xdotool does not wait for the end of the input
+PROBE_LINE = b'getmouselocation\n'
+PROBE_TIMEOUT = 1.0  # seconds
+
+
+class XdoPipeInjector(object):
+    """XdoPipeInjector : keep one `xdotool -` process
+    and write the key events on its standard input
+
+    Some xdotool versions read the whole script up to the end of file
+    before running it, and would send nothing until the injector is
+    closed : xdotool is started at once, and if it does not answer
+    PROBE_LINE within PROBE_TIMEOUT, each key event is sent by its own
+    xdotool process (XdoInjector) instead.
+    """
+
+    def __init__(self, command=('xdotool', '-')):
+        self._command = list(command)
+        self._process = None
+        self._fallback = XdoInjector(self._command[:-1])
+        self._buffered = False      # the probe failed, see _start
+        self._start()
+
+    def resolve(self, keybind):
+        """resolve
+
+        :param keybind: e.g. Ctrl+a
+        """
+        return keybind
+
+    def _start(self):
+        """_start : start xdotool, None if it can not run
+        the lines as soon as they are written"""
+        if self._buffered:
+            return None
+        try:
+            self._process = subprocess.Popen(
+                self._command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                bufsize=0)
+        except OSError:
+            logging.error("Can't run %s", ' '.join(self._command))
+            self._process = None
+            return None
+        if not self._probe():
+            logging.error("%s does not run the lines at once, "
+                          "use one xdotool process per key event",
+                          ' '.join(self._command))
+            self._buffered = True
+            self._process.kill()
+            self._process.wait()
+            self._process.stdin.close()
+            self._process.stdout.close()
+            self._process = None
+        return self._process
+
+    def _probe(self):
+        """_probe : tell if xdotool answers PROBE_LINE in time"""
+        try:
+            self._process.stdin.write(PROBE_LINE)
+        except (IOError, ValueError):
+            return False
+        stdout = self._process.stdout
+        (ready, _, _) = select.select([stdout], [], [], PROBE_TIMEOUT)
+        return bool(ready and stdout.readline())
+
+    def inject(self, keyevt, keybind):
+        """inject
+
+        :param keyevt: key, keydown or keyup
+        :param keybind:
+        """
+        if self._process is None or self._process.poll() is not None:
+            if self._start() is None:
+                self._fallback.inject(keyevt, keybind)
+                return
+        try:
+            self._process.stdin.write(
+                ("%s %s\n" % (keyevt, keybind)).encode())
+        except (IOError, ValueError):
+            logging.warning('xdotool pipe closed, fallback on xdotool')
+            self._process = None
+            self._fallback.inject(keyevt, keybind)
+
+    def inject_many(self, events):
+        """inject_many : the lines of all the key events in one write
+
+        :param events: [(keyevt, keybind)]
+        """
+        if self._process is None or self._process.poll() is not None:
+            if self._start() is None:
+                self._fallback.inject_many(events)
+                return
+        try:
+            self._process.stdin.write(
+                ''.join("%s %s\n" % event for event in events).encode())
+        except (IOError, ValueError):
+            logging.warning('xdotool pipe closed, fallback on xdotool')
+            self._process = None
+            self._fallback.inject_many(events)
+
+    def close(self):
+        """close"""
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+                self._process.wait(1)
+            except (IOError, subprocess.TimeoutExpired):
+                self._process.kill()
+            self._process.stdout.close()
+            self._process = None
+
+
+class AsyncXdoPipeInjector(object):
+    """AsyncXdoPipeInjector : `xdotool -` started from an asyncio loop,
+    inject only appends to the pipe buffer and never blocks the loop
+
+    As XdoPipeInjector, it falls back on one xdotool process per key
+    event if xdotool does not answer PROBE_LINE within PROBE_TIMEOUT.
+    """
+
+    def __init__(self, command=('xdotool', '-')):
+        self._command = list(command)
+        self._process = None
+        self._fallback = XdoInjector(self._command[:-1])
+
+    def resolve(self, keybind):
+        """resolve
+
+        :param keybind: e.g. Ctrl+a
+        """
+        return keybind
+
+    async def start(self):
+        """start : to be awaited before the first inject"""
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                *self._command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE)
+        except OSError:
+            logging.error("Can't run %s", ' '.join(self._command))
+            self._process = None
+            return None
+        self._process.stdin.write(PROBE_LINE)
+        try:
+            answered = await asyncio.wait_for(
+                self._process.stdout.readline(), PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            answered = False
+        if not answered:
+            logging.error("%s does not run the lines at once, "
+                          "use one xdotool process per key event",
+                          ' '.join(self._command))
+            self._process.kill()
+            await self._process.wait()
+            self._process = None
+        return self._process
+
+    def inject(self, keyevt, keybind):
+        """inject
+
+        :param keyevt: key, keydown or keyup
+        :param keybind:
+        """
+        if self._process is None or self._process.returncode is not None:
+            self._fallback.inject(keyevt, keybind)
+            return
+        self._process.stdin.write(("%s %s\n" % (keyevt, keybind)).encode())
+
+    def inject_many(self, events):
+        """inject_many
+
+        :param events: [(keyevt, keybind)]
+        """
+        if self._process is None or self._process.returncode is not None:
+            self._fallback.inject_many(events)
+            return
+        self._process.stdin.write(
+            ''.join("%s %s\n" % event for event in events).encode())
+
+    async def aclose(self):
+        """aclose : close and wait for the xdotool process"""
+        process = self._process
+        self.close()
+        if process is not None:
+            await process.wait()
+
+    def close(self):
+        """close"""
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process = None
+
+
+class FakeInjector(object):
+    """FakeInjector : keep key events in a list (tests and benchmarks)"""
+
+    def __init__(self, record=True):
+        self.record = record
+        self.events = []
+
+    def resolve(self, keybind):
+        """resolve
+
+        :param keybind: e.g. Ctrl+a
+        """
+        return keybind
+
+    def inject(self, keyevt, keybind):
+        """inject
+
+        :param keyevt: key, keydown or keyup
+        :param keybind:
+        """
+        if self.record:
+            self.events.append((keyevt, keybind))
+
+    def inject_many(self, events):
+        """inject_many
+
+        :param events: [(keyevt, keybind)]
+        """
+        if self.record:
+            self.events.extend(events)
+
+    def close(self):
+        """close"""
+        pass
+
+
+# modifier names of keybinds, as accepted by xdotool
+MODIFIER_KEYSYMS = {
+    'ctrl': 'Control_L',
+    'control': 'Control_L',
+    'alt': 'Alt_L',
+    'shift': 'Shift_L',
+    'super': 'Super_L',
+    'meta': 'Meta_L',
+}
+
+
+def split_keybind(keybind):
+    """split_keybind : key names of a keybind, e.g. Ctrl+Alt+a
+
+    :param keybind:
+    """
+    return [name for name in keybind.split('+') if name]
+
+
+def press_release(keyevt, keys):
+    """press_release : (key, pressed) to send for a key event,
+    modifiers are pressed first and released last
+
+    :param keyevt: key, keydown or keyup
+    :param keys: resolved keys, modifiers first
+    """
+    if keyevt == 'keydown':
+        return [(key, True) for key in keys]
+    if keyevt == 'keyup':
+        return [(key, False) for key in reversed(keys)]
+    return ([(key, True) for key in keys] +
+            [(key, False) for key in reversed(keys)])
+
+
+class XTestInjector(object):
+    """XTestInjector : send key events straight to the X server
+    with the XTest extension (libX11 and libXtst through ctypes)"""
+
+    def __init__(self, display=None):
+        xlib = ctypes.util.find_library('X11')
+        xtst = ctypes.util.find_library('Xtst')
+        if not (xlib and xtst):
+            raise OSError('libX11 and libXtst are required')
+        self._xlib = ctypes.CDLL(xlib)
+        self._xtst = ctypes.CDLL(xtst)
+        self._xlib.XOpenDisplay.restype = ctypes.c_void_p
+        self._xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        self._xlib.XStringToKeysym.restype = ctypes.c_ulong
+        self._xlib.XStringToKeysym.argtypes = [ctypes.c_char_p]
+        self._xlib.XKeysymToKeycode.restype = ctypes.c_ubyte
+        self._xlib.XKeysymToKeycode.argtypes = [ctypes.c_void_p,
+                                                ctypes.c_ulong]
+        self._xlib.XFlush.argtypes = [ctypes.c_void_p]
+        self._xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        self._xtst.XTestFakeKeyEvent.argtypes = [
+            ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong]
+        self._display = self._xlib.XOpenDisplay(
+            display.encode() if display else None)
+        if not self._display:
+            raise OSError("Can't open the X display")
+
+    def _keycode(self, name):
+        """_keycode : keycode of a key name, 0 if unknown
+
+        :param name:
+        """
+        name = MODIFIER_KEYSYMS.get(name.lower(), name)
+        keysym = self._xlib.XStringToKeysym(name.encode())
+        if not keysym and len(name) > 1:
+            keysym = self._xlib.XStringToKeysym(name.capitalize().encode())
+        if not keysym:
+            return 0
+        return self._xlib.XKeysymToKeycode(self._display, keysym)
+
+    def resolve(self, keybind):
+        """resolve : keycodes of a keybind, None if a key is unknown
+
+        :param keybind: e.g. Ctrl+a
+        """
+        keycodes = tuple(self._keycode(name)
+                         for name in split_keybind(keybind))
+        if not keycodes or 0 in keycodes:
+            logging.warning("Unknown keybind %s", keybind)
+            return None
+        return keycodes
+
+    def inject(self, keyevt, keycodes):
+        """inject
+
+        :param keyevt: key, keydown or keyup
+        :param keycodes: see resolve
+        """
+        for (keycode, pressed) in press_release(keyevt, keycodes):
+            self._xtst.XTestFakeKeyEvent(self._display, keycode, pressed, 0)
+        self._xlib.XFlush(self._display)
+
+    def inject_many(self, events):
+        """inject_many : one flush for all the key events
+
+        :param events: [(keyevt, keycodes)]
+        """
+        for (keyevt, keycodes) in events:
+            if keycodes is None:
+                continue
+            for (keycode, pressed) in press_release(keyevt, keycodes):
+                self._xtst.XTestFakeKeyEvent(self._display, keycode,
+                                             pressed, 0)
+        self._xlib.XFlush(self._display)
+
+    def close(self):
+        """close"""
+        if self._display:
+            self._xlib.XCloseDisplay(self._display)
+            self._display = None
+
+
+# linux/uinput.h and linux/input-event-codes.h
+UINPUT_DEVICE = '/dev/uinput'
+UI_DEV_CREATE = 0x5501
+UI_DEV_DESTROY = 0x5502
+UI_DEV_SETUP = 0x405c5503
+UI_SET_EVBIT = 0x40045564
+UI_SET_KEYBIT = 0x40045565
+BUS_VIRTUAL = 0x06
+EV_SYN = 0x00
+EV_KEY = 0x01
+SYN_REPORT = 0
+INPUT_EVENT = struct.Struct('llHHi')
+UINPUT_SETUP = struct.Struct('HHHH80sI')
+# keycodes of X keysym names (lower case)
+UINPUT_KEYS = dict(
+    [(c, code) for (code, c) in enumerate('1234567890', 2)] +
+    [(c, code) for (code, c) in enumerate('qwertyuiop', 16)] +
+    [(c, code) for (code, c) in enumerate('asdfghjkl', 30)] +
+    [(c, code) for (code, c) in enumerate('zxcvbnm', 44)] +
+    [('f%d' % n, code) for (code, n) in enumerate(range(1, 11), 59)] + [
+        ('f11', 87), ('f12', 88),
+        ('escape', 1), ('minus', 12), ('equal', 13), ('backspace', 14),
+        ('tab', 15), ('bracketleft', 26), ('bracketright', 27),
+        ('return', 28), ('enter', 28), ('semicolon', 39),
+        ('apostrophe', 40), ('grave', 41), ('backslash', 43),
+        ('comma', 51), ('period', 52), ('slash', 53), ('space', 57),
+        ('caps_lock', 58), ('num_lock', 69), ('scroll_lock', 70),
+        ('home', 102), ('up', 103), ('page_up', 104), ('prior', 104),
+        ('left', 105), ('right', 106), ('end', 107), ('down', 108),
+        ('page_down', 109), ('next', 109), ('insert', 110),
+        ('delete', 111), ('pause', 119), ('menu', 139), ('print', 210),
+        ('xf86audiomute', 113), ('xf86audiolowervolume', 114),
+        ('xf86audioraisevolume', 115), ('xf86audionext', 163),
+        ('xf86audioplay', 164), ('xf86audioprev', 165),
+        ('control_l', 29), ('control_r', 97), ('shift_l', 42),
+        ('shift_r', 54), ('alt_l', 56), ('alt_r', 100),
+        ('super_l', 125), ('super_r', 126), ('meta_l', 125),
+    ])
+
+
+class UinputInjector(object):
+    """UinputInjector : a virtual keyboard created with /dev/uinput,
+    read by the kernel as any keyboard (X11, Wayland, console)"""
+
+    def __init__(self, device=UINPUT_DEVICE):
+        self._fd = os.open(device, os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            fcntl.ioctl(self._fd, UI_SET_EVBIT, EV_KEY)
+            for keycode in set(UINPUT_KEYS.values()):
+                fcntl.ioctl(self._fd, UI_SET_KEYBIT, keycode)
+            fcntl.ioctl(self._fd, UI_DEV_SETUP, UINPUT_SETUP.pack(
+                BUS_VIRTUAL, 0x1209, 0x4d4b, 1, b'midievk', 0))
+            fcntl.ioctl(self._fd, UI_DEV_CREATE)
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def resolve(self, keybind):
+        """resolve : keycodes of a keybind, None if a key is unknown
+
+        :param keybind: e.g. Ctrl+a
+        """
+        keycodes = []
+        for name in split_keybind(keybind):
+            name = MODIFIER_KEYSYMS.get(name.lower(), name)
+            if len(name) == 1 and name.isupper():
+                keycodes.append(UINPUT_KEYS['shift_l'])
+            keycode = UINPUT_KEYS.get(name.lower())
+            if keycode is None:
+                logging.warning("Unknown keybind %s", keybind)
+                return None
+            keycodes.append(keycode)
+        return tuple(keycodes) or None
+
+    def inject(self, keyevt, keycodes):
+        """inject
+
+        :param keyevt: key, keydown or keyup
+        :param keycodes: see resolve
+        """
+        self.inject_many([(keyevt, keycodes)])
+
+    def inject_many(self, events):
+        """inject_many : the input events of all the key events
+        in one write
+
+        :param events: [(keyevt, keycodes)]
+        """
+        now = time.time()
+        (sec, usec) = (int(now), int(now % 1 * 1e6))
+        data = []
+        for (keyevt, keycodes) in events:
+            if keycodes is None:
+                continue
+            for (keycode, pressed) in press_release(keyevt, keycodes):
+                data.append(INPUT_EVENT.pack(sec, usec, EV_KEY, keycode,
+                                             int(pressed)))
+                data.append(INPUT_EVENT.pack(sec, usec, EV_SYN,
+                                             SYN_REPORT, 0))
+        if data:
+            os.write(self._fd, b''.join(data))
+
+    def close(self):
+        """close"""
+        if self._fd is not None:
+            fcntl.ioctl(self._fd, UI_DEV_DESTROY)
+            os.close(self._fd)
+            self._fd = None
+
+
+class BatchInjector(object):
+    """BatchInjector : keep the key events given to another injector
+    during a short window, then send them in order with one inject_many
+
+    The window starts with the first pending event ; the dispatcher calls
+    flush when it is over (see MidiToXdo.flush_pending).
+    """
+
+    def __init__(self, injector, window):
+        """__init__
+
+        :param injector:
+        :param window: seconds
+        """
+        self.injector = injector
+        self.window = window
+        self._pending = []
+        self._since = 0
+
+    def resolve(self, keybind):
+        """resolve
+
+        :param keybind: e.g. Ctrl+a
+        """
+        return self.injector.resolve(keybind)
+
+    def inject(self, keyevt, resolved):
+        """inject
+
+        :param keyevt: key, keydown or keyup
+        :param resolved: see resolve
+        """
+        now = time.perf_counter()
+        if self._pending and now - self._since >= self.window:
+            self.flush()
+        if not self._pending:
+            self._since = now
+        self._pending.append((keyevt, resolved))
+
+    def inject_many(self, events):
+        """inject_many
+
+        :param events: [(keyevt, resolved)]
+        """
+        for (keyevt, resolved) in events:
+            self.inject(keyevt, resolved)
+
+    def deadline(self):
+        """deadline : time when the pending events have to be sent,
+        None if there are none"""
+        if self._pending:
+            return self._since + self.window
+        return None
+
+    def flush(self, now=None):
+        """flush : send the pending events
+
+        :param now: only if their window is over, when given
+        """
+        if not self._pending:
+            return
+        if now is not None and now < self._since + self.window:
+            return
+        pending = self._pending
+        self._pending = []
+        self.injector.inject_many(pending)
+
+    async def start(self):
+        """start : start the injector from an asyncio loop,
+        see AsyncXdoPipeInjector.start"""
+        if hasattr(self.injector, 'start'):
+            return await self.injector.start()
+        return None
+
+    async def aclose(self):
+        """aclose : send the pending events, then close the injector
+        from an asyncio loop"""
+        self.flush()
+        if hasattr(self.injector, 'aclose'):
+            await self.injector.aclose()
+        else:
+            self.injector.close()
+
+    def close(self):
+        """close"""
+        self.flush()
+        self.injector.close()
+
+
+INJECTORS = {
+    'xdotool': XdoInjector,
+    'xdotool-pipe': XdoPipeInjector,
+    'xtest': XTestInjector,
+    'uinput': UinputInjector,
+    'null': lambda: FakeInjector(record=False),
+}
+# used instead of INJECTORS from an asyncio loop
+ASYNC_INJECTORS = {
+    'xdotool-pipe': AsyncXdoPipeInjector,
+}
+
+
+def new_injector(name, batch_window=0, asynchronous=False):
+    """new_injector
+
+    :param name: one of INJECTORS keys
+    :param batch_window: seconds during which key events are gathered
+                         (see BatchInjector), 0 sends them at once
+    :param asynchronous: started from an asyncio loop, see ASYNC_INJECTORS
+    """
+    if name not in INJECTORS:
+        logging.error("Unknown injector %s, use xdotool", name)
+        name = 'xdotool'
+    try:
+        if asynchronous and name in ASYNC_INJECTORS:
+            injector = ASYNC_INJECTORS[name]()
+        else:
+            injector = INJECTORS[name]()
+    except OSError as error:
+        logging.error("Can't use the %s injector (%s), use xdotool",
+                      name, error)
+        injector = XdoInjector()
+    if batch_window > 0:
+        return BatchInjector(injector, batch_window)
+    return injector
+
+
+async def aclose_injector(injector):
+    """aclose_injector : close an injector from an asyncio loop
+
+    :param injector:
+    """
+    if hasattr(injector, 'aclose'):
+        await injector.aclose()
+    else:
+        injector.close()
+
+
+def async_injector(injector):
+    """async_injector : the asyncio version of an injector made by
+    new_injector, the injector itself when it has none
+
+    :param injector:
+    """
+    if isinstance(injector, BatchInjector):
+        inner = async_injector(injector.injector)
+        if inner is injector.injector:
+            return injector
+        return BatchInjector(inner, injector.window)
+    if type(injector) is XdoPipeInjector:
+        return AsyncXdoPipeInjector(injector._command)
+    return injector
@@ -17,3 +17,18 @@ def setInterval(function):
         t.start()
         return stopped
     return wrapper
+
+
+def setPeriod(seconds, function, *args, **kwargs):
+    """call function every seconds in another thread,
+    until the returned event is set"""
+    stopped = threading.Event()
+
+    def loop():  # executed in another thread
+        while not stopped.wait(seconds):  # until stopped
+            function(*args, **kwargs)
+
+    t = threading.Thread(target=loop)
+    t.daemon = True  # stop if the program exits
+    t.start()
+    return stopped
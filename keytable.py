@@ -0,0 +1,226 @@
+"""
+Keytable of MidiToXdo : the binding of each hexcode
+(pressure or step << 12 | miditype << 4 | channel),
+with its type, channel, keybind and mode
+
+The hexcodes fit in 16 bits : a dense array gives the row of a hexcode,
+and each field is kept in its own column (keybinds and types are
+interned strings, channels and modes are bytes) instead of a dict
+for each binding.
+"""
+import sys
+from array import array
+
+# hexcodes indexed by the dense array, others are kept in a dict
+DENSE_KEYS = 1 << 16
+# rows are stored + 1 in the dense array, 0 is no row
+MAX_DENSE_ROWS = (1 << 16) - 2
+FIELDS = ('type', 'channel', 'keybind', 'mode')
+# keybind of the keys not bound yet, in the configurator
+UNDEFINED_KEYBIND = '<Undefined>'
+
+
+def intern(string):
+    """intern : one copy of each keybind or type
+
+    :param string: str or None
+    """
+    return None if string is None else sys.intern(string)
+
+
+def check_entry(values):
+    """check_entry : a keytable entry of a config file, with all its fields,
+    None if it can not be used (no type or channel, no keybind)
+
+    :param values: {type, channel, keybind, mode}
+    """
+    keytype = values.get('type')
+    channel = values.get('channel')
+    keybind = values.get('keybind')
+    if not isinstance(keytype, str) or not isinstance(channel, int):
+        return None
+    if not isinstance(keybind, str) or keybind in ('', UNDEFINED_KEYBIND):
+        return None
+    return {'type': keytype, 'channel': channel, 'keybind': keybind,
+            'mode': int(values.get('mode') or 0)}
+
+
+class KeyEntry(object):
+    """KeyEntry : the binding of a hexcode,
+    read and written as a dict {type, channel, keybind, mode}"""
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, field):
+        return self._table.get_field(self._row, field)
+
+    def __setitem__(self, field, value):
+        self._table.set_field(self._row, field, value)
+
+    def __contains__(self, field):
+        return field in FIELDS
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def get(self, field, default=None):
+        """get
+
+        :param field:
+        :param default:
+        """
+        return self[field] if field in FIELDS else default
+
+    def keys(self):
+        """keys"""
+        return list(FIELDS)
+
+    def items(self):
+        """items"""
+        return [(field, self[field]) for field in FIELDS]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class KeyTable(object):
+    """KeyTable : hexcode -> KeyEntry, used as a dict of dicts"""
+
+    def __init__(self):
+        self._index = array('H')   # hexcode -> row + 1, grown on demand
+        self._overflow = {}        # hexcode -> row, for the others
+        self._keys = []
+        self._types = []
+        self._channels = array('B')
+        self._keybinds = []
+        self._modes = array('B')
+
+    def _row(self, key):
+        """_row : row of a hexcode, None if it is not in the table
+
+        :param key:
+        """
+        if 0 <= key < len(self._index):
+            row = self._index[key] - 1
+            return row if row >= 0 else None
+        return self._overflow.get(key)
+
+    def _new_row(self, key):
+        """_new_row
+
+        :param key:
+        """
+        row = len(self._keys)
+        if 0 <= key < DENSE_KEYS and row < MAX_DENSE_ROWS:
+            if key >= len(self._index):
+                self._index.extend([0] * (key + 1 - len(self._index)))
+            self._index[key] = row + 1
+        else:
+            self._overflow[key] = row
+        self._keys.append(key)
+        self._types.append(None)
+        self._channels.append(0)
+        self._keybinds.append(None)
+        self._modes.append(0)
+        return row
+
+    def get_field(self, row, field):
+        """get_field
+
+        :param row:
+        :param field: one of FIELDS
+        """
+        if field == 'keybind':
+            return self._keybinds[row]
+        if field == 'mode':
+            return self._modes[row]
+        if field == 'channel':
+            return self._channels[row]
+        if field == 'type':
+            return self._types[row]
+        raise KeyError(field)
+
+    def set_field(self, row, field, value):
+        """set_field
+
+        :param row:
+        :param field: one of FIELDS
+        :param value:
+        """
+        if field == 'keybind':
+            self._keybinds[row] = intern(value)
+        elif field == 'mode':
+            self._modes[row] = int(value or 0)
+        elif field == 'channel':
+            self._channels[row] = value
+        elif field == 'type':
+            self._types[row] = intern(value)
+        else:
+            raise KeyError(field)
+
+    def keybind(self, key):
+        """keybind : keybind of a hexcode, None if it is not bound
+
+        :param key:
+        """
+        if 0 <= key < len(self._index):
+            row = self._index[key]
+            return self._keybinds[row - 1] if row else None
+        row = self._overflow.get(key)
+        return None if row is None else self._keybinds[row]
+
+    def mode(self, key):
+        """mode
+
+        :param key:
+        """
+        row = self._row(key)
+        return None if row is None else self._modes[row]
+
+    def __contains__(self, key):
+        return self._row(key) is not None
+
+    def __getitem__(self, key):
+        row = self._row(key)
+        if row is None:
+            raise KeyError(key)
+        return KeyEntry(self, row)
+
+    def __setitem__(self, key, values):
+        row = self._row(key)
+        if row is None:
+            row = self._new_row(key)
+        self._types[row] = intern(values.get('type'))
+        self._channels[row] = values.get('channel') or 0
+        self._keybinds[row] = intern(values.get('keybind'))
+        self._modes[row] = int(values.get('mode') or 0)
+
+    def get(self, key, default=None):
+        """get
+
+        :param key:
+        :param default:
+        """
+        row = self._row(key)
+        return default if row is None else KeyEntry(self, row)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        """keys"""
+        return list(self._keys)
+
+    def items(self):
+        """items"""
+        return [(key, KeyEntry(self, row))
+                for (row, key) in enumerate(self._keys)]
@@ -0,0 +1,893 @@
+#!/usr/bin/python3
+"""
+midievk benchmarks
+
+Run without any midi keyboard : events are written into fifos
+created in /tmp/fakemidi* (accepted as devices by options.parse_argv).
+Keystrokes go to a null injector.
+
+Usage : ./midibench.py [recording ...]
+recordings made with `./fakemidi.py --record` are replayed
+through a fifo as fast as possible.
+"""
+import io
+import os
+import contextlib
+import tracemalloc
+import sys
+import time
+import subprocess
+import random
+import threading
+from shutil import which
+from midiev import MidiKeyboard, MidiParser, NOTEON, NOTEOFF, CONTROLLER
+from midiev import AFTERTOUCH, PITCHBEND, SYSEX, SYSEX_END, REALTIME
+from midiev import READ_TIMEOUT, MIDITYPE, CHANNEL, VELOCITY
+from midiev import CONTROLLER_VALUE
+from midievk import MidiToXdo, ABS_DELTA, split_ctl_value
+from options import OPTIONS, NB_CTL_STEPS_IDX, NOTE_PRESSURE_MIDDLE_IDX
+from options import NOTE_PRESSURE_STRONG_IDX, NOTE_PRESSURE_MIDDLE_DELTA
+from options import NOTE_PRESSURE_STRONG_DELTA, CTL_VALUE_MIDDLE_MIN_IDX
+from options import CTL_VALUE_MIDDLE_MAX_IDX, CTL_INCREASING, CTL_DECREASING
+from options import save_config, load_config
+from fakemidi import make_fifo, FakeMidi, read_records, replay
+from injector import XdoInjector, XdoPipeInjector, FakeInjector
+from injector import XTestInjector, UinputInjector, BatchInjector
+from keytable import KeyTable
+
+FAKE_DEVICE = '/tmp/fakemidi-bench'
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class RecordingMidiToXdo(MidiToXdo):
+    """MidiToXdo keeping dispatch times instead of sending keystrokes"""
+
+    def __init__(self):
+        MidiToXdo.__init__(self)
+        self.dispatched = threading.Event()
+        self.dispatch_time = None
+
+    def send_keystroke(self, midikey, hexkey):
+        self.dispatch_time = time.perf_counter()
+        self.dispatched.set()
+
+
+def bench_dispatch(read_timeout, idle=2.0, nb_events=200, name='dispatch'):
+    """bench_dispatch : idle cpu and event-to-dispatch latency
+
+    :param read_timeout: MidiToXdo.read_timeout (0 is the polling mode)
+    :param idle: seconds spent without midi traffic
+    :param nb_events: number of note-on sent to measure latency
+    :param name: suffix of the fifo
+    """
+    device = make_fifo(FAKE_DEVICE + '-' + name)
+    midikb = MidiKeyboard(device)
+    # opening for writing blocks until the reader thread opened the fifo
+    writer = open(device, 'wb', buffering=0)
+    midixdo = RecordingMidiToXdo()
+    midixdo.read_timeout = read_timeout
+    midixdo.set_midi_device(midikb)
+    stopped = midixdo.loop_midi_device()
+    midikb.wait_running(1)
+
+    cpu = time.process_time()
+    time.sleep(idle)
+    cpu = time.process_time() - cpu
+
+    latencies = []
+    for i in range(nb_events):
+        midixdo.dispatched.clear()
+        start = time.perf_counter()
+        writer.write(bytes([NOTEON, i % 128, 100]))
+        if midixdo.dispatched.wait(1):
+            latencies.append(midixdo.dispatch_time - start)
+    stopped.set()
+    midikb.stop_thread()
+    writer.close()
+    latencies.sort()
+    return {
+        'idle_cpu': cpu / idle,
+        'p50': latencies[len(latencies) // 2],
+        'max': latencies[-1],
+    }
+
+
+def bench_injector(injector, nb_events=200):
+    """bench_injector : mean time spent in injector.inject
+
+    :param injector:
+    :param nb_events:
+    """
+    keys = injector.resolve('a')
+    injector.inject('keyup', keys)  # start persistent processes
+    start = time.perf_counter()
+    for i in range(nb_events):
+        injector.inject('keydown' if i % 2 else 'keyup', keys)
+    return (time.perf_counter() - start) / nb_events
+
+
+def bench_send_keystroke(injector, nb_events=200):
+    """bench_send_keystroke : mean time of MidiToXdo.send_keystroke,
+    from a note to the keystroke sent by injector
+
+    :param injector:
+    :param nb_events:
+    """
+    midixdo = keytable_midixdo()
+    midixdo.set_injector(injector)
+    messages = [(NOTEON if i % 2 else NOTEOFF, 60, 100)
+                for i in range(nb_events)]
+    commands = [midixdo.parse_command(message) for message in messages]
+    start = time.perf_counter()
+    for (command, hexcode) in commands:
+        midixdo.send_keystroke(command, hexcode)
+    return (time.perf_counter() - start) / nb_events
+
+
+class TimedInjector(object):
+    """TimedInjector : injector keeping the time each key event is sent"""
+
+    def __init__(self, injector):
+        self.injector = injector
+        self.times = []
+
+    def resolve(self, keybind):
+        return self.injector.resolve(keybind)
+
+    def inject(self, keyevt, resolved):
+        self.injector.inject(keyevt, resolved)
+        self.times.append(time.perf_counter())
+
+    def inject_many(self, events):
+        self.injector.inject_many(events)
+        self.times.extend([time.perf_counter()] * len(events))
+
+    def close(self):
+        self.injector.close()
+
+
+def bench_batching(new, window, nb_bursts=500, burst=4):
+    """bench_batching : a storm of chords (burst notes on, then off)
+    through process_batch, as read by the dispatcher ;
+    return (key events/s, p50 and max latency from the read to the key event
+    sent)
+
+    :param new: injector factory
+    :param window: BatchInjector window in seconds, 0 without batching
+    :param nb_bursts:
+    :param burst: notes of each chord
+    """
+    timed = TimedInjector(new())
+    injector = BatchInjector(timed, window) if window else timed
+    midixdo = keytable_midixdo()
+    midixdo.set_injector(injector)
+    injector.inject('keyup', injector.resolve('a'))  # start processes
+    latencies = []
+    start = time.perf_counter()
+    for i in range(nb_bursts):
+        notes = [(i + n * 32) % 128 for n in range(burst)]
+        for status in (NOTEON, NOTEOFF):
+            stamp = time.perf_counter()
+            sent = len(timed.times)
+            midixdo.process_batch([('bench', (status, note, 100), stamp)
+                                   for note in notes])
+            # the dispatcher waits for the end of the window
+            while midixdo.flush_deadline() is not None:
+                midixdo.flush_pending()
+            latencies.extend(sent_time - stamp
+                             for sent_time in timed.times[sent:])
+    elapsed = time.perf_counter() - start
+    injector.close()
+    latencies.sort()
+    return (len(latencies) / elapsed,
+            latencies[len(latencies) // 2], latencies[-1])
+
+
+def injectors():
+    """injectors : injectors to compare, xdotool, xtest and uinput
+    are compared when they can be used (a stand-in for xdotool
+    would tell nothing about the xdotool pipe)"""
+    found = []
+    if which('xdotool'):
+        found = [('xdotool', XdoInjector),
+                 ('xdotool-pipe', XdoPipeInjector)]
+    else:
+        print("xdotool is not installed, the xdotool injectors "
+              "are not measured")
+    for (name, injector) in (('xtest', XTestInjector),
+                             ('uinput', UinputInjector)):
+        try:
+            injector().close()
+        except OSError:
+            continue
+        found.append((name, injector))
+    return found + [('null', lambda: FakeInjector(record=False))]
+
+
+def midi_stream(size, seed=0):
+    """midi_stream : notes, controller sweeps using running status,
+    sysex and clock bytes
+
+    :param size: approximative size in bytes
+    :param seed:
+    """
+    rand = random.Random(seed)
+    stream = bytearray()
+    while len(stream) < size:
+        kind = rand.random()
+        if kind < 0.4:
+            stream += bytes([NOTEON, rand.randrange(128), rand.randrange(128)])
+        elif kind < 0.8:
+            stream.append(CONTROLLER)
+            for value in range(0, 128, 4):
+                stream += bytes([7, value])  # running status
+        elif kind < 0.9:
+            stream.append(SYSEX)
+            stream += bytes(rand.randrange(128) for _ in range(32))
+            stream.append(SYSEX_END)
+        else:
+            stream.append(REALTIME)
+    return bytes(stream)
+
+
+def legacy_parse(stream):
+    """legacy_parse : byte per byte reading, as done before MidiParser
+
+    :param stream:
+    """
+    midiinput = io.BytesIO(stream)
+    messages = []
+    data = midiinput.read(1)
+    while data:
+        data = ord(data)
+        if data in MidiKeyboard.miditable:
+            message = [data, ord(midiinput.read(1) or b'\0')]
+            if MidiKeyboard.miditable[data] == 2:
+                message.append(ord(midiinput.read(1) or b'\0'))
+            messages.append(message)
+        data = midiinput.read(1)
+    return messages
+
+
+def bench_parser(stream, chunk=4096):
+    """bench_parser : return (MB/s, messages/s) of MidiParser
+
+    :param stream:
+    :param chunk: size of each read
+    """
+    parser = MidiParser(chunk)
+    view = memoryview(stream)
+    nb_messages = 0
+    start = time.perf_counter()
+    for offset in range(0, len(stream), chunk):
+        nb_messages += len(parser.feed(view[offset:offset + chunk]))
+    elapsed = time.perf_counter() - start
+    return (len(stream) / elapsed / 1e6, nb_messages / elapsed)
+
+
+def bench_legacy_parser(stream):
+    """bench_legacy_parser : return (MB/s, messages/s) of legacy_parse
+
+    :param stream:
+    """
+    start = time.perf_counter()
+    nb_messages = len(legacy_parse(stream))
+    elapsed = time.perf_counter() - start
+    return (len(stream) / elapsed / 1e6, nb_messages / elapsed)
+
+
+class ListKeyboard(object):
+    """ListKeyboard : MidiKeyboard replaying a list of messages"""
+
+    def __init__(self, messages):
+        self._messages = iter(messages)
+
+    def read(self, timeout=0):
+        """read
+
+        :param timeout: unused
+        """
+        return next(self._messages, False)
+
+
+def keytable_midixdo(ctl_steps=10):
+    """keytable_midixdo : MidiToXdo with a keybind on every note and pot
+
+    :param ctl_steps: --ctl-steps option
+    """
+    OPTIONS[NB_CTL_STEPS_IDX] = ctl_steps
+    OPTIONS[NOTE_PRESSURE_MIDDLE_IDX] = 40
+    midixdo = MidiToXdo(FakeInjector(record=False))
+    for note in range(128):
+        for level in (0, 2, 3):
+            midixdo.insert((level << 12) | NOTEON << 4 | note, {
+                'type': 'Note-on', 'channel': note,
+                'keybind': 'a', 'mode': 0})
+    for ctl in range(128):
+        for step in range(1, ctl_steps + 1):
+            midixdo.insert((step << 12) | CONTROLLER << 4 | ctl, {
+                'type': 'CC', 'channel': ctl,
+                'keybind': 'b', 'mode': 1})
+    return midixdo
+
+
+def dispatch_workload(nb_events, seed=0):
+    """dispatch_workload : note-on/note-off pairs and controller sweeps
+
+    :param nb_events:
+    :param seed:
+    """
+    rand = random.Random(seed)
+    messages = []
+    while len(messages) < nb_events:
+        note = rand.randrange(128)
+        messages.append((NOTEON, note, rand.randrange(1, 128)))
+        messages.append((NOTEON, note, 0))
+        ctl = rand.randrange(128)
+        messages.extend((CONTROLLER, ctl, value) for value in range(0, 128, 8))
+    return messages
+
+
+class LegacyMidiToXdo(MidiToXdo):
+    """LegacyMidiToXdo : parse_midi and send_keystroke as done before
+    the dispatch tables (if/elif on the message type, OPTIONS read
+    for each event, keytable of dicts), to compare with"""
+
+    def __init__(self, midixdo):
+        MidiToXdo.__init__(self, midixdo.injector)
+        self._legacy_values = dict(
+            (key, dict(values.items()))
+            for (key, values) in midixdo._midi_values.items())
+
+    def parse_midi(self, timeout=0):
+        """parse_midi
+
+        :param timeout:
+        """
+        command = self.midikb.read(timeout)
+        if not command:
+            return (None, None)
+        miditype = command[MIDITYPE]
+        channel = command[CHANNEL]
+        hexcode = None
+        if miditype == NOTEOFF:
+            hexcode = (NOTEOFF << 4 | channel)
+        elif miditype == NOTEON:
+            vel = command[VELOCITY]
+            if vel == 0:
+                hexcode = (NOTEOFF << 4 | channel)
+                command = (NOTEOFF, channel, vel)
+            else:
+                hexcode = (NOTEON << 4 | channel)
+                if vel > OPTIONS[NOTE_PRESSURE_MIDDLE_IDX]:
+                    if vel > OPTIONS[NOTE_PRESSURE_STRONG_IDX]:
+                        hexcode = hexcode | NOTE_PRESSURE_STRONG_DELTA << 12
+                    else:
+                        hexcode = hexcode | NOTE_PRESSURE_MIDDLE_DELTA << 12
+        elif miditype == CONTROLLER:
+            hexcode = (CONTROLLER << 4 | channel)
+            ctlval = command[CONTROLLER_VALUE]
+            if OPTIONS[NB_CTL_STEPS_IDX] != 0:
+                hexcode = hexcode | (split_ctl_value(ctlval) << 12)
+            else:
+                nhexcode = None
+                if ctlval == 0:
+                    nhexcode = hexcode | CTL_DECREASING << 12
+                elif ctlval == 127:
+                    nhexcode = hexcode | CTL_INCREASING << 12
+                elif hexcode in self._midi_ctl_values:
+                    prevctlval = self._midi_ctl_values[hexcode]
+                    if ctlval == prevctlval:
+                        nhexcode = hexcode
+                    elif ctlval < prevctlval:
+                        nhexcode = hexcode | CTL_DECREASING << 12
+                    else:
+                        nhexcode = hexcode | CTL_INCREASING << 12
+                self._midi_ctl_values[hexcode] = ctlval
+                hexcode = nhexcode
+        return (command, hexcode)
+
+    def send_keystroke(self, midikey, hexkey):
+        """send_keystroke
+
+        :param midikey:
+        :param hexkey:
+        """
+        keyevt = None
+        key = hexkey
+        channel = midikey[CHANNEL]
+        mode = (self._legacy_values[key]['mode']
+                if key in self._legacy_values else None)
+        keytype = midikey[MIDITYPE] - (ABS_DELTA if mode else 0)
+        if keytype in ((NOTEOFF - ABS_DELTA), (NOTEON - ABS_DELTA),
+                       CONTROLLER):
+            keyevt = "key"
+        elif keytype == NOTEOFF:
+            if channel in self._midi_key_values:
+                key = self._midi_key_values.pop(channel, None)
+                keyevt = "keyup"
+        elif keytype == NOTEON:
+            if channel not in self._midi_key_values:
+                keyevt = "keydown"
+                self._midi_key_values[channel] = key
+        elif keytype == (CONTROLLER - ABS_DELTA):
+            if OPTIONS[NB_CTL_STEPS_IDX] != 0:
+                if channel in self._midi_ctl_values:
+                    prevkeybind = self._midi_ctl_values[channel]
+                    if prevkeybind is not None:
+                        self.injector.inject("keyup", prevkeybind)
+                keyevt = "keydown"
+                self._midi_ctl_values[channel] = \
+                    self._legacy_values[key]['keybind']
+            elif channel in self._midi_ctl_values:
+                if (OPTIONS[CTL_VALUE_MIDDLE_MIN_IDX] <= midikey[VELOCITY] <=
+                        OPTIONS[CTL_VALUE_MIDDLE_MAX_IDX]):
+                    key = self._midi_ctl_values.pop(channel, None)
+                    keyevt = "keyup"
+            else:
+                keyevt = "keydown"
+                if midikey[VELOCITY] < OPTIONS[CTL_VALUE_MIDDLE_MIN_IDX]:
+                    key = (key % (1 << 12)) | CTL_DECREASING << 12
+                    self._midi_ctl_values[channel] = key
+                elif midikey[VELOCITY] > OPTIONS[CTL_VALUE_MIDDLE_MAX_IDX]:
+                    key = (key % (1 << 12)) | CTL_INCREASING << 12
+                    self._midi_ctl_values[channel] = key
+                else:
+                    return
+        if keyevt and key in self._legacy_values:
+            keybind = self._legacy_values[key]['keybind']
+            if keybind is not None:
+                self.injector.inject(keyevt, keybind)
+
+
+def bench_parse_dispatch(nb_events=200000, legacy=False):
+    """bench_parse_dispatch : events/s through parse_midi + send_keystroke
+
+    :param nb_events:
+    :param legacy: with LegacyMidiToXdo (before the dispatch tables)
+    """
+    messages = dispatch_workload(nb_events)
+    midixdo = keytable_midixdo()
+    if legacy:
+        midixdo = LegacyMidiToXdo(midixdo)
+    midixdo.set_midi_device(ListKeyboard(messages))
+    start = time.perf_counter()
+    (command, hexcode) = midixdo.parse_midi()
+    while command is not None:
+        if hexcode is not None:
+            midixdo.send_keystroke(command, hexcode)
+        (command, hexcode) = midixdo.parse_midi()
+    return len(messages) / (time.perf_counter() - start)
+
+
+def sweep_workload(nb_sweeps=100, nb_controllers=4):
+    """sweep_workload : pots turned from 0 to 127 and back
+
+    :param nb_sweeps:
+    :param nb_controllers:
+    """
+    values = list(range(128)) + list(range(127, -1, -1))
+    return [(CONTROLLER, ctl, value)
+            for _ in range(nb_sweeps)
+            for value in values
+            for ctl in range(nb_controllers)]
+
+
+def note_storm(nb_events, seed=0):
+    """note_storm : fast note-on/note-off pairs, many keys held together
+
+    :param nb_events:
+    :param seed:
+    """
+    rand = random.Random(seed)
+    messages = []
+    held = []
+    while len(messages) < nb_events:
+        if len(held) < 10 and rand.random() < 0.6:
+            note = rand.randrange(128)
+            held.append(note)
+            messages.append((NOTEON, note, rand.randrange(1, 128)))
+        elif held:
+            messages.append((NOTEOFF, held.pop(rand.randrange(len(held))), 64))
+    return messages
+
+
+def controller_sweeps(nb_events, seed=0):
+    """controller_sweeps : pots turned on several controllers at once
+
+    :param nb_events:
+    :param seed:
+    """
+    return sweep_workload(nb_events // 1024 + 1, 4)[:nb_events]
+
+
+def mixed_traffic(nb_events, seed=0):
+    """mixed_traffic : notes, controllers, pitch bend and aftertouch
+    on the 16 midi channels (status low nibble)
+
+    :param nb_events:
+    :param seed:
+    """
+    rand = random.Random(seed)
+    messages = []
+    while len(messages) < nb_events:
+        channel = rand.randrange(16)
+        kind = rand.random()
+        if kind < 0.4:
+            note = rand.randrange(128)
+            messages.append((NOTEON | channel, note, rand.randrange(1, 128)))
+            messages.append((NOTEON | channel, note, 0))
+        elif kind < 0.8:
+            messages.append((CONTROLLER | channel, rand.randrange(128),
+                             rand.randrange(128)))
+        elif kind < 0.9:
+            messages.append((PITCHBEND | channel, rand.randrange(128),
+                             rand.randrange(128)))
+        else:
+            messages.append((AFTERTOUCH | channel, rand.randrange(128),
+                             rand.randrange(128)))
+    return messages
+
+
+WORKLOADS = (
+    ('note storm', note_storm),
+    ('ctl sweeps', controller_sweeps),
+    ('mixed', mixed_traffic),
+)
+
+
+def to_stream(messages):
+    """to_stream : midi bytes of messages
+
+    :param messages:
+    """
+    return b''.join(bytes(message) for message in messages)
+
+
+def bench_workload(messages):
+    """bench_workload : return (parser messages/s, parse_midi events/s)
+
+    :param messages: workload messages
+    """
+    (_, parsed) = bench_parser(to_stream(messages))
+    # as done by the reader thread, only known status bytes are queued
+    kept = [message for message in messages
+            if message[0] in MidiKeyboard.miditable]
+    midixdo = keytable_midixdo()
+    midixdo.set_midi_device(ListKeyboard(kept))
+    start = time.perf_counter()
+    (command, hexcode) = midixdo.parse_midi()
+    while command is not None:
+        (command, hexcode) = midixdo.parse_midi()
+    return (parsed, len(kept) / (time.perf_counter() - start))
+
+
+def bench_drain(messages, batch=True):
+    """bench_drain : events/s taken from a full MidiQueue and processed,
+    one read_event or one read_events (process_batch) at a time
+
+    :param messages: workload messages
+    :param batch:
+    """
+    midixdo = keytable_midixdo()
+    midikb = MidiKeyboard(maxsize=0)
+    fifo = midikb._queue
+    stamp = time.perf_counter()
+    for message in messages:
+        if message[0] in MidiKeyboard.miditable:
+            fifo.put(('bench', message, stamp))
+    nb_events = fifo.qsize()
+    start = time.perf_counter()
+    if batch:
+        events = midikb.read_events()
+        while events:
+            midixdo.process_batch(events)
+            events = midikb.read_events()
+    else:
+        event = midikb.read_event()
+        while event:
+            midixdo.process(event[1], event[0])
+            event = midikb.read_event()
+    return nb_events / (time.perf_counter() - start)
+
+
+def bench_replay(file_name):
+    """bench_replay : replay a recording as fast as possible through a fifo,
+    the reader thread and MidiToXdo ; return (events, events/s)
+
+    :param file_name: recording made by fakemidi.MidiRecorder
+    """
+    nb_devices = 1 + max([number for (_, number, _) in
+                          read_records(file_name)] or [0])
+    fakes = [FakeMidi('%s-replay%d' % (FAKE_DEVICE, i))
+             for i in range(nb_devices)]
+    midikb = MidiKeyboard(maxsize=0)
+    midikb.set_device([fake.path for fake in fakes])
+    midikb.start_thread()
+    midixdo = keytable_midixdo()
+    start = time.perf_counter()
+    replay(file_name, fakes, speed=0)
+    for fake in fakes:
+        fake.close()
+    nb_events = 0
+    event = midikb.read_event(READ_TIMEOUT)
+    while event:
+        if event[1][0] in midixdo._levels:
+            midixdo.process(event[1], event[0])
+            nb_events += 1
+            elapsed = time.perf_counter() - start
+        event = midikb.read_event(READ_TIMEOUT)
+    midikb.stop_thread()
+    for fake in fakes:
+        fake.remove()
+    return (nb_events, nb_events / elapsed if nb_events else 0)
+
+
+def bench_chords(nb_events=200000, nb_chords=40, nb_sequences=40, seed=0):
+    """bench_chords : events/s through MidiToXdo.process for a note storm,
+    without and with chords and sequences, and the largest number of
+    notes held back or sequence cursors seen
+
+    :param nb_events:
+    :param nb_chords: triads bound to keybinds
+    :param nb_sequences: sequences of 3 notes
+    :param seed:
+    """
+    rand = random.Random(seed)
+    messages = note_storm(nb_events, seed)
+    results = []
+    for chords in (False, True):
+        midixdo = keytable_midixdo()
+        if chords:
+            midixdo.chords = [
+                {'notes': rand.sample(range(128), 3), 'keybind': 'c'}
+                for _ in range(nb_chords)]
+            midixdo.sequences = [
+                {'notes': [rand.randrange(128) for _ in range(3)],
+                 'keybind': 's'} for _ in range(nb_sequences)]
+            midixdo.compile_table()
+        matcher = midixdo._matcher
+        most = 0
+        start = time.perf_counter()
+        for message in messages:
+            midixdo.process(message)
+            if matcher is not None:
+                most = max(most, len(matcher._pending), len(matcher._cursors))
+        results.append((nb_events / (time.perf_counter() - start), most))
+    return results
+
+
+def bench_ctl_coalescing(ctl_interval=0, nb_sweeps=100):
+    """bench_ctl_coalescing : return (events, injected keys, suppressed
+    events, seconds) for a recorded-like controller sweep
+
+    :param ctl_interval: MidiToXdo.ctl_interval
+    :param nb_sweeps:
+    """
+    messages = sweep_workload(nb_sweeps)
+    midixdo = keytable_midixdo()
+    midixdo.set_injector(FakeInjector())
+    midixdo.ctl_interval = ctl_interval
+    start = time.perf_counter()
+    for message in messages:
+        midixdo.process(message)
+        midixdo.flush_pending()
+    elapsed = time.perf_counter() - start
+    # the last values of the sweeps are sent at the end of the interval
+    time.sleep(ctl_interval)
+    midixdo.flush_pending()
+    return (len(messages), len(midixdo.injector.events),
+            midixdo.suppressed, elapsed)
+
+
+def bench_ctl_no_coalescing(nb_sweeps=100):
+    """bench_ctl_no_coalescing : as bench_ctl_coalescing,
+    sending every event
+
+    :param nb_sweeps:
+    """
+    messages = sweep_workload(nb_sweeps)
+    midixdo = keytable_midixdo()
+    midixdo.set_injector(FakeInjector())
+    start = time.perf_counter()
+    for message in messages:
+        (command, hexcode) = midixdo.parse_command(message)
+        midixdo.send_keystroke(command, hexcode)
+    elapsed = time.perf_counter() - start
+    return (len(messages), len(midixdo.injector.events), 0, elapsed)
+
+
+def large_settings(ctl_steps=10):
+    """large_settings : config with a keybind for 16 channels x 128 notes
+    x 3 pressure levels and 16 channels x 128 controllers x ctl_steps
+    (the midi channel is put above the hexcode bits, as keytables do not
+    distinguish channels, to get a keytable of this size)
+
+    :param ctl_steps:
+    """
+    keytable = {}
+    for channel in range(16):
+        for value in range(128):
+            for level in (0, 2, 3):
+                keytable[(channel << 16) | (level << 12) |
+                         NOTEON << 4 | value] = {
+                    'type': 'Note-on', 'channel': value,
+                    'keybind': 'ctrl+%d' % value, 'mode': 0}
+            for step in range(1, ctl_steps + 1):
+                keytable[(channel << 16) | (step << 12) |
+                         CONTROLLER << 4 | value] = {
+                    'type': 'CC', 'channel': value,
+                    'keybind': 'alt+%d' % step, 'mode': 1}
+    return {'ctl-steps': ctl_steps,
+            'note-pressures': {'middle': 40, 'strong': 80},
+            'keytable': keytable}
+
+
+def bench_config_load(file_format, repeat=5):
+    """bench_config_load : return (keys, file size, best time to load
+    the file, best time of MidiToXdo.read_configs)
+
+    :param file_format: CONFIG_LOADER key
+    :param repeat:
+    """
+    settings = large_settings()
+    file_name = '/tmp/midibench-config.' + file_format
+    save_config(settings, file_name)
+    (loads, reads) = ([], [])
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load_config(file_name)
+        loads.append(time.perf_counter() - start)
+        midixdo = MidiToXdo(FakeInjector(record=False))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            midixdo.read_configs(file_name=file_name)
+        reads.append(time.perf_counter() - start)
+    size = os.path.getsize(file_name)
+    os.unlink(file_name)
+    return (len(settings['keytable']), size, min(loads), min(reads))
+
+
+def bench_keytable(keytable, repeat=5):
+    """bench_keytable : return (bytes, keybind lookups/s) of a dict of dicts
+    and of a KeyTable holding the same bindings
+
+    :param keytable: {hexcode: {type, channel, keybind, mode}}
+    :param repeat:
+    """
+    def build_dicts():
+        """build_dicts : as loaded from a json config"""
+        return dict((key, dict((field, (str(value) + ' ')[:-1]
+                                if isinstance(value, str) else value)
+                               for (field, value) in values.items()))
+                    for (key, values) in keytable.items())
+
+    def build_table():
+        """build_table"""
+        table = KeyTable()
+        for (key, values) in build_dicts().items():
+            table[key] = values
+        return table
+
+    def lookup_dicts(table, keys):
+        """lookup_dicts"""
+        for key in keys:
+            table[key]['keybind']
+
+    def lookup_table(table, keys):
+        """lookup_table"""
+        for key in keys:
+            table.keybind(key)
+
+    results = []
+    keys = list(keytable) * 10
+    for (build, lookup) in ((build_dicts, lookup_dicts),
+                            (build_table, lookup_table)):
+        tracemalloc.start()
+        table = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            lookup(table, keys)
+            times.append(time.perf_counter() - start)
+        results.append((size, len(keys) / min(times)))
+    return results
+
+
+def bench_import(module='midievk', repeat=10):
+    """bench_import : best time of `import module` in a new python,
+    python startup excluded
+
+    :param module:
+    :param repeat:
+    """
+    def best(code):
+        """best"""
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.check_call([sys.executable, '-c', code], cwd=HERE)
+            times.append(time.perf_counter() - start)
+        return min(times)
+    return best('import ' + module) - best('pass')
+
+
+def show_result(name, result):
+    """show_result
+
+    :param name:
+    :param result:
+    """
+    print("{0:<14s} idle cpu {1:6.1%}   latency p50 {2:8.1f}us  max {3:8.1f}us".format(
+        name, result['idle_cpu'], result['p50'] * 1e6, result['max'] * 1e6))
+
+
+def main():
+    """main"""
+    print("{0:<14s} {1:10.1f}ms".format(
+        'import midievk', bench_import() * 1e3))
+    show_result('polling', bench_dispatch(0, name='polling'))
+    show_result('event-driven', bench_dispatch(0.5, name='event'))
+    stream = midi_stream(4 << 20)
+    for name, bench in (('parser', bench_parser),
+                        ('byte per byte', bench_legacy_parser)):
+        (mbps, msgps) = bench(stream)
+        print("{0:<14s} {1:6.2f} MB/s  {2:10.0f} messages/s".format(
+            name, mbps, msgps))
+    for (name, new) in injectors():
+        injector = new()
+        injected = bench_injector(injector)
+        sent = bench_send_keystroke(injector)
+        injector.close()
+        print("{0:<14s} injection {1:10.1f}us/event  send_keystroke "
+              "{2:10.1f}us/event".format(name, injected * 1e6, sent * 1e6))
+    for (name, new) in injectors():
+        for window in (0, 0.0005):
+            (keys, p50, most) = bench_batching(new, window)
+            print("{0:<14s} batch {1:4.0f}us {2:10.0f} keys/s  latency p50 "
+                  "{3:8.1f}us  max {4:8.1f}us".format(
+                      name, window * 1e6, keys, p50 * 1e6, most * 1e6))
+    print("{0:<14s} {1:10.0f} events/s  if/elif before {2:10.0f} "
+          "events/s".format('parse+dispatch', bench_parse_dispatch(),
+                            bench_parse_dispatch(legacy=True)))
+    for (name, workload) in WORKLOADS:
+        (parsed, dispatched) = bench_workload(workload(200000))
+        print("{0:<14s} parser {1:10.0f} messages/s  parse_midi {2:10.0f} "
+              "events/s".format(name, parsed, dispatched))
+    storm = note_storm(200000)
+    for (name, batch) in (('read_event', False), ('read_events', True)):
+        print("{0:<14s} {1:10.0f} events/s".format(
+            name, bench_drain(storm, batch)))
+    for (name, (events, most)) in zip(('storm', 'storm chords'),
+                                      bench_chords()):
+        print("{0:<14s} {1:10.0f} events/s  {2:d} notes or cursors "
+              "at most".format(name, events, most))
+    for (name, result) in (
+            ('sweep', bench_ctl_no_coalescing()),
+            ('sweep coalesce', bench_ctl_coalescing()),
+            ('sweep 20ms', bench_ctl_coalescing(0.02))):
+        print("{0:<14s} {1:d} events, {2:d} keys, {3:d} suppressed, "
+              "{4:.1f}ms".format(name, result[0], result[1], result[2],
+                                 result[3] * 1e3))
+    for (name, keytable) in (
+            ('keytable', dict(keytable_midixdo()._midi_values.items())),
+            ('large table', large_settings()['keytable'])):
+        for (kind, (size, lookups)) in zip(('dicts', 'KeyTable'),
+                                           bench_keytable(keytable)):
+            print("{0:<14s} {1:5d} keys {2:<8s} {3:9d} bytes "
+                  "{4:10.0f} lookups/s".format(
+                      name, len(keytable), kind, size, lookups))
+    for file_format in ('json', 'mevk'):
+        (keys, size, load, read) = bench_config_load(file_format)
+        print("{0:<14s} {1:d} keys, {2:8d} bytes, load {3:6.1f}ms, "
+              "read_configs {4:6.1f}ms".format(
+                  'config ' + file_format, keys, size, load * 1e3, read * 1e3))
+    for file_name in sys.argv[1:]:
+        print("{0:<14s} {1:d} events, {2:10.0f} events/s".format(
+            os.path.basename(file_name)[:14], *bench_replay(file_name)))
+
+
+if __name__ == '__main__':
+    main()
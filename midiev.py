@@ -19,12 +19,19 @@ midievk midi listener
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 # Require xdotool, python3-tk
+import os
+import time
+import asyncio
 import threading
 import logging
 import sys
 import queue
-from interval import setInterval
-from options import usage, DEVICE, STATS
+import selectors
+from collections import deque
+from interval import setInterval, setPeriod
+import options
+from options import usage
+from stats import ValueStats
 
 try:
     input = raw_input
@@ -40,6 +47,12 @@ PRESSURE = 0xD0
 PATCHCHANGE = 0xC0
 PITCHBEND = 0xE0
 # (non-musical commands = 0xF0
+SYSEX = 0xF0
+SYSEX_END = 0xF7
+REALTIME = 0xF8  # clock, start, stop... up to 0xFF
+# pseudo event types (out of midi bytes range) queued by MidiKeyboard
+DEVICE_LOST = 0x100  # the device is unplugged
+DEVICE_FOUND = 0x101  # the device is back
 
 # event values indexes
 MIDITYPE = 0
@@ -50,9 +63,327 @@ CONTROLLER_VALUE = 2
 LSB = 1  # 7bits
 MSB = 2  # 7bits
 
+# how long (in seconds) a consumer sleeps on the queue before
+# checking again that the reader is alive ; 0 means polling
+READ_TIMEOUT = 0.5
+# how often (in seconds) a lost device is looked for
+RECONNECT_INTERVAL = 1.0
+# most messages taken from the queue by a consumer at once
+READ_BATCH = 256
+
+
+# number of data bytes following each status byte
+# (-1 for bytes which are not followed by data bytes)
+DATA_LENGTH = [-1] * 0x80 + [
+    (2, 2, 2, 2, 1, 1, 2)[(status >> 4) - 8] if status < 0xF0 else
+    {0xF1: 1, 0xF2: 2, 0xF3: 1}.get(status, 0)
+    for status in range(0x80, 0x100)
+]
+
+
+class MidiParser(object):
+    """MidiParser : turn a midi byte stream into message tuples
+
+    (status, data1, data2) or (status, data1) for channel messages,
+    (SYSEX, payload) for system exclusive messages
+    and (status,) for other system messages (real-time, tune request...).
+    Running status (data bytes without repeated status byte) is decoded.
+    """
+
+    def __init__(self, bufsize=4096):
+        self._buffer = bytearray(bufsize)
+        self._view = memoryview(self._buffer)
+        self._status = None   # status of the message being read
+        self._data = []       # data bytes already read for this message
+        self._sysex = None    # payload of the current system exclusive
+
+    def read_from(self, midiinput, recorder=None):
+        """read_from : read all the available bytes and parse them
+
+        :param midiinput: unbuffered binary file
+        :param recorder: function called with the bytes read
+        :return: list of messages, None at end of file
+        """
+        size = midiinput.readinto(self._buffer)
+        if size is None:  # non-blocking file without available data
+            return []
+        if not size:
+            return None
+        if recorder is not None:
+            recorder(self._view[:size])
+        return self.feed(self._view[:size])
+
+    def feed(self, data):
+        """feed
+
+        :param data: bytes-like object
+        :return: list of complete messages
+        """
+        messages = []
+        append = messages.append
+        status = self._status
+        msgdata = self._data
+        sysex = self._sysex
+        for byte in data:
+            if byte < 0x80:
+                if sysex is not None:
+                    sysex.append(byte)
+                    continue
+                if status is None:
+                    continue  # no status to refer to
+                msgdata.append(byte)
+                if len(msgdata) == DATA_LENGTH[status]:
+                    append((status,) + tuple(msgdata))
+                    msgdata = []
+                    if status >= 0xF0:
+                        status = None  # no running status for system messages
+            elif byte >= REALTIME:
+                append((byte,))  # may appear anywhere, even within a message
+            else:
+                if sysex is not None:
+                    append((SYSEX, bytes(sysex)))
+                    sysex = None
+                msgdata = []
+                status = None
+                if byte == SYSEX:
+                    sysex = bytearray()
+                elif byte == SYSEX_END:
+                    pass
+                elif DATA_LENGTH[byte] == 0:
+                    append((byte,))
+                else:
+                    status = byte
+        self._status = status
+        self._data = msgdata
+        self._sysex = sysex
+        return messages
+
+
+class MidiQueue(object):
+    """MidiQueue : queue of (device path, message, time read)
+    between the reader
+    thread and the consumer, with a bounded size and a policy
+    to follow when it is full :
+
+    block       : the reader waits (the device buffer fills up)
+    drop-oldest : the oldest event is dropped
+    drop-newest : the new event is dropped
+    coalesce    : a controller value replaces the pending value of the
+                  same controller (always, not only when full),
+                  when full the oldest controller value is dropped,
+                  or the oldest event if only notes are waiting
+
+    Releases (note-off, lost device) are never dropped, so that no key
+    stays held : the oldest other event is dropped instead, and when
+    only releases are waiting they are kept beyond maxsize.
+
+    get raises queue.Empty as queue.Queue does. A byte is written to the
+    notify fd (see set_notify) when the queue is no longer empty.
+    """
+    policies = ('block', 'drop-oldest', 'drop-newest', 'coalesce')
+
+    def __init__(self, maxsize=0, policy='drop-oldest'):
+        if policy not in self.policies:
+            raise ValueError('Unknown overflow policy %s' % policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.coalesced = 0
+        self._items = deque()      # [device path, message] slots
+        self._controllers = {}     # (device, status, controller) -> slot
+        self._notify = None
+        lock = threading.Lock()
+        self._not_empty = threading.Condition(lock)
+        self._not_full = threading.Condition(lock)
+
+    def set_notify(self, fd):
+        """set_notify
+
+        :param fd: non-blocking file descriptor (write end of a pipe)
+        """
+        self._notify = fd
+
+    def qsize(self):
+        """qsize"""
+        return len(self._items)
+
+    def _full(self):
+        """_full"""
+        return 0 < self.maxsize <= len(self._items)
+
+    @staticmethod
+    def is_release(message):
+        """is_release : tell if a message releases a key
+
+        :param message:
+        """
+        miditype = message[MIDITYPE]
+        return (miditype == NOTEOFF or miditype == DEVICE_LOST or
+                (miditype == NOTEON and message[VELOCITY] == 0))
+
+    def _drop_oldest(self):
+        """_drop_oldest : drop the oldest event which is not a release,
+        tell if there was one"""
+        is_release = self.is_release
+        for (index, slot) in enumerate(self._items):
+            if not is_release(slot[1]):
+                break
+        else:
+            return False
+        if index == 0:
+            self._popleft()
+            return True
+        del self._items[index]
+        message = slot[1]
+        if self._controllers and message[MIDITYPE] == CONTROLLER:
+            key = (slot[0], CONTROLLER, message[CHANNEL])
+            if self._controllers.get(key) is slot:
+                del self._controllers[key]
+        return True
+
+    def _popleft(self):
+        """_popleft"""
+        slot = self._items.popleft()
+        message = slot[1]
+        if self._controllers and message[MIDITYPE] == CONTROLLER:
+            key = (slot[0], CONTROLLER, message[CHANNEL])
+            if self._controllers.get(key) is slot:
+                del self._controllers[key]
+        return slot
+
+    def put(self, item):
+        """put
+
+        :param item: (device path, message, time read)
+        """
+        with self._not_full:
+            key = None
+            if self.policy == 'coalesce' and item[1][MIDITYPE] == CONTROLLER:
+                key = (item[0], CONTROLLER, item[1][CHANNEL])
+                slot = self._controllers.get(key)
+                if slot is not None:
+                    slot[1:] = item[1:]
+                    self.coalesced += 1
+                    return
+            slot = list(item)
+            while self._full():
+                if self.policy == 'block':
+                    self._not_full.wait()
+                elif (self.policy == 'drop-newest' and
+                      not self.is_release(item[1])):
+                    self.dropped += 1
+                    return
+                elif self.policy == 'coalesce' and self._controllers:
+                    # notes are kept : drop the oldest controller value
+                    oldest = next(iter(self._controllers))
+                    self._items.remove(self._controllers.pop(oldest))
+                    self.dropped += 1
+                elif self._drop_oldest():
+                    self.dropped += 1
+                else:
+                    break  # only releases are waiting : all kept
+            self._items.append(slot)
+            if key is not None:
+                self._controllers[key] = slot
+            self._not_empty.notify()
+            if self._notify is not None and len(self._items) == 1:
+                try:
+                    os.write(self._notify, b'\0')
+                except BlockingIOError:
+                    pass  # the pipe is full : the consumer is woken up anyway
+
+    def get(self, block=True, timeout=None):
+        """get
+
+        :param block:
+        :param timeout: seconds, None waits until an event arrives
+        """
+        with self._not_empty:
+            if block and not self._items:
+                self._not_empty.wait_for(lambda: self._items, timeout)
+            if not self._items:
+                raise queue.Empty
+            slot = self._popleft()
+            self._not_full.notify()
+            return tuple(slot)
+
+    def get_many(self, max_n=0, block=True, timeout=None):
+        """get_many : every waiting item (at most max_n) with one lock,
+        an empty list if there is none
+
+        :param max_n: 0 for no limit
+        :param block: wait for the first item
+        :param timeout: seconds, None waits until an event arrives
+        """
+        with self._not_empty:
+            if block and not self._items:
+                self._not_empty.wait_for(lambda: self._items, timeout)
+            count = len(self._items)
+            if 0 < max_n < count:
+                count = max_n
+            if not self._controllers:
+                popleft = self._items.popleft
+                items = [tuple(popleft()) for _ in range(count)]
+            else:
+                items = [tuple(self._popleft()) for _ in range(count)]
+            if items:
+                self._not_full.notify_all()
+            return items
+
+
+def open_nonblocking(path, flags):
+    """open_nonblocking : opener for open()
+
+    :param path:
+    :param flags:
+    """
+    return os.open(path, flags | os.O_NONBLOCK)
+
+
+class MidiDevice(object):
+    """MidiDevice : a raw midi device (/dev/midi*, /dev/snd/midi*, fifo)
+    read without blocking"""
+
+    def __init__(self, path, recorder=None):
+        self.path = path
+        self._parser = MidiParser()
+        self._midiinput = open(path, 'rb', buffering=0,
+                               opener=open_nonblocking)
+        self._recorder = None
+        if recorder is not None:
+            self._recorder = lambda data: recorder(path, data)
+
+    def fileno(self):
+        """fileno"""
+        return self._midiinput.fileno()
+
+    def read(self):
+        """read : return available messages, None if the device is closed"""
+        try:
+            return self._parser.read_from(self._midiinput, self._recorder)
+        except IOError:
+            return None
+
+    def close(self):
+        """close"""
+        self._midiinput.close()
+
+
+def new_device(path, recorder=None):
+    """new_device : open a device, raise IOError if it is not available
+
+    :param path: raw midi device, or seq:client:port for an alsa
+                 sequencer port (see alsaseq.py)
+    :param recorder: see MidiKeyboard.set_recorder
+    """
+    if path.startswith(options.SEQ_PREFIX):
+        from alsaseq import SeqDevice
+        return SeqDevice(path, recorder)
+    return MidiDevice(path, recorder)
+
 
 class MidiKeyboard(object):
-    """MidiKeyboard"""
+    """MidiKeyboard : read one or several midi devices in one thread"""
     miditable = {
         # cmd  parameters
         # ----+--------------
@@ -73,31 +404,37 @@ class MidiKeyboard(object):
         CONTROLLER: 'Controller',
         PATCHCHANGE: 'Path change',
         PRESSURE: 'Pressure',
-        PITCHBEND: 'Pitch bend'
+        PITCHBEND: 'Pitch bend',
+        DEVICE_LOST: 'Device lost',
+        DEVICE_FOUND: 'Device found'
     }
 
-    def __init__(self, device=None):
-        self._device = None
-        self._device_pipe = None
+    def __init__(self, device=None, maxsize=None, policy=None):
+        self._devices = []
+        self._thread = None
+        self._last_reconnect = 0
+        self._recorder = None
         self._running = threading.Event()
-        self._queue = queue.Queue()
+        self._queue = MidiQueue(
+            options.QUEUE_SIZE if maxsize is None else maxsize,
+            policy or options.OVERFLOW)
+        # written to wake the reader thread up when it has to stop
+        (self._wakeup_in, self._wakeup_out) = os.pipe()
+        self._notify = None
         if device is not None:
-            print('listen %s' % device)
             self.set_device(device)
+            print('listen %s' % ' '.join(self._devices))
             self.start_thread()
 
     def start_thread(self):
-        """start_thread
-
-        :param device:
-        """
-        if self._device is None:
+        """start_thread"""
+        if not self._devices:
             raise Exception('No device defined')
         try:
             self._thread = threading.Thread(
-                target=self._read_device,
+                target=self._read_devices,
                 args=())
-            self._thread.setDaemon(True)
+            self._thread.daemon = True
             self._thread.start()
         except NameError:
             print("Variable ?", sys.exc_info()[2])
@@ -107,82 +444,253 @@ class MidiKeyboard(object):
     def stop_thread(self):
         """stop_thread"""
         logging.info('Stop midi-thread request')
-        try:
-            if self._running.is_set():
-                self._device_pipe.kill()
-                self._device_pipe.stdout.close()
-                self._running.clear()
-                logging.debug('I set running flag off.')
-                self._thread.join(1)
-                logging.debug('I close pipe.')
-                self._device_pipe.close()
-                logging.debug('Midi-thread is closed.')
-        except:
-            logging.debug('Some thread had been engraved alive.')
-
-    def _read_data_with_values(self, data, message):
-        midiinput = self._device_pipe
-        if data >= 0x80:
-            message.append(data)
-            if data in self.miditable:
-                expected_len = self.miditable[data]
-                message.append(ord(midiinput.read(1)))
-                if expected_len == 2:
-                    message.append(ord(midiinput.read(1)))
-                    if STATS:
-                        reg_stat(message)
-                self._queue.put(message)
-            else:
-                expected_len = 0
-
-    def _read_device(self):
-        """_read_device """
-        # self._device_pipe = open(self._device, 'rb') # a?
-        # self._device_pipe = subprocess.Popen(['cat', device],
-        # stdout=subprocess.PIPE, bufsize=0)
+        if self._running.is_set():
+            self._running.clear()
+            logging.debug('I set running flag off.')
+            os.write(self._wakeup_out, b'\0')
+            self._thread.join(1)
+            logging.debug('Midi-thread is closed.')
+
+    def _reconnect(self, selector, lost, announce=True):
+        """_reconnect : open the lost devices which are back
+
+        :param selector:
+        :param lost: paths of devices to open, updated
+        :param announce: queue a DEVICE_FOUND event for each opened device
+        """
+        now = time.monotonic()
+        if announce and now - self._last_reconnect < RECONNECT_INTERVAL:
+            return
+        self._last_reconnect = now
+        for path in list(lost):
+            try:
+                device = new_device(path, self._recorder)
+            except IOError:
+                continue
+            selector.register(device, selectors.EVENT_READ)
+            lost.remove(path)
+            if announce:
+                logging.info("Device found: %s", path)
+                self._queue.put((path, (DEVICE_FOUND,), time.perf_counter()))
+        if not announce:
+            for path in lost:
+                logging.error("Device not found: %s ", path)
+
+    def _read_devices(self):
+        """_read_devices : wait for any device to be readable, and queue
+        its messages as (device path, message, time.perf_counter())
+
+        An unplugged device is closed (a DEVICE_LOST event is queued)
+        and looked for every RECONNECT_INTERVAL until it is back."""
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_in, selectors.EVENT_READ)
+        lost = list(self._devices)
+        self._reconnect(selector, lost, announce=False)
+        self._running.set()
+        while self._running.is_set():
+            timeout = RECONNECT_INTERVAL if lost else None
+            for (key, _) in selector.select(timeout):
+                device = key.fileobj
+                if device is self._wakeup_in:
+                    os.read(self._wakeup_in, 64)
+                    continue
+                messages = device.read()
+                stamp = time.perf_counter()
+                if messages is None:
+                    logging.error("Device closed: %s", device.path)
+                    selector.unregister(device)
+                    device.close()
+                    lost.append(device.path)
+                    # looked for again after RECONNECT_INTERVAL
+                    self._last_reconnect = time.monotonic()
+                    self._queue.put((device.path, (DEVICE_LOST,), stamp))
+                    continue
+                for message in messages:
+                    if self._keep(message):
+                        self._queue.put((device.path, message, stamp))
+            if lost:
+                self._reconnect(selector, lost)
+        for key in list(selector.get_map().values()):
+            if key.fileobj is not self._wakeup_in:
+                key.fileobj.close()
+        selector.close()
+
+    def _keep(self, message):
+        """_keep : tell if a message is given to the consumers
+
+        :param message:
+        """
+        if message[MIDITYPE] in self.miditable:
+            if options.STATS and len(message) == 3:
+                reg_stat(message)
+            return True
+        return False
+
+    async def events(self, tagged=False):
+        """events : asynchronous iterator over the messages,
+        the devices are read from the running asyncio loop
+        (do not use with start_thread). Unplugged devices are looked for
+        every RECONNECT_INTERVAL, as in the reader thread.
+
+            midikb = MidiKeyboard()
+            midikb.set_device('/dev/midi1')
+            async for message in midikb.events():
+                ...
+
+        :param tagged: yield (device path, message) instead of message
+        """
+        loop = asyncio.get_event_loop()
+        pending = asyncio.Queue()
+        devices = []
+        timers = []  # retries to open lost devices
+
+        def open_device(path, announce=True):
+            """open_device : open or look for it later"""
+            try:
+                device = new_device(path, self._recorder)
+            except IOError:
+                device = None
+            if device is None:
+                if not announce:
+                    logging.error("Device not found: %s ", path)
+                timers.append(loop.call_later(
+                    RECONNECT_INTERVAL, open_device, path))
+                return
+            devices.append(device)
+            loop.add_reader(device.fileno(), on_readable, device)
+            if announce:
+                logging.info("Device found: %s", path)
+                pending.put_nowait((path, (DEVICE_FOUND,)))
+
+        def on_readable(device):
+            """on_readable"""
+            messages = device.read()
+            if messages is None:
+                logging.error("Device closed: %s", device.path)
+                loop.remove_reader(device.fileno())
+                device.close()
+                devices.remove(device)
+                pending.put_nowait((device.path, (DEVICE_LOST,)))
+                timers.append(loop.call_later(
+                    RECONNECT_INTERVAL, open_device, device.path))
+                return
+            for message in messages:
+                if self._keep(message):
+                    pending.put_nowait((device.path, message))
+
+        for path in self._devices:
+            open_device(path, announce=False)
         self._running.set()
-        # with self._device_pipe.stdout as f:
-        # with self._device_pipe as f:
         try:
-            with open(self._device, 'rb') as midiinput:
-                self._device_pipe = midiinput
-                try:
-                    data = None
-                    message = None
-                    while self._running.is_set():
-                        message = []
-                        data = ord(midiinput.read(1))
-                        self._read_data_with_values(data, message)
-
-                except BufferError:
-                    if data is not None:
-                        logging.error(
-                            "Midi message not understood: %s - %s",
-                            hex(data), message)
-                    else:
-                        logging.error("Midi message was NONE")
-                    exit()
-        except IOError:
-            logging.error("Device not found: %s ", self._device)
-
-    def read(self):
-        """read"""
+            while True:
+                event = await pending.get()
+                yield event if tagged else event[1]
+        finally:
+            for timer in timers:
+                timer.cancel()
+            for device in devices:
+                loop.remove_reader(device.fileno())
+                device.close()
+            self._running.clear()
+
+    def read_event(self, timeout=0):
+        """read_event : return (device path, message, time read) or False
+
+        :param timeout: seconds to wait for a message,
+                        0 returns at once, None waits until one arrives
+        """
         try:
-            return self._queue.get(False)
+            if timeout == 0:
+                return self._queue.get(False)
+            return self._queue.get(True, timeout)
         except queue.Empty:
             return False
 
+    def read_events(self, max_n=READ_BATCH, timeout=0):
+        """read_events : return the waiting (device path, message, time read),
+        at most max_n, [] if none arrived
+
+        :param max_n: 0 for no limit
+        :param timeout: seconds to wait for the first message,
+                        0 returns at once, None waits until one arrives
+        """
+        return self._queue.get_many(max_n, timeout != 0, timeout)
+
+    def read_many(self, max_n=READ_BATCH, timeout=0):
+        """read_many : return the waiting messages, as read_events
+
+        :param max_n: 0 for no limit
+        :param timeout:
+        """
+        return [event[1] for event in self.read_events(max_n, timeout)]
+
+    def read(self, timeout=0):
+        """read
+
+        :param timeout: seconds to wait for a message,
+                        0 returns at once, None waits until one arrives
+        """
+        event = self.read_event(timeout)
+        return event and event[1]
+
+    def notify_fd(self):
+        """notify_fd : a file descriptor readable when messages are waiting,
+        to wait for them in an event loop (tk createfilehandler, selectors)
+        instead of polling. Call clear_notify, then read every message."""
+        if self._notify is None:
+            (notify_in, notify_out) = os.pipe()
+            os.set_blocking(notify_in, False)
+            os.set_blocking(notify_out, False)
+            self._notify = notify_in
+            self._queue.set_notify(notify_out)
+        return self._notify
+
+    def clear_notify(self):
+        """clear_notify : to be called before reading the messages"""
+        try:
+            os.read(self._notify, 4096)
+        except BlockingIOError:
+            pass
+
+    def queue_stats(self):
+        """queue_stats : pending, dropped and coalesced events"""
+        return {
+            'pending': self._queue.qsize(),
+            'dropped': self._queue.dropped,
+            'coalesced': self._queue.coalesced,
+        }
+
     def is_running(self):
         """is_running"""
         return self._running.is_set()
 
+    def wait_running(self, timeout=None):
+        """wait_running : block until the reader thread is running
+
+        :param timeout: seconds to wait, None waits forever
+        """
+        return self._running.wait(timeout)
+
     def set_device(self, device=None):
         """set_device
 
-        :param device:
+        :param device: path or list of paths
         """
         if device is not None:
-            self._device = device
+            self._devices = (
+                [device] if isinstance(device, str) else list(device))
+
+    def get_devices(self):
+        """get_devices"""
+        return list(self._devices)
+
+    def set_recorder(self, recorder):
+        """set_recorder : to be set before start_thread or events
+
+        :param recorder: function called with (device path, bytes)
+                         for every read, e.g. fakemidi.MidiRecorder
+        """
+        self._recorder = recorder
 
     # def setlight(self, note, status):
         # coord = where['coordinate']
@@ -205,6 +713,7 @@ class MidiView(object):
     """MidiView"""
     midikb = None
     failcnt = 0
+    read_timeout = READ_TIMEOUT
 
     def connect_to_device(self, dev):
         """connect_to_device
@@ -217,16 +726,18 @@ class MidiView(object):
     def check_midi_device(self):
         """check_midi_device"""
         if self.midikb:
-            if self.midikb.is_running():
-                command = self.midikb.read()
-                if command:
-                    print('Event:  %s' % command)
+            if self.midikb.wait_running(self.read_timeout):
+                for command in self.midikb.read_many(0, self.read_timeout):
+                    print('Event:  %s' % (command,))
         else:
             print("Midi device disappeared")
             exit()
 
 
+# {message type: {channel: ValueStats}}
 STATISTICS = {}
+# percentiles shown by show_stats
+PERCENTILES = (5, 25, 50, 75, 95)
 
 
 def reg_stat(message):
@@ -236,45 +747,60 @@ def reg_stat(message):
     """
     data = message[0]
     channel = message[1]
-    if data in STATISTICS:
-        if channel in STATISTICS[data]:
-            STATISTICS[data][channel].append(message[2])
-        else:
-            STATISTICS[data][channel] = [message[2]]
-    else:
-        STATISTICS[data] = {channel: [message[2]]}
+    if data not in STATISTICS:
+        STATISTICS[data] = {}
+    if channel not in STATISTICS[data]:
+        STATISTICS[data][channel] = ValueStats()
+    STATISTICS[data][channel].add(message[2])
 
 
 def show_stats():
-    """show_stats"""
-    template = "{0:<14s} {1:<8s} {2:<8s} {3:<8s} {4:<8s}"
-    print(template.format("Type", "Channel", "Value", "", ""))
-    print(template.format("", "", "(min)", "(mean)", "(max)"))
-    print(template.format("----", "-------", "-----", "-----", "-----"))
-    for (keytype, channel_values) in STATISTICS.items():
-        for (channel, values) in channel_values.items():
+    """show_stats : one line per type and channel, and one line for
+    all the channels of a type (e.g. to choose --note-pressures)"""
+    template = "{:<14s} {:<8s} {:>7s} {:>5s} {:>6s} {:>6s} {:>5s}" + \
+        " {:>5s}" * len(PERCENTILES)
+    print(template.format("Type", "Channel", "Count", "Value", "", "", "",
+                          *["" for _ in PERCENTILES]))
+    print(template.format("", "", "", "(min)", "(mean)", "(std)", "(max)",
+                          *["(p%d)" % p for p in PERCENTILES]))
+    print(template.format("----", "-------", "-----", "-----", "-----",
+                          "-----", "-----", *["-----" for _ in PERCENTILES]))
+    for (keytype, channel_values) in list(STATISTICS.items()):
+        alls = ValueStats()
+        lines = sorted(channel_values.items())
+        for (_, values) in lines:
+            alls.merge(values)
+        if len(lines) > 1:
+            lines.append(('all', alls))
+        for (channel, values) in lines:
             print(template.format(
                 MidiKeyboard.event_desc[keytype],
                 str(channel),
-                str(min(values)),
-                str(sum(values)/len(values)),
-                str(max(values))
+                str(values.count),
+                str(values.min),
+                "%.1f" % values.mean,
+                "%.1f" % values.stddev(),
+                str(values.max),
+                *[str(values.percentile(p)) for p in PERCENTILES]
             ))
 
 
 def main():
     """main"""
     midiobserver = MidiView()
-    midiobserver.connect_to_device(DEVICE)
+    midiobserver.connect_to_device(options.DEVICES)
     midiobserver.check_midi_device()
-    while input() is not 'q':
+    if options.STATS and options.STATS_INTERVAL:
+        setPeriod(options.STATS_INTERVAL, show_stats)
+    while input() != 'q':
         pass
-    if STATS:
+    if options.STATS:
         show_stats()
 
 
 if __name__ == '__main__':
-    if DEVICE:
+    options.parse_argv()
+    if options.DEVICES:
         main()
     else:
         usage()
@@ -19,19 +19,30 @@ Require xdotool
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-import subprocess
+import os
+import asyncio
 import logging
+import signal
+import time
+import threading
 from os.path import isfile
 from midiev import MidiKeyboard, MIDITYPE, NOTEON, NOTEOFF, CONTROLLER
-from midiev import CONTROLLER_VALUE, VELOCITY, CHANNEL
-from options import usage, DEVICE, set_options, get_options
-from options import CONFIG_FILE, CONFIG_FORMAT, CONFIG_LOADER
+from midiev import CONTROLLER_VALUE, VELOCITY, CHANNEL, READ_TIMEOUT
+from midiev import DEVICE_LOST
+import options
+from options import usage, set_options, get_options
+from options import CONFIG_LOADER, config_format, load_config, save_config
 from options import OPTIONS
 from options import NOTE_PRESSURE_MIDDLE_IDX, NOTE_PRESSURE_STRONG_IDX
 from options import NOTE_PRESSURE_MIDDLE_DELTA, NOTE_PRESSURE_STRONG_DELTA
 from options import CTL_DECREASING, CTL_INCREASING, NB_CTL_STEPS_IDX
 from options import CTL_VALUE_MIDDLE_MIN_IDX, CTL_VALUE_MIDDLE_MAX_IDX
 from interval import setInterval
+from injector import new_injector, async_injector, aclose_injector
+from injector import BatchInjector
+from keytable import KeyTable, check_entry
+from chords import ChordMatcher, check_chord, CHORD_WINDOW, SEQUENCE_GAP
+from stats import LatencyStats
 
 try:
     input = raw_input
@@ -39,26 +50,70 @@ except NameError:
     pass
 
 ABS_DELTA = NOTEOFF
+# how often (in seconds) the config files are checked for changes
+CONFIG_CHECK_INTERVAL = 1.0
 
 
-def split_ctl_value(ctlval):
+def split_ctl_value(ctlval, values=None):
     """split_ctl_value : return
 
     :param ctlval:
+    :param values: OPTIONS of a config, the current OPTIONS by default
     """
-    return int(round(ctlval * (OPTIONS[NB_CTL_STEPS_IDX]-1) / 127)) + 1
+    values = OPTIONS if values is None else values
+    return int(round(ctlval * (values[NB_CTL_STEPS_IDX]-1) / 127)) + 1
+
+
+def note_level(vel, values=None):
+    """note_level : return the pressure bits of a note-on hexcode
+
+    :param vel: velocity
+    :param values: OPTIONS of a config, the current OPTIONS by default
+    """
+    values = OPTIONS if values is None else values
+    if vel > values[NOTE_PRESSURE_MIDDLE_IDX]:
+        if vel > values[NOTE_PRESSURE_STRONG_IDX]:
+            return NOTE_PRESSURE_STRONG_DELTA << 12
+        return NOTE_PRESSURE_MIDDLE_DELTA << 12
+    return 0
 
 
 class MidiToXdo(object):
 
     """MidiToXdo"""
 
-    def __init__(self):
+    def __init__(self, injector=None):
         self.midikb = None
+        self.device = None          # only listen this device if defined
+        self.injector = injector or new_injector(options.INJECTOR)
+        self.read_timeout = READ_TIMEOUT
         # self._midi_key_chord = {}   # active keys
         self._midi_key_values = {}  # recents values
         self._midi_ctl_values = {}  # recents values for controllers
-        self._midi_values = {}      # table containing config
+        # controller coalescing, see coalesce_ctl
+        self.ctl_interval = options.CTL_INTERVAL / 1000.0
+        self.suppressed = 0         # controller events not sent
+        self._ctl_hexcodes = {}     # controller -> last hexcode sent
+        self._ctl_times = {}        # controller -> time of last hexcode sent
+        self._ctl_pending = {}      # controller -> (command, hexcode)
+                                    # suppressed, sent after ctl_interval
+        self.latency = None         # stats.LatencyStats when measured
+        self.config_file = None     # config read, reloaded when it changes
+        self._options = None        # OPTIONS of the config, see set_options
+        self._config_stamp = None   # see _stat_config
+        self._config_checked = 0
+        self._midi_values = KeyTable()  # table containing config
+        self.chords = []            # [{notes, keybind}] see chords.py
+        self.sequences = []         # [{notes, keybind}]
+        self.chord_window = CHORD_WINDOW
+        self.sequence_gap = SEQUENCE_GAP
+        # compiled from options and config, see compile_table
+        self._levels = {}           # miditype -> bits to add for each value
+        self._actions = {}          # hexcode -> (resolved keybind, mode)
+        self._ctl_steps = 0
+        self._ctl_middle = (0, 0)
+        self._matcher = None        # ChordMatcher if chords or sequences
+        self.compile_table()
 
     def __iter__(self):
         return iter(self._midi_values)
@@ -70,6 +125,16 @@ class MidiToXdo(object):
         """
         self.midikb = midikb
 
+    def set_injector(self, injector):
+        """set_injector
+
+        :param injector: see injector.py
+        """
+        if self.injector is not None:
+            self.injector.close()
+        self.injector = injector
+        self.compile_table()  # keybinds are resolved by the injector
+
     def insert(self, key, values):
         """insert
 
@@ -77,6 +142,7 @@ class MidiToXdo(object):
         :param values:
         """
         self._midi_values[key] = values
+        self._compile_key(key)
 
     def set_keybind(self, key, keybind):
         """set_keybind
@@ -85,6 +151,7 @@ class MidiToXdo(object):
         :param keybind:
         """
         self._midi_values[key]['keybind'] = keybind
+        self._compile_key(key)
 
     def get_key_type(self, key):
         """get_key_type
@@ -121,76 +188,228 @@ class MidiToXdo(object):
         """
         if key in self._midi_values:
             self._midi_values[key]['mode'] = val
+            self._compile_key(key)
+
+    def set_options(self, settings):
+        """set_options
+
+        :param settings: see options.set_options
+        """
+        set_options(settings)
+        self._options = list(OPTIONS)  # saved with the config
+        self.compile_table()
+
+    def compile_table(self):
+        """compile_table : precompute from the options of the config
+        (OPTIONS before a config is read) and the keytable everything
+        parse_command and send_keystroke need, so that an event costs
+        a few indexed lookups"""
+        values = OPTIONS if self._options is None else self._options
+        self._ctl_steps = values[NB_CTL_STEPS_IDX]
+        self._ctl_hexcodes = {}
+        self._ctl_middle = (values[CTL_VALUE_MIDDLE_MIN_IDX],
+                            values[CTL_VALUE_MIDDLE_MAX_IDX])
+        self._levels = {
+            NOTEOFF: [0] * 128,
+            NOTEON: [note_level(vel, values) for vel in range(128)],
+            # without steps, the direction depends on the previous value
+            CONTROLLER: (
+                [split_ctl_value(val, values) << 12 for val in range(128)]
+                if self._ctl_steps != 0 else None)
+        }
+        self._actions = {}
+        for key in self._midi_values:
+            self._compile_key(key)
+        self._compile_matcher()
+
+    def _compile_matcher(self):
+        """_compile_matcher : ChordMatcher of the chords and sequences,
+        the ones whose keybind the injector can not send are skipped"""
+        self._matcher = None
+        if self.chords or self.sequences:
+            self._matcher = ChordMatcher(
+                self.send_keystroke,
+                lambda keyevt, action: self.injector.inject(keyevt, action),
+                self._resolve_chords(self.chords, 'Chord'),
+                self._resolve_chords(self.sequences, 'Sequence'),
+                self.chord_window, self.sequence_gap)
+
+    def _resolve_chords(self, entries, kind):
+        """_resolve_chords : [(notes, action)] of chords or sequences
+
+        :param entries: [{notes, keybind}]
+        :param kind: Chord or Sequence, for the log
+        """
+        resolved = []
+        for entry in entries:
+            checked = check_chord(entry)
+            action = (None if checked is None
+                      else self.injector.resolve(checked['keybind']))
+            if action is None:
+                logging.warning("%s ignored: %s", kind, entry)
+                continue
+            resolved.append((checked['notes'], action))
+        return resolved
+
+    def _compile_key(self, key):
+        """_compile_key
+
+        :param key:
+        """
+        keybind = self._midi_values.keybind(key)
+        self._actions[key] = (
+            None if keybind is None else self.injector.resolve(keybind),
+            self._midi_values.mode(key))
 
     def read_configs(self,
-                     file_format=CONFIG_FORMAT,
-                     file_name=CONFIG_FILE,
+                     file_format=None,
+                     file_name=None,
                      config_line_process=None
                      ):
         """read_configs
 
-        :param file_format:
+        :param file_format: CONFIG_LOADER key, from the extension by default
         :param file_name:
         :param config_line_process:
         """
+        file_name = file_name or options.CONFIG_FILE
+        self.config_file = file_name
+        self._config_stamp = self._stat_config()
         if isfile(file_name):
             try:
-                with open(file_name, "r") as config:
-                    options = CONFIG_LOADER[file_format].load(config)
-                    set_options(options)
-                    if 'keytable' in options:
-                        for hexkey in options['keytable']:
-                            values = options['keytable'][hexkey]
-                            key = int(hexkey, 16)
-                            if not ('type' in values and 'channel' in values):
-                                continue
-                            if ('keybind' not in values or values['keybind'] == '<Undefined>'):
-                                values['keybind'] = None
-                                continue
-                            if 'mode' not in values:
-                                values['mode'] = 0
-                            self.insert(key, values)
-                            if config_line_process:
-                                config_line_process(
-                                    key, self._midi_values[key])
-            except BufferError:
+                settings = load_config(file_name, file_format)
+                self.set_options(settings)
+                self.device = settings.get('device')
+                self.chords = self._check_chords(
+                    settings.get('chords'), 'Chord')
+                self.sequences = self._check_chords(
+                    settings.get('sequences'), 'Sequence')
+                self.chord_window = settings.get('chord-window', CHORD_WINDOW)
+                self.sequence_gap = settings.get('sequence-gap', SEQUENCE_GAP)
+                self._compile_matcher()
+                keytable = settings.get('keytable', {})
+                for hexkey in keytable:
+                    values = check_entry(keytable[hexkey])
+                    if values is None:
+                        continue
+                    key = (hexkey if isinstance(hexkey, int)
+                           else int(hexkey, 16))
+                    self.insert(key, values)
+                    if config_line_process:
+                        config_line_process(
+                            key, self._midi_values[key])
+            except (BufferError, ValueError):
                 print("error while parsing %s" % file_name)
             print("using config %s" % file_name)
         else:
             print("%s not found" % file_name)
-        return len(self._midi_values) > 0
+        return len(self._midi_values) > 0 or self._matcher is not None
+
+    @staticmethod
+    def _check_chords(entries, kind):
+        """_check_chords : the usable chords or sequences of a config file
 
-    def save_configs(self, file_format=CONFIG_FORMAT, file_name=CONFIG_FILE):
+        :param entries: [{notes, keybind}]
+        :param kind: Chord or Sequence, for the log
+        """
+        if entries is None:
+            return []
+        if not isinstance(entries, list):
+            logging.warning("%ss ignored: %s", kind, entries)
+            return []
+        checked = []
+        for entry in entries:
+            values = check_chord(entry)
+            if values is None:
+                logging.warning("%s ignored: %s", kind, entry)
+                continue
+            checked.append(values)
+        return checked
+
+    def _stat_config(self):
+        """_stat_config : what changes when the config file is saved
+        (a saved config is a new file, see options.save_config),
+        None without config file"""
+        if self.config_file is None:
+            return None
+        try:
+            stat = os.stat(self.config_file)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def reload_configs(self):
+        """reload_configs : read the config file again if it changed,
+        into a fresh table which replaces the current one
+        (to be called between two events, by the dispatching thread)"""
+        stamp = self._stat_config()
+        if stamp is None or stamp == self._config_stamp:
+            return False
+        fresh = MidiToXdo(self.injector)
+        if not fresh.read_configs(file_name=self.config_file):
+            logging.error("Config %s not reloaded", self.config_file)
+            self._config_stamp = stamp  # wait for the next change
+            return False
+        self.release_keys()
+        self.device = fresh.device
+        self._midi_values = fresh._midi_values
+        self._levels = fresh._levels
+        self._actions = fresh._actions
+        self._ctl_steps = fresh._ctl_steps
+        self._ctl_middle = fresh._ctl_middle
+        self._options = fresh._options
+        self.chords = fresh.chords
+        self.sequences = fresh.sequences
+        self.chord_window = fresh.chord_window
+        self.sequence_gap = fresh.sequence_gap
+        self._compile_matcher()
+        self._config_stamp = fresh._config_stamp
+        logging.info("Config reloaded: %s", self.config_file)
+        return True
+
+    def check_configs(self):
+        """check_configs : reload_configs, at most every
+        CONFIG_CHECK_INTERVAL"""
+        now = time.monotonic()
+        if now - self._config_checked >= CONFIG_CHECK_INTERVAL:
+            self._config_checked = now
+            self.reload_configs()
+
+    def save_configs(self, file_format=None, file_name=None):
         """save_configs
 
-        :param file_format:
+        :param file_format: CONFIG_LOADER key, from the extension by default
         :param file_name:
         """
-        if file_format in CONFIG_LOADER:
-            options = get_options()
-            keytable = {}
-            for hexkey in [k for k in  self._midi_values
-                           if self._midi_values[k].get('keybind') ]:
-                keytable[hex(hexkey)] = self._midi_values[hexkey]
-            options['keytable'] = keytable
-            with open(file_name, "w") as config:
-                CONFIG_LOADER[file_format].dump(
-                    options, config, sort_keys=True, indent=4)
+        file_name = file_name or options.CONFIG_FILE
+        if (file_format or config_format(file_name)) in CONFIG_LOADER:
+            settings = get_options(self._options)
+            settings['keytable'] = dict(
+                (hexkey, dict(values.items()))
+                for (hexkey, values) in self._midi_values.items()
+                if values['keybind'])
+            if self.device is not None:
+                settings['device'] = self.device
+            if self.chords or self.sequences:
+                settings['chords'] = self.chords
+                settings['sequences'] = self.sequences
+                settings['chord-window'] = self.chord_window
+                settings['sequence-gap'] = self.sequence_gap
+            save_config(settings, file_name, file_format)
 
     def send_keystroke(self, midikey, hexkey):
         """send_keystroke
 
         :param midikey: MIDI input
         :param hexkey: key to access to keybind
-        :param keyini: key type
         """
-        # print (midikey,hexkey,keyini)
         keyevt = None
         key = hexkey
         channel = midikey[CHANNEL]
+        action = self._actions.get(key)
 
         keytype = (
-            midikey[MIDITYPE] - (ABS_DELTA if self.get_key_mode(key) else 0)
+            midikey[MIDITYPE] - (ABS_DELTA if action and action[1] else 0)
         )
 
         if keytype in ((NOTEOFF - ABS_DELTA),
@@ -209,17 +428,13 @@ class MidiToXdo(object):
                 self._midi_key_values[channel] = key
 
         elif keytype == (CONTROLLER - ABS_DELTA):
-            if OPTIONS[NB_CTL_STEPS_IDX] != 0:
+            if self._ctl_steps != 0:
                 # begin to release existing key if exist
-                if channel in self._midi_ctl_values:
-                    prevkeybind = self._midi_ctl_values[channel]
-                    keyevt = "keyup"
-                    if prevkeybind is not None:
-                        subprocess.Popen(["xdotool", keyevt, prevkeybind])
-
+                prevkeybind = self._midi_ctl_values.get(channel)
+                if prevkeybind is not None:
+                    self.injector.inject("keyup", prevkeybind)
                 keyevt = "keydown"
-                keybind = self._midi_values[key]['keybind']
-                self._midi_ctl_values[key] = keybind
+                self._midi_ctl_values[channel] = action[0]
             else:
                 # The following complicated operations just find
                 # the key reference registered for increasing and
@@ -228,123 +443,568 @@ class MidiToXdo(object):
                 # a controler used in relative mode (here the pot
                 # only have to be on negative side to simulate
                 # keydown for a decreasing key).
+                (middle_min, middle_max) = self._ctl_middle
+                value = midikey[VELOCITY]
                 if channel in self._midi_ctl_values:
-                    if (
-                            midikey[
-                                VELOCITY] >= OPTIONS[
-                                    CTL_VALUE_MIDDLE_MIN_IDX] and
-                            midikey[
-                                VELOCITY] <= OPTIONS[
-                                    CTL_VALUE_MIDDLE_MAX_IDX]
-                    ):
+                    if middle_min <= value <= middle_max:
                         # Neutral - > release a previous key
                         key = self._midi_ctl_values.pop(channel, None)
                         keyevt = "keyup"
                 else:
                     keyevt = "keydown"
-                    if midikey[VELOCITY] < OPTIONS[CTL_VALUE_MIDDLE_MIN_IDX]:
+                    if value < middle_min:
                         # Negative -> continuously press key for decrease
                         key = (key % (1 << 12)) | CTL_DECREASING << 12
                         self._midi_ctl_values[channel] = key
-                    elif midikey[VELOCITY] > OPTIONS[CTL_VALUE_MIDDLE_MAX_IDX]:
+                    elif value > middle_max:
                         # Positive - > continuously press key for increase
                         key = (key % (1 << 12)) | CTL_INCREASING << 12
                         self._midi_ctl_values[channel] = key
                     else:
                         return
 
-        # print(keyevt, key)
         if keyevt:
-            if key in self._midi_values:
-                keybind = self._midi_values[key]['keybind']
-                if keybind is not None:
-                    subprocess.Popen(
-                        ["xdotool", keyevt, keybind])
-
-    def parse_midi(self):
-        """parse_midi"""
-        command = self.midikb.read()
-        if not command:
-            return (None, None)
+            action = self._actions.get(key)
+            if action is not None and action[0] is not None:
+                self.injector.inject(keyevt, action[0])
+
+    def _release(self, key):
+        """_release : keyup for a key of the keytable
+
+        :param key: hexcode
+        """
+        action = self._actions.get(key)
+        if action is not None and action[0] is not None:
+            self.injector.inject("keyup", action[0])
+
+    def release_keys(self):
+        """release_keys : release the keys held by notes and controllers,
+        and forget the recent values (e.g. the device is unplugged)"""
+        for key in self._midi_key_values.values():
+            self._release(key)
+        for (channel, value) in self._midi_ctl_values.items():
+            if channel > 0x7F:
+                continue  # previous value of a controller, not a key
+            if isinstance(value, int):
+                self._release(value)
+            elif value is not None:
+                self.injector.inject("keyup", value)
+        self._midi_key_values.clear()
+        self._midi_ctl_values.clear()
+        self._ctl_hexcodes.clear()
+        self._ctl_times.clear()
+        self._ctl_pending.clear()
+        if self._matcher is not None:
+            self._matcher.release()
+
+    def _ctl_direction(self, hexcode, ctlval):
+        """_ctl_direction : hexcode of a controller without steps,
+        depending on the previous value of the controller
+
+        :param hexcode:
+        :param ctlval:
+        """
+        nhexcode = None
+        if ctlval == 0:
+            nhexcode = hexcode | CTL_DECREASING << 12
+        elif ctlval == 127:
+            nhexcode = hexcode | CTL_INCREASING << 12
+        elif hexcode in self._midi_ctl_values:
+            prevctlval = self._midi_ctl_values[hexcode]
+            if ctlval == prevctlval:
+                nhexcode = hexcode
+            elif ctlval < prevctlval:
+                nhexcode = hexcode | CTL_DECREASING << 12
+            else:
+                nhexcode = hexcode | CTL_INCREASING << 12
+        self._midi_ctl_values[hexcode] = ctlval
+        return nhexcode
+
+    def parse_command(self, command):
+        """parse_command : return (command, hexcode)
+
+        :param command: midi message
+        """
         # Only pay attention to 0x9X Note on and 0xBX Continuous controller
         miditype = command[MIDITYPE]
-        channel = command[CHANNEL]
-        hexcode = None
-
-        if miditype == NOTEOFF:
-            hexcode = (NOTEOFF << 4 | channel)
-        elif miditype == NOTEON:
-            vel = command[VELOCITY]
-            if vel == 0:
-                hexcode = (NOTEOFF << 4 | channel)
-                command[MIDITYPE] = NOTEOFF
-            else:
-                hexcode = (NOTEON << 4 | channel)
-                if vel > OPTIONS[NOTE_PRESSURE_MIDDLE_IDX]:
-                    if vel > OPTIONS[NOTE_PRESSURE_STRONG_IDX]:
-                        hexcode = hexcode | NOTE_PRESSURE_STRONG_DELTA << 12
-                    else:
-                        hexcode = hexcode | NOTE_PRESSURE_MIDDLE_DELTA << 12
-        elif miditype == CONTROLLER:
-            hexcode = (CONTROLLER << 4 | channel)
-            ctlval = command[CONTROLLER_VALUE]
-            if OPTIONS[NB_CTL_STEPS_IDX] != 0:
-                val = split_ctl_value(ctlval)
-                hexcode = (hexcode | (val << 12))
-            else:
-                nhexcode = None
-                if ctlval == 0:
-                    nhexcode = hexcode | CTL_DECREASING << 12
-                elif ctlval == 127:
-                    nhexcode = hexcode | CTL_INCREASING << 12
-                elif hexcode in self._midi_ctl_values:
-                    prevctlval = self._midi_ctl_values[hexcode]
-                    if ctlval == prevctlval:
-                        nhexcode = hexcode
-                    elif ctlval < prevctlval:
-                        nhexcode = hexcode | CTL_DECREASING << 12
-                    else:
-                        nhexcode = (hexcode << 1) | CTL_INCREASING
-                self._midi_ctl_values[hexcode] = ctlval
-                hexcode = nhexcode
-        return (command, hexcode)
+        if miditype not in self._levels:
+            if miditype == DEVICE_LOST:
+                self.release_keys()
+            return (command, None)
+        if miditype == NOTEON and command[VELOCITY] == 0:
+            command = (NOTEOFF, command[CHANNEL], 0)
+            miditype = NOTEOFF
+        hexcode = miditype << 4 | command[CHANNEL]
+        levels = self._levels[miditype]
+        if levels is None:
+            return (command, self._ctl_direction(hexcode,
+                                                 command[CONTROLLER_VALUE]))
+        return (command, hexcode | levels[command[VELOCITY]])
+
+    def parse_midi(self, timeout=0):
+        """parse_midi
+
+        :param timeout: seconds to wait for a midi message (see MidiKeyboard.read)
+        """
+        command = self.midikb.read(timeout)
+        if not command:
+            return (None, None)
+        return self.parse_command(command)
+
+    def process(self, command, device=None):
+        """process : parse a midi message and send the matching keystroke
+
+        :param command: midi message
+        :param device: path of the device which sent the message
+        """
+        if device is not None and self.device not in (None, device):
+            return
+        if self.latency is not None:
+            self._process_timed(command)
+            return
+        (command, hexcode) = self.parse_command(command)
+        if hexcode is not None:
+            if command[MIDITYPE] == CONTROLLER:
+                if self.coalesce_ctl(command, hexcode):
+                    return
+            elif self._matcher is not None:
+                self._matcher.feed(command, hexcode, time.perf_counter())
+                return
+            self.send_keystroke(command, hexcode)
+            logging.debug('Key: %s %s', command, hex(hexcode))
+
+    def process_batch(self, events):
+        """process_batch : process the events read at once
+
+        :param events: [(device path, message, time read)]
+                       (see MidiKeyboard.read_events)
+        """
+        process = self.process
+        latency = self.latency
+        if latency is None:
+            for (device, command, _) in events:
+                process(command, device)
+            return
+        for (device, command, stamp) in events:
+            latency.add('queue', time.perf_counter() - stamp)
+            process(command, device)
+            latency.add('total', time.perf_counter() - stamp)
+
+    def _process_timed(self, command):
+        """_process_timed : process, measuring parse and inject durations
+
+        :param command: midi message
+        """
+        start = time.perf_counter()
+        (command, hexcode) = self.parse_command(command)
+        parsed = time.perf_counter()
+        self.latency.add('parse', parsed - start)
+        if hexcode is not None:
+            if command[MIDITYPE] == CONTROLLER:
+                if self.coalesce_ctl(command, hexcode):
+                    return
+            elif self._matcher is not None:
+                self._matcher.feed(command, hexcode, parsed)
+                self.latency.add('inject', time.perf_counter() - parsed)
+                return
+            self.send_keystroke(command, hexcode)
+            self.latency.add('inject', time.perf_counter() - parsed)
+
+    def coalesce_ctl(self, command, hexcode):
+        """coalesce_ctl : tell if a controller event has to be suppressed
+
+        With --ctl-steps, a value giving the same step as the previous one
+        changes nothing. With --ctl-interval, a controller sends at most
+        one event per interval : the last value suppressed is sent when
+        the interval is over (see flush_ctl), and a value releasing
+        a held key is never suppressed.
+
+        :param command: controller message
+        :param hexcode:
+        """
+        controller = command[CHANNEL]
+        if self._ctl_steps != 0:
+            if self._ctl_hexcodes.get(controller) == hexcode:
+                self._ctl_pending.pop(controller, None)
+                self.suppressed += 1
+                return True
+        if self.ctl_interval:
+            now = time.perf_counter()
+            if (now - self._ctl_times.get(controller, 0) < self.ctl_interval
+                    and not self._releases_ctl_key(command, hexcode)):
+                self._ctl_pending[controller] = (command, hexcode)
+                self.suppressed += 1
+                return True
+            self._ctl_times[controller] = now
+            self._ctl_pending.pop(controller, None)
+        self._ctl_hexcodes[controller] = hexcode
+        return False
+
+    def _releases_ctl_key(self, command, hexcode):
+        """_releases_ctl_key : tell if a controller value releases the key
+        held by an absolute controller (see send_keystroke)
+
+        :param command: controller message
+        :param hexcode:
+        """
+        action = self._actions.get(hexcode)
+        if self._ctl_steps != 0 or not (action and action[1]):
+            return False
+        (middle_min, middle_max) = self._ctl_middle
+        return (command[CHANNEL] in self._midi_ctl_values and
+                middle_min <= command[CONTROLLER_VALUE] <= middle_max)
+
+    def ctl_deadline(self):
+        """ctl_deadline : time when the last suppressed controller value
+        has to be sent, None if there is none"""
+        if not self._ctl_pending:
+            return None
+        return min(self._ctl_times.get(controller, 0)
+                   for controller in self._ctl_pending) + self.ctl_interval
+
+    def flush_ctl(self):
+        """flush_ctl : send the last suppressed value of each controller
+        once its interval is over"""
+        if not self._ctl_pending:
+            return
+        now = time.perf_counter()
+        for (controller, (command, hexcode)) in list(
+                self._ctl_pending.items()):
+            if now - self._ctl_times.get(controller, 0) >= self.ctl_interval:
+                del self._ctl_pending[controller]
+                if not self.coalesce_ctl(command, hexcode):
+                    self.send_keystroke(command, hexcode)
+
+    def chords_deadline(self):
+        """chords_deadline : time when notes held back by the chord
+        matcher have to be sent, None if there are none"""
+        return None if self._matcher is None else self._matcher.deadline()
+
+    def flush_chords(self):
+        """flush_chords : send the notes held back by the chord matcher
+        once their window is over"""
+        if self._matcher is not None:
+            self._matcher.flush(time.perf_counter())
+
+    def flush_deadline(self):
+        """flush_deadline : time when notes held back by the chord matcher,
+        suppressed controller values (see coalesce_ctl), or key events
+        gathered by a BatchInjector, have to be sent, None if there are none"""
+        deadlines = [deadline for deadline in (
+            self.chords_deadline(), self.ctl_deadline(),
+            self.injector.deadline()
+            if isinstance(self.injector, BatchInjector) else None)
+            if deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    def flush_pending(self):
+        """flush_pending : flush_chords and flush_ctl, then send the key
+        events gathered by a BatchInjector once their window is over"""
+        self.flush_chords()
+        self.flush_ctl()
+        if isinstance(self.injector, BatchInjector):
+            self.injector.flush(time.perf_counter())
+
+    def wait_time(self):
+        """wait_time : read_timeout, shortened to flush the chords
+        and the gathered key events"""
+        deadline = self.flush_deadline()
+        if deadline is None:
+            return self.read_timeout
+        return max(0, min(self.read_timeout, deadline - time.perf_counter()))
+
+    async def run_async(self, midikb=None):
+        """run_async : dispatch the messages of midikb.events()
+        in the running asyncio loop, without any thread
+        (the injector is replaced by its asyncio version, if any).
+        On exit or cancellation, the held keys are released
+        and the injector is closed.
+
+        :param midikb: MidiKeyboard with devices, not started
+        """
+        if midikb is not None:
+            self.set_midi_device(midikb)
+        injector = async_injector(self.injector)
+        if injector is not self.injector:
+            self.set_injector(injector)
+        if hasattr(self.injector, 'start'):
+            await self.injector.start()
+        watcher = asyncio.ensure_future(watch_configs(self))
+        try:
+            async for (device, command) in self.midikb.events(tagged=True):
+                self.process(command, device)
+                deadline = self.flush_deadline()
+                if deadline is not None:
+                    asyncio.get_event_loop().call_later(
+                        max(0, deadline - time.perf_counter()),
+                        self.flush_pending)
+        finally:
+            watcher.cancel()
+            self.release_keys()
+            await aclose_injector(self.injector)
 
     @setInterval
     def loop_midi_device(self):
         """loop_midi_device"""
         command = None
         if self.midikb:
-            if not self.midikb.is_running():
-                print(DEVICE + " is not running")
+            if not self.midikb.wait_running(self.read_timeout):
+                print(' '.join(self.midikb.get_devices()) + " is not running")
                 return
         else:
             print("Midi device disappeared")
             exit()
-        (command, hexcode) = self.parse_midi()
-        if hexcode is not None:
-            self.send_keystroke(command, hexcode)
-            logging.debug('Key: %s %s', command, hex(hexcode))
+        # sleep on the queue until the reader thread produces messages
+        self.process_batch(self.midikb.read_events(timeout=self.wait_time()))
+        self.flush_pending()
+        self.check_configs()
 
     def on_closing(self):
         """on_closing"""
         logging.debug('User want to close the app')
         self.midikb.stop_thread()
+        self.release_keys()
+        self.injector.close()
         logging.debug('Thanks for using this app :)')
 
 
+class MidiToXdoGroup(object):
+
+    """MidiToXdoGroup : read the midi device once
+    and give every message to each layout (MidiToXdo)"""
+
+    def __init__(self, layouts):
+        self.midikb = None
+        self.read_timeout = READ_TIMEOUT
+        self.layouts = layouts
+        self.latency = None
+        # held while loop_midi_device dispatches, see on_closing
+        self._dispatching = threading.Lock()
+        self._closed = False
+
+    def set_latency(self, latency):
+        """set_latency
+
+        :param latency: stats.LatencyStats, None to stop measuring
+        """
+        self.latency = latency
+        for midixdo in self.layouts:
+            midixdo.latency = latency
+
+    def set_midi_device(self, midikb):
+        """set_midi_device
+
+        :param midikb:
+        """
+        self.midikb = midikb
+        for midixdo in self.layouts:
+            midixdo.set_midi_device(midikb)
+
+    def reload_configs(self):
+        """reload_configs : see MidiToXdo.reload_configs"""
+        reloaded = False
+        for midixdo in self.layouts:
+            reloaded = midixdo.reload_configs() or reloaded
+        return reloaded
+
+    def check_configs(self):
+        """check_configs : see MidiToXdo.check_configs"""
+        for midixdo in self.layouts:
+            midixdo.check_configs()
+
+    def process(self, command, device=None):
+        """process
+
+        :param command: midi message
+        :param device: path of the device which sent the message
+        """
+        for midixdo in self.layouts:
+            midixdo.process(command, device)
+
+    def process_batch(self, events):
+        """process_batch : see MidiToXdo.process_batch
+
+        :param events:
+        """
+        process = self.process
+        latency = self.latency
+        if latency is None:
+            for (device, command, _) in events:
+                process(command, device)
+            return
+        for (device, command, stamp) in events:
+            latency.add('queue', time.perf_counter() - stamp)
+            process(command, device)
+            latency.add('total', time.perf_counter() - stamp)
+
+    def chords_deadline(self):
+        """chords_deadline : see MidiToXdo.chords_deadline"""
+        deadlines = [deadline for deadline in
+                     (midixdo.chords_deadline() for midixdo in self.layouts)
+                     if deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    def flush_chords(self):
+        """flush_chords : see MidiToXdo.flush_chords"""
+        for midixdo in self.layouts:
+            midixdo.flush_chords()
+
+    def flush_deadline(self):
+        """flush_deadline : see MidiToXdo.flush_deadline"""
+        deadlines = [deadline for deadline in
+                     (midixdo.flush_deadline() for midixdo in self.layouts)
+                     if deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    def flush_pending(self):
+        """flush_pending : see MidiToXdo.flush_pending"""
+        for midixdo in self.layouts:
+            midixdo.flush_pending()
+
+    def wait_time(self):
+        """wait_time : see MidiToXdo.wait_time"""
+        deadline = self.flush_deadline()
+        if deadline is None:
+            return self.read_timeout
+        return max(0, min(self.read_timeout, deadline - time.perf_counter()))
+
+    async def run_async(self, midikb=None):
+        """run_async : see MidiToXdo.run_async
+
+        :param midikb: MidiKeyboard with devices, not started
+        """
+        if midikb is not None:
+            self.set_midi_device(midikb)
+        injectors = {}  # shared injector -> its asyncio version
+        for midixdo in self.layouts:
+            if midixdo.injector not in injectors:
+                injectors[midixdo.injector] = async_injector(midixdo.injector)
+            injector = injectors[midixdo.injector]
+            if injector is not midixdo.injector:
+                midixdo.set_injector(injector)
+        for injector in set(injectors.values()):
+            if hasattr(injector, 'start'):
+                await injector.start()
+        watcher = asyncio.ensure_future(watch_configs(self))
+        try:
+            async for (device, command) in self.midikb.events(tagged=True):
+                self.process(command, device)
+                deadline = self.flush_deadline()
+                if deadline is not None:
+                    asyncio.get_event_loop().call_later(
+                        max(0, deadline - time.perf_counter()),
+                        self.flush_pending)
+        finally:
+            watcher.cancel()
+            for midixdo in self.layouts:
+                midixdo.release_keys()
+            for injector in set(injectors.values()):
+                await aclose_injector(injector)
+
+    @setInterval
+    def loop_midi_device(self):
+        """loop_midi_device"""
+        if self.midikb:
+            if not self.midikb.wait_running(self.read_timeout):
+                print(' '.join(self.midikb.get_devices()) + " is not running")
+                return
+        else:
+            print("Midi device disappeared")
+            exit()
+        # sleep on the queue until the reader thread produces messages
+        events = self.midikb.read_events(timeout=self.wait_time())
+        with self._dispatching:
+            if self._closed:
+                return
+            self.process_batch(events)
+            self.flush_pending()
+            self.check_configs()
+
+    def on_closing(self):
+        """on_closing : release the held keys, once loop_midi_device
+        is done with the events it read"""
+        logging.debug('User want to close the app')
+        self.midikb.stop_thread()
+        logging.info('Events dropped: %(dropped)d, coalesced: %(coalesced)d',
+                     self.midikb.queue_stats())
+        with self._dispatching:
+            self._closed = True
+            for midixdo in self.layouts:
+                midixdo.release_keys()
+            for injector in set(midixdo.injector for midixdo in self.layouts):
+                injector.close()
+        logging.debug('Thanks for using this app :)')
+
+
+async def watch_configs(layout):
+    """watch_configs : reload the configs of a layout (MidiToXdo
+    or MidiToXdoGroup) when they change, from the asyncio loop
+
+    :param layout:
+    """
+    while True:
+        await asyncio.sleep(CONFIG_CHECK_INTERVAL)
+        layout.reload_configs()
+
+
+def read_layouts(config_files, injector=None):
+    """read_layouts : return a MidiToXdo for each usable config file
+
+    :param config_files:
+    :param injector: shared by all layouts
+    """
+    if injector is None:
+        window = options.BATCH_WINDOW
+        if window is None:
+            window = options.BATCH_WINDOWS.get(options.INJECTOR, 0)
+        injector = new_injector(options.INJECTOR, window / 1e6)
+    layouts = []
+    for config_file in config_files:
+        midixdo = MidiToXdo(injector)
+        if midixdo.read_configs(file_name=config_file):
+            layouts.append(midixdo)
+    return layouts
+
+
+def show_latency(latency):
+    """show_latency : print latency stats, and write them if asked
+
+    :param latency: stats.LatencyStats
+    """
+    latency.show()
+    if options.LATENCY_JSON:
+        latency.dump(options.LATENCY_JSON)
+
+
 def main():
     """main"""
-    midixdo = MidiToXdo()
-    if midixdo.read_configs():
-        midilistener = MidiKeyboard(DEVICE)
+    logging.basicConfig(level=logging.INFO)
+    if options.WORKERS:
+        import supervisor
+        supervisor.run(options.DEVICES, options.CONFIG_FILES, options.WORKERS)
+        return
+    layouts = read_layouts(options.CONFIG_FILES)
+    if layouts:
+        midilistener = MidiKeyboard(options.DEVICES)
+        midixdo = MidiToXdoGroup(layouts)
         midixdo.set_midi_device(midilistener)
-        midixdo.loop_midi_device()
-        while input() is not 'q':
+        if options.LATENCY:
+            latency = LatencyStats()
+            midixdo.set_latency(latency)
+            signal.signal(signal.SIGUSR1,
+                          lambda signum, frame: show_latency(latency))
+        dispatcher = midixdo.loop_midi_device()
+        while input() != 'q':
             pass
+        dispatcher.set()
+        midixdo.on_closing()
+        if options.LATENCY:
+            show_latency(latency)
 
 
 if __name__ == '__main__':
-    if DEVICE and CONFIG_FILE:
+    options.parse_argv()
+    if options.DEVICES and options.CONFIG_FILE:
         main()
     else:
         usage()
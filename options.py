@@ -2,20 +2,67 @@
 Get arguments for all parts of Midi2Keybind
 """
 from sys import argv
-from os.path import dirname
-import subprocess
+from os.path import dirname, basename, splitext
+import os
 import json
+import configbin
 
 OPT_DESC = {
-    '<midi>': ['Midi device e.g. /dev/midi1'],
-    './config.json': ['Path to configuration file'],
+    '<midi>': ['Midi device(s) e.g. /dev/midi1,\n' +
+               '                 or alsa sequencer port(s) e.g. seq:20:0'],
+    './config.json': ['Path to configuration file(s) (.json or .mevk)'],
+    '--batch-window': [
+        'To send the keystrokes of a burst with one injector call', {
+            '<microseconds>': (int, (
+                'window (default : 500 for xdotool, 0 (no batching)\n'
+                '         for the other injectors, which it slows down)'))
+        }
+    ],
     '--ctl-steps': [
         'To assign many keys to one pot controller', {
             '<nb-ctl-steps>': (int, 'number of keys (default : 10)')
         }
     ],
+    '--ctl-interval': [
+        'To send at most one key per controller in an interval', {
+            '<milliseconds>': (int, 'minimum interval (default : 0)')
+        }
+    ],
     '--help|-h': ['Show this help'],
+    '--injector': [
+        'How keystrokes are sent', {
+            '<name>': (str, (
+                'xdotool (default), xdotool-pipe, xtest (X11),\n         ' +
+                'uinput (/dev/uinput, X11, wayland, console) or null'))
+        }
+    ],
+    '--latency': [
+        'Measure the latency of events (shown on SIGUSR1 and on exit)'],
+    '--latency-json': [
+        'Also write the latency measures in a file', {
+            '<file>': (str, 'json file')
+        }
+    ],
     '--list|-l': ['List midi devices'],
+    '--overflow': [
+        'What to do when too many events are waiting', {
+            '<policy>': (str, (
+                'drop-oldest (default), drop-newest, block\n         ' +
+                'or coalesce (keep the last value of each controller)'))
+        }
+    ],
+    '--queue-size': [
+        'Maximum number of waiting events', {
+            '<size>': (int, 'default : 0, no limit')
+        }
+    ],
+    '--workers': [
+        'Run one process per device, restarted if it crashes', {
+            '<shard>': (str, (
+                'device (default) or config (one process\n         ' +
+                'per config file, each one reading all the devices)'))
+        }
+    ],
     '--note-pressures': [
         'To consider 3 levels of pressure for a note', {
             '<value-middle>': (int, 'minimum value of a middle pressure'),
@@ -29,15 +76,31 @@ OPT_DESC = {
 # Notes and CTL are in range [0,127]
 # GLOBALS default values
 CONFIG_FILE = './config.json'
+CONFIG_FILES = [CONFIG_FILE]
 TITLE = 'MidiEvK - midi event to key configurator'
 DEVICE = None
+DEVICES = []
 STATS = None
+STATS_INTERVAL = 0
+INJECTOR = 'xdotool'
+CTL_INTERVAL = 0
+BATCH_WINDOW = None  # default of the injector, see BATCH_WINDOWS
+# --batch-window of the injectors which are faster with it (microseconds)
+BATCH_WINDOWS = {'xdotool': 500}
+WORKERS = None
+LATENCY = False
+LATENCY_JSON = None
+QUEUE_SIZE = 0
+OVERFLOW = 'drop-oldest'
 # OPTIONS and options indexes // be carefull with the order
 OPTIONS = [127, 80, 0, 60, 66]
 (
     NOTE_PRESSURE_MIDDLE_IDX, NOTE_PRESSURE_STRONG_IDX,
     NB_CTL_STEPS_IDX, CTL_VALUE_MIDDLE_MIN_IDX, CTL_VALUE_MIDDLE_MAX_IDX
 ) = (0, 1, 2, 3, 4)
+# OPTIONS of the command line (or defaults), the options of each config
+# file apply on top of them (see set_options)
+BASE_OPTIONS = list(OPTIONS)
 # CONSTANTS <<12
 NOTE_PRESSURE_MIDDLE_DELTA = 0x2
 NOTE_PRESSURE_STRONG_DELTA = 0x3
@@ -46,18 +109,40 @@ CTL_VALUE_MIDDLE_MAX = 66  # is considered as centered
 CTL_INCREASING = 0x1
 CTL_DECREASING = 0x0
 CONFIG_FORMAT = 'json'
-CONFIG_LOADER = {'json': json}
+CONFIG_LOADER = {'json': json, 'mevk': configbin}
+# options given on the command line (see parse_argv)
+CMD_OPTIONS = []
+
+
+# prefix of alsa sequencer ports given as devices (seq:client:port)
+SEQ_PREFIX = 'seq:'
+
+# where midi devices are looked for
+MIDI_DEVICE_DIRS = ('/dev', '/dev/snd')
+_MIDI_DEVICES = None
+
+
+def get_all_midi_devices(refresh=False):
+    """Return midi devices in /dev and /dev/snd
 
+    The directories are only scanned on the first call,
+    or when refresh is set.
 
-def get_all_midi_devices():
-    """Return midi devices in /dev"""
-    return subprocess.check_output([
-        'find', '/dev/',
-        '-type', 'd', '!',
-        '-perm', '-g+r,u+r,o+r',
-        '-prune', '-o',
-        '-name', 'midi*',
-        '-print'])
+    :param refresh:
+    """
+    global _MIDI_DEVICES
+    if _MIDI_DEVICES is None or refresh:
+        devices = []
+        for directory in MIDI_DEVICE_DIRS:
+            try:
+                with os.scandir(directory) as entries:
+                    devices.extend(sorted(
+                        entry.path for entry in entries
+                        if entry.name.startswith('midi')))
+            except OSError:
+                pass
+        _MIDI_DEVICES = devices
+    return list(_MIDI_DEVICES)
 
 
 def usage():
@@ -88,17 +173,25 @@ def usage():
 
 
 def parse_argv():
-    """parse_argv"""
-    global DEVICE
-    global STATS, CONFIG_FILE
+    """parse_argv : set the module globals from the command line
+    (to be called by the main programs, not at import)"""
+    global CMD_OPTIONS, DEVICE, DEVICES
+    global STATS, STATS_INTERVAL, CONFIG_FILE, CONFIG_FILES, INJECTOR
+    global QUEUE_SIZE, OVERFLOW, CTL_INTERVAL, LATENCY, LATENCY_JSON
+    global BATCH_WINDOW, WORKERS
+    if basename(argv[0]) in ['midiev.py', 'midiobserver.py', 'midixdo.py']:
+        OPT_DESC['--stats'] = ['Show statistics when exiting with \'q\'']
+        OPT_DESC['--stats-interval'] = [
+            'Also show statistics periodically', {
+                '<seconds>': (int, 'interval between two prints')
+            }
+        ]
+
     opt_equiv = {}
     for i in OPT_DESC:
         for j in i.split('|'):
             opt_equiv[j] = i
 
-    if argv[0] in ['midiobserver.py', 'midixdo.py']:
-        OPT_DESC['--stats'] = ['Show statistics when exiting with \'q\'']
-
     options = []
     options_param = {}
     files = []
@@ -127,22 +220,60 @@ def parse_argv():
         exit()
 
     if '--list' in options or '-l' in options:
-        print(get_all_midi_devices())
+        from alsaseq import list_ports
+        print('\n'.join(get_all_midi_devices()))
+        for (address, name) in list_ports():
+            print("{0:<16s} {1:s}".format(address, name))
         exit()
 
-    config_files = [i for i in files if i.endswith('.' + CONFIG_FORMAT)]
-    devices = ([
+    config_files = [i for i in files
+                    if splitext(i)[1][1:] in CONFIG_LOADER]
+    devices = [
         i for i in files
-        if i.startswith('/dev/') or i.startswith('/tmp/fakemidi')
-    ] or get_all_midi_devices().split()
-               )
-    CONFIG_FILE = (
-        config_files[0] if config_files else
+        if i.startswith('/dev/') or i.startswith('/tmp/fakemidi') or
+        i.startswith(SEQ_PREFIX)
+    ]
+    CONFIG_FILES = config_files or [
         (dirname(argv[0]) or '.') + '/config.json'
-    )
-    DEVICE = devices[0] if devices else None
+    ]
+    CONFIG_FILE = CONFIG_FILES[0]
+    # all the given devices, or the first one found
+    DEVICES = devices or get_all_midi_devices()[:1]
+    DEVICE = DEVICES[0] if DEVICES else None
+
+    if '--stats-interval' in options:
+        paramtab = options_param['--stats-interval']
+        STATS_INTERVAL = paramtab[0] if paramtab else STATS_INTERVAL
+    STATS = ('--stats' in options) or STATS_INTERVAL > 0
+
+    if '--injector' in options:
+        paramtab = options_param['--injector']
+        INJECTOR = paramtab[0] if paramtab else INJECTOR
+
+    if '--ctl-interval' in options:
+        paramtab = options_param['--ctl-interval']
+        CTL_INTERVAL = paramtab[0] if paramtab else CTL_INTERVAL
+
+    if '--batch-window' in options:
+        paramtab = options_param['--batch-window']
+        BATCH_WINDOW = paramtab[0] if paramtab else BATCH_WINDOW
 
-    STATS = ('--stats' in options)
+    if '--workers' in options:
+        paramtab = options_param['--workers']
+        WORKERS = paramtab[0] if paramtab else 'device'
+
+    if '--latency-json' in options:
+        paramtab = options_param['--latency-json']
+        LATENCY_JSON = paramtab[0] if paramtab else LATENCY_JSON
+    LATENCY = '--latency' in options or LATENCY_JSON is not None
+
+    if '--queue-size' in options:
+        paramtab = options_param['--queue-size']
+        QUEUE_SIZE = paramtab[0] if paramtab else QUEUE_SIZE
+
+    if '--overflow' in options:
+        paramtab = options_param['--overflow']
+        OVERFLOW = paramtab[0] if paramtab else OVERFLOW
 
     if '--ctl-steps' in options:
         paramtab = options_param['--ctl-steps']
@@ -162,25 +293,80 @@ def parse_argv():
     else:
         OPTIONS[NOTE_PRESSURE_MIDDLE_IDX] = 127
 
+    BASE_OPTIONS[:] = OPTIONS
+    CMD_OPTIONS = options
     return options
 
 
-def get_options():
-    """get_options"""
+def config_format(file_name):
+    """config_format : CONFIG_LOADER key given by the file extension
+
+    :param file_name:
+    """
+    extension = splitext(file_name)[1][1:]
+    return extension if extension in CONFIG_LOADER else CONFIG_FORMAT
+
+
+def load_config(file_name, file_format=None):
+    """load_config
+
+    :param file_name:
+    :param file_format: CONFIG_LOADER key, from the extension by default
+    """
+    loader = CONFIG_LOADER[file_format or config_format(file_name)]
+    binary = getattr(loader, 'BINARY', False)
+    with open(file_name, 'rb' if binary else 'r') as config:
+        return loader.load(config)
+
+
+def save_config(settings, file_name, file_format=None):
+    """save_config : write a temporary file, then rename it,
+    so that the config is never left half written
+
+    :param settings: the keytable keys are hex strings or integers
+    :param file_name:
+    :param file_format: CONFIG_LOADER key, from the extension by default
+    """
+    loader = CONFIG_LOADER[file_format or config_format(file_name)]
+    binary = getattr(loader, 'BINARY', False)
+    if 'keytable' in settings:
+        settings = dict(settings, keytable=dict(
+            (hex(k) if isinstance(k, int) else k, v)
+            for (k, v) in settings['keytable'].items()))
+    tmp_name = '%s.%d.tmp' % (file_name, os.getpid())
+    try:
+        with open(tmp_name, 'wb' if binary else 'w') as config:
+            loader.dump(settings, config, sort_keys=True, indent=4)
+            config.flush()
+            os.fsync(config.fileno())
+        os.replace(tmp_name, file_name)
+    finally:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+
+
+def get_options(values=None):
+    """get_options
+
+    :param values: OPTIONS of a config file, the current OPTIONS by default
+    """
+    values = OPTIONS if values is None else values
     return {
-        'ctl-steps': OPTIONS[NB_CTL_STEPS_IDX],
+        'ctl-steps': values[NB_CTL_STEPS_IDX],
         'note-pressures': {
-            'middle': OPTIONS[NOTE_PRESSURE_MIDDLE_IDX],
-            'strong': OPTIONS[NOTE_PRESSURE_STRONG_IDX]
+            'middle': values[NOTE_PRESSURE_MIDDLE_IDX],
+            'strong': values[NOTE_PRESSURE_STRONG_IDX]
         }
     }
 
 
 def set_options(options):
-    """set_options
+    """set_options : OPTIONS of a config file, the ones it does not give
+    are the command line ones (not those of a config read before)
 
     :param options: hash table looking like the one returned by get_options
     """
+    OPTIONS[:] = BASE_OPTIONS
     if 'ctl-steps' in options and '--ctl-steps' not in CMD_OPTIONS:
         OPTIONS[NB_CTL_STEPS_IDX] = options['ctl-steps']
 
@@ -191,6 +377,3 @@ def set_options(options):
         if 'strong' in pressparam:
             OPTIONS[NOTE_PRESSURE_STRONG_IDX] = pressparam['strong']
 
-
-# probably the most important line
-CMD_OPTIONS = parse_argv()
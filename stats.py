@@ -0,0 +1,190 @@
+"""
+Statistics kept with a constant memory, whatever the session length
+"""
+import json
+from math import sqrt
+
+# midi data bytes are 7-bit values
+MIDI_VALUES = 128
+
+# sub-buckets for each power of two of a LatencyHistogram
+SUB_BUCKETS_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKETS_BITS
+# durations up to 2**MAX_BITS microseconds (more than one hour)
+MAX_BITS = 32
+
+
+class LatencyHistogram(object):
+    """LatencyHistogram : durations in microseconds, counted in fixed
+    buckets : 8 buckets for each power of two (precision 12.5%)"""
+
+    def __init__(self):
+        self.count = 0
+        self.max = 0
+        self.buckets = [0] * ((MAX_BITS + 1) * SUB_BUCKETS + 1)
+
+    @staticmethod
+    def bucket(value):
+        """bucket : index of the bucket of a value
+
+        :param value: microseconds (int)
+        """
+        if value <= 0:
+            return 0
+        bits = min(value.bit_length(), MAX_BITS + 1)
+        top = ((value << SUB_BUCKETS_BITS) >> (bits - 1)) - SUB_BUCKETS
+        return 1 + (bits - 1) * SUB_BUCKETS + min(top, SUB_BUCKETS - 1)
+
+    @staticmethod
+    def bucket_limit(index):
+        """bucket_limit : highest value of a bucket
+
+        :param index:
+        """
+        if index == 0:
+            return 0
+        (bits, top) = divmod(index - 1, SUB_BUCKETS)
+        # the lowest value of the next bucket, rounded up, minus one
+        return -(-((SUB_BUCKETS + top + 1) << bits) >> SUB_BUCKETS_BITS) - 1
+
+    def add(self, seconds):
+        """add
+
+        :param seconds:
+        """
+        value = int(seconds * 1e6)
+        self.count += 1
+        if value > self.max:
+            self.max = value
+        self.buckets[self.bucket(value)] += 1
+
+    def percentile(self, percent):
+        """percentile : approximation in microseconds
+
+        :param percent: 0 - 100
+        """
+        if not self.count:
+            return 0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for (index, nb) in enumerate(self.buckets):
+            seen += nb
+            if nb and seen >= rank:
+                return min(self.bucket_limit(index), self.max)
+        return self.max
+
+    def summary(self):
+        """summary"""
+        return {
+            'count': self.count,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class LatencyStats(object):
+    """LatencyStats : one LatencyHistogram for each step
+    of an event, from its reading to its keystroke"""
+    steps = ('queue', 'parse', 'inject', 'total')
+
+    def __init__(self):
+        self.histograms = dict((step, LatencyHistogram())
+                               for step in self.steps)
+
+    def add(self, step, seconds):
+        """add
+
+        :param step: one of steps
+        :param seconds:
+        """
+        self.histograms[step].add(seconds)
+
+    def summary(self):
+        """summary"""
+        return dict((step, self.histograms[step].summary())
+                    for step in self.steps)
+
+    def show(self):
+        """show"""
+        template = "{0:<8s} {1:>8s} {2:>8s} {3:>8s} {4:>8s} {5:>8s}"
+        print(template.format("Step", "Count", "p50", "p95", "p99", "max"))
+        print(template.format("", "", "(us)", "(us)", "(us)", "(us)"))
+        print(template.format("----", "-----", "---", "---", "---", "---"))
+        summary = self.summary()
+        for step in self.steps:
+            values = summary[step]
+            print(template.format(
+                step, *[str(values[k])
+                        for k in ('count', 'p50', 'p95', 'p99', 'max')]))
+
+    def dump(self, file_name):
+        """dump : write the summary as json
+
+        :param file_name:
+        """
+        with open(file_name, "w") as output:
+            json.dump(self.summary(), output, sort_keys=True, indent=4)
+
+
+class ValueStats(object):
+    """ValueStats : count, min, max, mean and variance (Welford's online
+    algorithm) and histogram of 7-bit midi values"""
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.histogram = [0] * MIDI_VALUES
+
+    def add(self, value):
+        """add
+
+        :param value: 0 - 127
+        """
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.histogram[value] += 1
+
+    def merge(self, other):
+        """merge : add the values counted by an other ValueStats
+
+        :param other:
+        """
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        for (value, nb) in enumerate(other.histogram):
+            self.histogram[value] += nb
+
+    def stddev(self):
+        """stddev : standard deviation"""
+        return sqrt(self._m2 / self.count) if self.count else 0.0
+
+    def percentile(self, percent):
+        """percentile
+
+        :param percent: 0 - 100
+        """
+        rank = self.count * percent / 100.0
+        seen = 0
+        for (value, nb) in enumerate(self.histogram):
+            seen += nb
+            if nb and seen >= rank:
+                return value
+        return self.max
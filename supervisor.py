@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+"""
+Supervisor : one worker process per midi device (or per config file),
+each one with its own MidiKeyboard and MidiToXdo layouts, so that
+the traffic of many devices is parsed and injected on several cores.
+
+The workers report their counters through a pipe. The supervisor
+restarts the workers which die, and stops them cleanly (held keys are
+released) on SIGINT / SIGTERM. SIGUSR1 shows the counters.
+
+Usage : ./midievk.py --workers device config.json /dev/midi1 /dev/midi2
+    or  ./midievk.py --workers config a.json b.json seq:20:0
+(only alsa sequencer ports can be read by several workers at once :
+each one gets all the events, while the bytes of a raw midi device
+would be split between the workers)
+"""
+import time
+import signal
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+import options
+from options import usage, SEQ_PREFIX
+from midiev import MidiKeyboard
+from midievk import read_layouts, MidiToXdoGroup
+
+# seconds between two reports of a worker
+REPORT_INTERVAL = 1.0
+# seconds given to the workers to stop before they are killed
+STOP_TIMEOUT = 2.0
+# delay before restarting a worker, doubled at each crash up to RESTART_MAX
+RESTART_DELAY = 0.5
+RESTART_MAX = 30.0
+# a worker which ran that long is healthy : its restart delay is reset
+HEALTHY_RUN = 10.0
+SHARDS = ('device', 'config')
+
+
+def worker_counters(group, midikb, processed):
+    """worker_counters : counters reported by a worker
+
+    :param group: MidiToXdoGroup
+    :param midikb: MidiKeyboard
+    :param processed: number of events processed
+    """
+    counters = midikb.queue_stats()
+    counters['processed'] = processed
+    counters['suppressed'] = sum(midixdo.suppressed
+                                 for midixdo in group.layouts)
+    return counters
+
+
+def run_worker(devices, config_files, conn):
+    """run_worker : loop of a worker process, until the supervisor
+    sends anything on conn (or closes it)
+
+    :param devices:
+    :param config_files:
+    :param conn: end of the pipe to the supervisor
+    """
+    # stopped by the supervisor only
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    layouts = read_layouts(config_files)
+    if not layouts:
+        conn.send(('error', 'no usable config in %s' % ' '.join(config_files)))
+        return
+    group = MidiToXdoGroup(layouts)
+    midikb = MidiKeyboard(devices)
+    group.set_midi_device(midikb)
+    if not midikb.wait_running(STOP_TIMEOUT):
+        raise SystemExit('%s is not running' % ' '.join(devices))
+    processed = 0
+    reported = 0
+    try:
+        while not conn.poll():
+            if not midikb.is_running():
+                raise SystemExit('%s is not read' % ' '.join(devices))
+            events = midikb.read_events(timeout=group.wait_time())
+            group.process_batch(events)
+            processed += len(events)
+            group.flush_pending()
+            group.check_configs()
+            now = time.monotonic()
+            if now - reported >= REPORT_INTERVAL:
+                conn.send(('counters',
+                           worker_counters(group, midikb, processed)))
+                reported = now
+    finally:
+        for midixdo in layouts:
+            midixdo.release_keys()
+        midikb.stop_thread()
+        for injector in set(midixdo.injector for midixdo in layouts):
+            injector.close()
+        try:
+            conn.send(('stopped', worker_counters(group, midikb, processed)))
+        except (OSError, ValueError):
+            pass  # the supervisor is gone
+
+
+def shards(devices, config_files, shard='device'):
+    """shards : (name, devices, config files) of each worker
+
+    :param devices:
+    :param config_files:
+    :param shard: one of SHARDS
+    :raise ValueError: raw devices to be read by several workers
+    """
+    if shard not in SHARDS:
+        logging.error("Unknown shard %s, use device", shard)
+        shard = 'device'
+    if shard == 'config':
+        raw = [device for device in devices
+               if not device.startswith(SEQ_PREFIX)]
+        if raw and len(config_files) > 1:
+            raise ValueError(
+                'only alsa sequencer ports (%s...) can be read by a worker '
+                'for each config, not %s' % (SEQ_PREFIX, ' '.join(raw)))
+        return [(config_file, devices, [config_file])
+                for config_file in config_files]
+    return [(device, [device], config_files) for device in devices]
+
+
+class Worker(object):
+    """Worker : a worker process, its pipe and its counters"""
+
+    def __init__(self, name, devices, config_files):
+        self.name = name
+        self.devices = devices
+        self.config_files = config_files
+        self.process = None
+        self.conn = None
+        self.started = 0
+        self.restart_at = None
+        self.restarts = 0
+        self.delay = RESTART_DELAY
+        self.failed = False
+        self.counters = {}
+        self._past = {}            # counters of the previous processes
+
+    def start(self, context):
+        """start
+
+        :param context: multiprocessing context
+        """
+        (self.conn, child) = context.Pipe()
+        self.process = context.Process(
+            target=run_worker, name='midievk %s' % self.name,
+            args=(self.devices, self.config_files, child))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.started = time.monotonic()
+        self.restart_at = None
+
+    def receive(self):
+        """receive : read the messages of the worker"""
+        try:
+            while self.conn.poll():
+                (kind, data) = self.conn.recv()
+                if kind == 'error':
+                    logging.error("Worker %s: %s", self.name, data)
+                    self.failed = True
+                else:
+                    self.counters = data
+        except (EOFError, OSError):
+            pass
+
+    def exited(self):
+        """exited : forget the process, keep its counters,
+        return its exit code"""
+        self.receive()
+        self.process.join()
+        exitcode = self.process.exitcode
+        self.conn.close()
+        self.process = None
+        self.conn = None
+        for (name, value) in self.counters.items():
+            if name != 'pending':  # lost with the process
+                self._past[name] = self._past.get(name, 0) + value
+        self.counters = {}
+        return exitcode
+
+    def stop(self):
+        """stop : ask the worker to stop"""
+        try:
+            self.conn.send('stop')
+        except (OSError, ValueError):
+            pass
+
+    def total(self):
+        """total : counters of all the processes of the worker"""
+        total = dict(self._past)
+        for (name, value) in self.counters.items():
+            total[name] = total.get(name, 0) + value
+        return total
+
+
+class Supervisor(object):
+    """Supervisor : start the workers, restart them when they die"""
+
+    def __init__(self, worker_shards, context=None):
+        """__init__
+
+        :param worker_shards: see shards
+        :param context: multiprocessing context, fork by default
+                        (the workers get the options already parsed)
+        """
+        self.workers = [Worker(*shard) for shard in worker_shards]
+        self._context = context or multiprocessing.get_context('fork')
+        self._stopping = False
+
+    def stop(self, signum=None, frame=None):
+        """stop : signal handler, the workers are stopped by run"""
+        self._stopping = True
+
+    def run(self):
+        """run : until stop is called"""
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.show())
+        for worker in self.workers:
+            worker.start(self._context)
+        while not self._stopping:
+            self.poll(RESTART_DELAY)
+        self.shutdown()
+        self.show()
+
+    def poll(self, timeout):
+        """poll : read the reports, handle dead workers
+
+        :param timeout: seconds to wait for a report
+        """
+        running = [worker for worker in self.workers
+                   if worker.process is not None]
+        ready = wait([worker.conn for worker in running] +
+                     [worker.process.sentinel for worker in running],
+                     timeout)
+        now = time.monotonic()
+        for worker in running:
+            if worker.conn in ready:
+                worker.receive()
+            if worker.process.sentinel in ready:
+                self._restart_later(worker, now)
+        for worker in self.workers:
+            if (worker.restart_at is not None and now >= worker.restart_at and
+                    not self._stopping):
+                worker.start(self._context)
+
+    def _restart_later(self, worker, now):
+        """_restart_later : a worker died
+
+        :param worker:
+        :param now: time.monotonic()
+        """
+        exitcode = worker.exited()
+        if self._stopping or worker.failed:
+            return
+        if now - worker.started >= HEALTHY_RUN:
+            worker.delay = RESTART_DELAY
+        logging.error("Worker %s exited (%s), restarted in %.1fs",
+                      worker.name, exitcode, worker.delay)
+        worker.restart_at = now + worker.delay
+        worker.delay = min(worker.delay * 2, RESTART_MAX)
+        worker.restarts += 1
+
+    def shutdown(self):
+        """shutdown : stop the workers (they release the held keys),
+        kill the ones still running after STOP_TIMEOUT"""
+        running = [worker for worker in self.workers
+                   if worker.process is not None]
+        for worker in running:
+            worker.stop()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for worker in running:
+            worker.process.join(max(0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logging.warning("Worker %s does not stop, killed", worker.name)
+                worker.process.terminate()
+            worker.exited()
+
+    def counters(self):
+        """counters : counters of all the workers, and their restarts"""
+        total = {'restarts': 0}
+        for worker in self.workers:
+            for (name, value) in worker.total().items():
+                total[name] = total.get(name, 0) + value
+            total['restarts'] += worker.restarts
+        return total
+
+    def show(self):
+        """show : print the counters of each worker, then the total"""
+        for worker in self.workers + [None]:
+            if worker is None:
+                (name, pid, counters) = ('total', '', self.counters())
+            else:
+                (name, pid, counters) = (
+                    worker.name,
+                    worker.process.pid if worker.process else '-',
+                    dict(worker.total(), restarts=worker.restarts))
+            print("{0:<24s} {1:>7} {2:s}".format(
+                name, pid, '  '.join('%s %d' % item
+                                     for item in sorted(counters.items()))))
+
+
+def run(devices, config_files, shard='device'):
+    """run : supervise the workers until SIGINT or SIGTERM
+
+    :param devices:
+    :param config_files:
+    :param shard: one of SHARDS
+    """
+    try:
+        worker_shards = shards(devices, config_files, shard)
+    except ValueError as error:
+        logging.error("Can't start the workers: %s", error)
+        raise SystemExit(1)
+    Supervisor(worker_shards).run()
+
+
+def main():
+    """main"""
+    options.parse_argv()
+    logging.basicConfig(level=logging.INFO)
+    if not (options.DEVICES and options.CONFIG_FILE):
+        usage()
+        return
+    run(options.DEVICES, options.CONFIG_FILES, options.WORKERS or 'device')
+
+
+if __name__ == '__main__':
+    main()
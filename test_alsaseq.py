@@ -0,0 +1,146 @@
+"""
+Tests of SeqDevice without alsa : libasound is mocked
+and fed with crafted sequencer events
+
+Run with : python3 -m unittest
+"""
+import ctypes
+import unittest
+from unittest import mock
+import alsaseq
+from alsaseq import SeqDevice, SeqEvent, EAGAIN
+from alsaseq import SND_SEQ_EVENT_NOTEON, SND_SEQ_EVENT_NOTEOFF
+from alsaseq import SND_SEQ_EVENT_CONTROLLER, SND_SEQ_EVENT_PITCHBEND
+from alsaseq import SND_SEQ_EVENT_SYSEX, SND_SEQ_EVENT_PORT_EXIT
+from alsaseq import SND_SEQ_EVENT_CLIENT_EXIT
+from midiev import NOTEON, NOTEOFF, CONTROLLER, PITCHBEND, SYSEX
+
+# address of the port read, see FakeLibasound
+CLIENT = 20
+PORT = 0
+
+
+def note_event(evtype, channel, note, velocity):
+    """note_event : SeqEvent of a note"""
+    event = SeqEvent(type=evtype)
+    event.data.note.channel = channel
+    event.data.note.note = note
+    event.data.note.velocity = velocity
+    return event
+
+
+def control_event(evtype, channel, value, param=0):
+    """control_event : SeqEvent of a controller or a pitchbend"""
+    event = SeqEvent(type=evtype)
+    event.data.control.channel = channel
+    event.data.control.param = param
+    event.data.control.value = value
+    return event
+
+
+def exit_event(evtype, client, port):
+    """exit_event : SeqEvent announcing that a port or a client is gone"""
+    event = SeqEvent(type=evtype)
+    event.data.addr.client = client
+    event.data.addr.port = port
+    return event
+
+
+class FakeLibasound(object):
+    """FakeLibasound : a mock of libasound whose snd_seq_event_input
+    returns the queued events, then -EAGAIN"""
+
+    def __init__(self):
+        self.events = []
+        self.lib = mock.MagicMock()
+        for name in ('snd_seq_open', 'snd_seq_create_simple_port',
+                     'snd_seq_connect_from', 'snd_seq_poll_descriptors'):
+            getattr(self.lib, name).return_value = 0
+        self.lib.snd_seq_parse_address.side_effect = self.parse_address
+        self.lib.snd_seq_event_input.side_effect = self.event_input
+
+    @staticmethod
+    def parse_address(handle, addr, name):
+        """parse_address : every port is CLIENT:PORT"""
+        addr._obj.client = CLIENT
+        addr._obj.port = PORT
+        return 0
+
+    def event_input(self, handle, event):
+        """event_input : point event to the next queued event"""
+        if not self.events:
+            return -EAGAIN
+        event._obj.contents = self.events.pop(0)
+        return 1
+
+
+class TestSeqDevice(unittest.TestCase):
+    """SeqDevice.decode and read"""
+
+    def setUp(self):
+        self.fake = FakeLibasound()
+        patch = mock.patch.object(alsaseq, '_LIBASOUND', [self.fake.lib])
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.device = SeqDevice('seq:%d:%d' % (CLIENT, PORT))
+
+    def test_decode_note(self):
+        self.assertEqual(
+            SeqDevice.decode(note_event(SND_SEQ_EVENT_NOTEON, 2, 60, 100)),
+            (NOTEON | 2, 60, 100))
+        self.assertEqual(
+            SeqDevice.decode(note_event(SND_SEQ_EVENT_NOTEOFF, 0, 60, 0)),
+            (NOTEOFF, 60, 0))
+
+    def test_decode_controller(self):
+        self.assertEqual(
+            SeqDevice.decode(control_event(SND_SEQ_EVENT_CONTROLLER, 1,
+                                           64, param=7)),
+            (CONTROLLER | 1, 7, 64))
+
+    def test_decode_pitchbend(self):
+        for (value, data) in ((0, (0, 0x40)), (-8192, (0, 0)),
+                              (8191, (0x7F, 0x7F))):
+            self.assertEqual(
+                SeqDevice.decode(control_event(SND_SEQ_EVENT_PITCHBEND, 3,
+                                               value)),
+                (PITCHBEND | 3,) + data)
+
+    def test_decode_sysex(self):
+        data = ctypes.create_string_buffer(b'\xf0\x7e\x01\x06\xf7', 5)
+        event = SeqEvent(type=SND_SEQ_EVENT_SYSEX)
+        event.data.ext.len = 5
+        event.data.ext.ptr = ctypes.cast(data, ctypes.c_void_p).value
+        self.assertEqual(SeqDevice.decode(event), (SYSEX, b'\x7e\x01\x06'))
+
+    def test_decode_other(self):
+        self.assertIsNone(SeqDevice.decode(SeqEvent(type=0)))
+
+    def test_read(self):
+        self.fake.events = [
+            note_event(SND_SEQ_EVENT_NOTEON, 0, 60, 100),
+            exit_event(SND_SEQ_EVENT_PORT_EXIT, CLIENT, PORT + 1),
+            exit_event(SND_SEQ_EVENT_CLIENT_EXIT, CLIENT + 1, PORT),
+            note_event(SND_SEQ_EVENT_NOTEOFF, 0, 60, 0)]
+        self.assertEqual(self.device.read(),
+                         [(NOTEON, 60, 100), (NOTEOFF, 60, 0)])
+        self.assertEqual(self.device.read(), [])
+
+    def test_port_exit(self):
+        self.fake.events = [
+            note_event(SND_SEQ_EVENT_NOTEON, 0, 60, 100),
+            exit_event(SND_SEQ_EVENT_PORT_EXIT, CLIENT, PORT)]
+        self.assertIsNone(self.device.read())
+
+    def test_client_exit(self):
+        self.fake.events = [exit_event(SND_SEQ_EVENT_CLIENT_EXIT, CLIENT, 3)]
+        self.assertIsNone(self.device.read())
+
+    def test_close(self):
+        self.device.close()
+        self.device.close()
+        self.fake.lib.snd_seq_close.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+"""
+Tests of XTestInjector and UinputInjector, without X server nor
+/dev/uinput : the ctypes libraries, ioctl and write are mocked,
+of the xdotool pipe check with fake xdotool scripts,
+and of the selection of the asyncio injectors
+
+Run with : python3 -m unittest
+"""
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+import injector
+from injector import new_injector, async_injector, BatchInjector
+from injector import XdoPipeInjector, AsyncXdoPipeInjector, FakeInjector
+from injector import XTestInjector, UinputInjector, INPUT_EVENT
+from injector import EV_KEY, EV_SYN, SYN_REPORT, UI_DEV_CREATE
+from injector import UI_DEV_DESTROY
+
+# keysyms and keycodes of the fake X server
+KEYSYMS = {b'Control_L': 0xffe3, b'Shift_L': 0xffe1, b'a': 0x61,
+           b'b': 0x62, b'F5': 0xffc2}
+KEYCODES = {0xffe3: 37, 0xffe1: 50, 0x61: 38, 0x62: 56, 0xffc2: 71}
+
+
+class TestXTestInjector(unittest.TestCase):
+    """XTestInjector with fake libX11 and libXtst"""
+
+    def setUp(self):
+        self.xlib = mock.MagicMock()
+        self.xlib.XOpenDisplay.return_value = 1234
+        self.xlib.XStringToKeysym.side_effect = \
+            lambda name: KEYSYMS.get(name, 0)
+        self.xlib.XKeysymToKeycode.side_effect = \
+            lambda display, keysym: KEYCODES.get(keysym, 0)
+        self.xtst = mock.MagicMock()
+        libs = {'X11': self.xlib, 'Xtst': self.xtst}
+        with mock.patch('ctypes.util.find_library', lambda name: name), \
+                mock.patch('ctypes.CDLL', libs.get):
+            self.injector = XTestInjector()
+
+    def sent(self):
+        """sent : (keycode, pressed) of the faked key events"""
+        return [(call[0][1], call[0][2])
+                for call in self.xtst.XTestFakeKeyEvent.call_args_list]
+
+    def test_resolve(self):
+        self.assertEqual(self.injector.resolve('Ctrl+a'), (37, 38))
+        self.assertEqual(self.injector.resolve('f5'), (71,))
+        self.assertIsNone(self.injector.resolve('Ctrl+nokey'))
+
+    def test_press_release(self):
+        keycodes = self.injector.resolve('Ctrl+Shift+a')
+        self.injector.inject('key', keycodes)
+        self.assertEqual(self.sent(), [(37, True), (50, True), (38, True),
+                                       (38, False), (50, False),
+                                       (37, False)])
+        self.xlib.XFlush.assert_called_once_with(1234)
+
+    def test_inject_many(self):
+        self.injector.inject_many([('keydown', (37, 38)), ('key', None),
+                                   ('keyup', (37, 38))])
+        self.assertEqual(self.sent(), [(37, True), (38, True),
+                                       (38, False), (37, False)])
+        self.xlib.XFlush.assert_called_once_with(1234)
+
+    def test_close(self):
+        self.injector.close()
+        self.injector.close()
+        self.xlib.XCloseDisplay.assert_called_once_with(1234)
+
+
+class TestUinputInjector(unittest.TestCase):
+    """UinputInjector with a fake /dev/uinput"""
+
+    def setUp(self):
+        self.written = []
+        patches = [
+            mock.patch.object(injector.os, 'open', return_value=42),
+            mock.patch.object(injector.os, 'close'),
+            mock.patch.object(injector.os, 'write',
+                              lambda fd, data: self.written.append(data)),
+            mock.patch.object(injector.fcntl, 'ioctl')]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.ioctl = injector.fcntl.ioctl
+        self.injector = UinputInjector()
+
+    def events(self):
+        """events : (type, code, value) of each input event written"""
+        data = b''.join(self.written)
+        return [INPUT_EVENT.unpack_from(data, offset)[2:]
+                for offset in range(0, len(data), INPUT_EVENT.size)]
+
+    def test_create(self):
+        self.assertEqual(self.ioctl.call_args_list[-1],
+                         mock.call(42, UI_DEV_CREATE))
+
+    def test_resolve(self):
+        self.assertEqual(self.injector.resolve('Ctrl+a'), (29, 30))
+        self.assertEqual(self.injector.resolve('A'), (42, 30))
+        self.assertEqual(self.injector.resolve('F5'), (63,))
+        self.assertIsNone(self.injector.resolve('Ctrl+nokey'))
+
+    def test_press_release(self):
+        self.injector.inject('key', self.injector.resolve('Ctrl+a'))
+        self.assertEqual(len(self.written), 1)
+        syn = (EV_SYN, SYN_REPORT, 0)
+        self.assertEqual(self.events(), [
+            (EV_KEY, 29, 1), syn, (EV_KEY, 30, 1), syn,
+            (EV_KEY, 30, 0), syn, (EV_KEY, 29, 0), syn])
+
+    def test_inject_many(self):
+        self.injector.inject_many([('keydown', (29,)), ('key', None),
+                                   ('keydown', (30,)), ('keyup', (30,)),
+                                   ('keyup', (29,))])
+        self.assertEqual(len(self.written), 1)
+        self.assertEqual([event for event in self.events()
+                          if event[0] == EV_KEY],
+                         [(EV_KEY, 29, 1), (EV_KEY, 30, 1),
+                          (EV_KEY, 30, 0), (EV_KEY, 29, 0)])
+
+    def test_close(self):
+        self.injector.close()
+        self.injector.close()
+        self.assertEqual(self.ioctl.call_args_list[-1],
+                         mock.call(42, UI_DEV_DESTROY))
+        injector.os.close.assert_called_once_with(42)
+# a fake `xdotool -` which runs each line at once : it answers
+# getmouselocation, and writes the other lines in the file argv[1]
+XDOTOOL_SCRIPT = """
+import sys
+with open(sys.argv[1], 'a') as done:
+    for line in iter(sys.stdin.readline, ''):
+        if line.startswith('getmouselocation'):
+            print('x:0 y:0 screen:0 window:1', flush=True)
+        else:
+            done.write(line)
+            done.flush()
+"""
+
+
+class TestXdoPipeCheck(unittest.TestCase):
+    """an xdotool which waits for the end of its input is not used"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.done = os.path.join(self.tmpdir, 'done')
+        patch = mock.patch.object(injector, 'PROBE_TIMEOUT', 0.2)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def command(self, buffered):
+        """command : of a fake xdotool reading its standard input
+
+        :param buffered: reads it up to the end of file first
+        """
+        if buffered:
+            return ('sh', '-c', 'cat > "$1"', '-', self.done, '-')
+        return (sys.executable, '-u', '-c', XDOTOOL_SCRIPT, self.done, '-')
+
+    def sent(self):
+        """sent : lines run by the fake xdotool"""
+        if not os.path.exists(self.done):
+            return []
+        with open(self.done) as done:
+            return done.read().splitlines()
+
+    def test_pipe(self):
+        pipe = XdoPipeInjector(self.command(buffered=False))
+        pipe._fallback = FakeInjector()
+        pipe.inject('key', 'a')
+        pipe.inject_many([('keydown', 'b'), ('keyup', 'b')])
+        pipe.close()
+        self.assertEqual(self.sent(), ['key a', 'keydown b', 'keyup b'])
+        self.assertEqual(pipe._fallback.events, [])
+
+    def test_buffered(self):
+        pipe = XdoPipeInjector(self.command(buffered=True))
+        pipe._fallback = FakeInjector()
+        pipe.inject('key', 'a')
+        pipe.inject_many([('keydown', 'b'), ('keyup', 'b')])
+        pipe.close()
+        self.assertEqual(pipe._fallback.events,
+                         [('key', 'a'), ('keydown', 'b'), ('keyup', 'b')])
+        self.assertNotIn('key a', self.sent())
+
+    def run_async(self, buffered):
+        """run_async : inject a key with an AsyncXdoPipeInjector,
+        return the key events given to its fallback"""
+        pipe = AsyncXdoPipeInjector(self.command(buffered))
+        pipe._fallback = FakeInjector()
+
+        async def run():
+            """run"""
+            await pipe.start()
+            pipe.inject('key', 'a')
+            await pipe.aclose()
+
+        asyncio.run(run())
+        return pipe._fallback.events
+
+    def test_async_pipe(self):
+        self.assertEqual(self.run_async(buffered=False), [])
+        self.assertEqual(self.sent(), ['key a'])
+
+    def test_async_buffered(self):
+        self.assertEqual(self.run_async(buffered=True), [('key', 'a')])
+
+
+class TestAsyncInjector(unittest.TestCase):
+    """asyncio versions of the injectors"""
+
+    def test_new_injector(self):
+        self.assertIsInstance(new_injector('xdotool-pipe'), XdoPipeInjector)
+        self.assertIsInstance(new_injector('xdotool-pipe', asynchronous=True),
+                              AsyncXdoPipeInjector)
+        batch = new_injector('xdotool-pipe', 0.001, asynchronous=True)
+        self.assertIsInstance(batch.injector, AsyncXdoPipeInjector)
+
+    def test_async_injector(self):
+        batch = async_injector(BatchInjector(XdoPipeInjector(), 0.001))
+        self.assertIsInstance(batch.injector, AsyncXdoPipeInjector)
+        self.assertEqual(batch.window, 0.001)
+        fake = FakeInjector()
+        self.assertIs(async_injector(fake), fake)
+        batch = BatchInjector(fake, 0.001)
+        self.assertIs(async_injector(batch), batch)
+
+    def test_batch_start_aclose(self):
+        inner = mock.MagicMock()
+        inner.start = mock.AsyncMock(return_value='started')
+        inner.aclose = mock.AsyncMock()
+        batch = BatchInjector(inner, 1)
+
+        async def run():
+            """run"""
+            self.assertEqual(await batch.start(), 'started')
+            batch.inject('key', 'a')
+            await batch.aclose()
+
+        asyncio.run(run())
+        inner.inject_many.assert_called_once_with([('key', 'a')])
+        inner.aclose.assert_awaited_once_with()
+        inner.close.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
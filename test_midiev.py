@@ -0,0 +1,88 @@
+"""
+Tests of MidiQueue, and of MidiKeyboard with fake midi devices
+(fifos, see fakemidi.py)
+
+Run with : python3 -m unittest
+"""
+import time
+import unittest
+from fakemidi import FakeMidi
+from midiev import MidiKeyboard, MidiQueue, DEVICE_LOST, DEVICE_FOUND
+from midiev import NOTEON, NOTEOFF, CONTROLLER
+from midiev import RECONNECT_INTERVAL
+
+
+class TestQueue(unittest.TestCase):
+    """a full queue never drops the releases"""
+
+    def fill(self, policy):
+        """fill : put more events than a queue of 2 events can hold,
+        return the messages kept"""
+        queue = MidiQueue(maxsize=2, policy=policy)
+        for message in ((NOTEON, 60, 100), (CONTROLLER, 7, 1),
+                        (NOTEOFF, 60, 0), (NOTEOFF, 61, 0),
+                        (NOTEON, 62, 100), (NOTEON, 63, 0)):
+            queue.put(('dev', message, 0))
+        return [queue.get(block=False)[1] for _ in range(queue.qsize())]
+
+    def test_releases_kept(self):
+        for policy in ('drop-oldest', 'drop-newest', 'coalesce'):
+            self.assertEqual(self.fill(policy),
+                             [(NOTEOFF, 60, 0), (NOTEOFF, 61, 0),
+                              (NOTEON, 63, 0)], policy)
+
+    def test_unbounded(self):
+        queue = MidiQueue()
+        for note in range(2000):
+            queue.put(('dev', (NOTEON, note % 128, 100), 0))
+        self.assertEqual((queue.qsize(), queue.dropped), (2000, 0))
+
+
+class TestReconnect(unittest.TestCase):
+    """an unplugged device is read again once it is back"""
+
+    def setUp(self):
+        self.fake = FakeMidi('/tmp/fakemidi-test-reconnect')
+        self.midikb = MidiKeyboard(self.fake.path)
+        self.assertTrue(self.midikb.wait_running(2))
+
+    def tearDown(self):
+        self.midikb.stop_thread()
+        self.fake.remove()
+
+    def read(self, timeout=2):
+        """read : next (message, time read)"""
+        event = self.midikb.read_event(timeout)
+        self.assertTrue(event, 'no event')
+        return (event[1], event[2])
+
+    def test_unplug_replug(self):
+        self.fake.send((NOTEON, 60, 100))
+        self.assertEqual(self.read()[0], (NOTEON, 60, 100))
+        # running for longer than the retry interval before the unplug
+        time.sleep(RECONNECT_INTERVAL * 1.5)
+        self.fake.unplug()
+        (message, lost) = self.read()
+        self.assertEqual(message, (DEVICE_LOST,))
+        time.sleep(RECONNECT_INTERVAL / 2)
+        self.assertFalse(self.midikb.read_event(0))
+        self.fake.replug()  # blocks until the reader opened the fifo
+        (message, found) = self.read(RECONNECT_INTERVAL * 2)
+        self.assertEqual(message, (DEVICE_FOUND,))
+        self.assertGreaterEqual(found - lost, RECONNECT_INTERVAL / 2)
+        self.fake.send((NOTEON, 62, 100))
+        self.assertEqual(self.read()[0], (NOTEON, 62, 100))
+
+    def test_unplug_twice(self):
+        for note in (60, 62):
+            self.fake.send((NOTEON, note, 100))
+            self.assertEqual(self.read()[0], (NOTEON, note, 100))
+            self.fake.unplug()
+            self.assertEqual(self.read()[0], (DEVICE_LOST,))
+            self.fake.replug()
+            self.assertEqual(self.read(RECONNECT_INTERVAL * 2)[0],
+                             (DEVICE_FOUND,))
+
+
+if __name__ == '__main__':
+    unittest.main()
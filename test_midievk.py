@@ -0,0 +1,231 @@
+"""
+Tests of MidiToXdo and MidiToXdoGroup, with a FakeInjector
+
+Run with : python3 -m unittest
+"""
+import os
+import json
+import shutil
+import asyncio
+import time
+import tempfile
+import unittest
+from fakemidi import FakeMidi
+from unittest import mock
+import options
+from injector import FakeInjector, BatchInjector, XdoInjector
+from midiev import MidiKeyboard, NOTEON, NOTEOFF, CONTROLLER
+from midievk import MidiToXdo, MidiToXdoGroup, read_layouts
+
+KEYTABLE = {'0x93c': {'type': 'Note-on', 'channel': 60,
+                      'keybind': 'a', 'mode': 0}}
+
+
+class LayoutTest(unittest.TestCase):
+    """config files in a temporary directory"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def config(self, name, **settings):
+        """config : write a config file, return its path
+
+        :param name:
+        :param settings: e.g. keytable
+        """
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as config_file:
+            json.dump(dict((key.replace('_', '-'), value)
+                           for (key, value) in settings.items()),
+                      config_file)
+        return path
+
+    def layout(self, injector=None, **settings):
+        """layout : MidiToXdo of a new config
+
+        :param injector:
+        :param settings: see config
+        """
+        midixdo = MidiToXdo(injector or FakeInjector())
+        path = self.config('config%d.json' % len(os.listdir(self.tmpdir)),
+                           **settings)
+        self.assertTrue(midixdo.read_configs(file_name=path))
+        return midixdo
+
+
+class FakeMidiKeyboard(object):
+    """FakeMidiKeyboard : events() yields the given messages,
+    then waits until it is cancelled"""
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def events(self, tagged=False):
+        """events"""
+        for message in self.messages:
+            yield ('fake', message)
+        await asyncio.Event().wait()
+
+
+class TestLayoutOptions(LayoutTest):
+    """each layout keeps the options of its own config"""
+
+    def test_set_injector(self):
+        layouts = [self.layout(keytable=KEYTABLE, ctl_steps=10),
+                   self.layout(keytable=KEYTABLE, ctl_steps=0)]
+        for midixdo in layouts:
+            midixdo.set_injector(FakeInjector())
+        self.assertEqual([midixdo._ctl_steps for midixdo in layouts],
+                         [10, 0])
+        self.assertIsNotNone(layouts[0]._levels[CONTROLLER])
+        self.assertIsNone(layouts[1]._levels[CONTROLLER])
+
+
+class KeymapInjector(FakeInjector):
+    """KeymapInjector : resolve returns None for unknown keys,
+    as XTestInjector and UinputInjector do"""
+
+    def resolve(self, keybind):
+        """resolve
+
+        :param keybind:
+        """
+        return keybind if keybind in ('a', 'b', 'c') else None
+
+    def inject(self, keyevt, keybind):
+        """inject
+
+        :param keyevt:
+        :param keybind:
+        """
+        assert keybind is not None, 'unresolved keybind injected'
+        FakeInjector.inject(self, keyevt, keybind)
+
+
+class TestChordEntries(LayoutTest):
+    """chords and sequences which can not be used are skipped"""
+
+    def play(self, midixdo, notes):
+        """play : press then release notes, return the key events"""
+        for note in notes:
+            midixdo.process((NOTEON, note, 100))
+        for note in notes:
+            midixdo.process((NOTEOFF, note, 0))
+        midixdo.flush_pending()
+        return midixdo.injector.events
+
+    def test_incomplete_entries(self):
+        midixdo = self.layout(
+            KeymapInjector(), keytable=KEYTABLE,
+            chords=[{'keybind': 'b'}, {'notes': [62, 64]},
+                    {'notes': [], 'keybind': 'b'}, 'b',
+                    {'notes': [62, 64], 'keybind': 'c'}],
+            sequences=[{'notes': [65, 67]}, {'keybind': 'b'}, None])
+        self.assertEqual(midixdo.chords,
+                         [{'notes': [62, 64], 'keybind': 'c'}])
+        self.assertEqual(midixdo.sequences, [])
+        self.assertEqual(self.play(midixdo, [62, 64]),
+                         [('keydown', 'c'), ('keyup', 'c')])
+
+    def test_unresolved_keybind(self):
+        midixdo = self.layout(
+            KeymapInjector(), keytable=KEYTABLE,
+            chords=[{'notes': [62, 64], 'keybind': 'nokey'},
+                    {'notes': [65, 67], 'keybind': None}],
+            sequences=[{'notes': [60, 62], 'keybind': 'Ctrl+nokey'}])
+        self.assertEqual(self.play(midixdo, [62, 64]), [])
+        self.assertEqual(self.play(midixdo, [60, 62]),
+                         [('keydown', 'a'), ('keyup', 'a')])
+
+    def test_reload(self):
+        midixdo = self.layout(KeymapInjector(), keytable=KEYTABLE)
+        self.config(os.path.basename(midixdo.config_file), keytable=KEYTABLE,
+                    chords=[{'notes': [62, 64]},
+                            {'notes': [65, 67], 'keybind': 'nokey'}])
+        self.assertTrue(midixdo.reload_configs())
+        self.assertEqual(self.play(midixdo, [62, 64, 65, 67]), [])
+
+
+class TestBatchWindow(LayoutTest):
+    """key events are gathered by default with xdotool only"""
+
+    def injector(self, name, window=None):
+        """injector : of the layouts read with --injector name"""
+        path = self.config('config.json', keytable=KEYTABLE)
+        with mock.patch.object(options, 'INJECTOR', name), \
+                mock.patch.object(options, 'BATCH_WINDOW', window):
+            return read_layouts([path])[0].injector
+
+    def test_xdotool(self):
+        injector = self.injector('xdotool')
+        self.assertIsInstance(injector, BatchInjector)
+        self.assertIsInstance(injector.injector, XdoInjector)
+        self.assertEqual(injector.window, 0.0005)
+        self.assertIsInstance(self.injector('xdotool', 0), XdoInjector)
+
+    def test_other(self):
+        self.assertIsInstance(self.injector('null'), FakeInjector)
+        self.assertEqual(self.injector('null', 1000).window, 0.001)
+
+
+class TestRunAsync(LayoutTest):
+    """keys held when run_async stops are released"""
+
+    def run_cancelled(self, layout, messages):
+        """run_cancelled : run layout.run_async until the messages
+        are processed, then cancel it"""
+
+        async def run():
+            """run"""
+            task = asyncio.ensure_future(
+                layout.run_async(FakeMidiKeyboard(messages)))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+
+    def test_release_on_cancel(self):
+        injector = FakeInjector()
+        midixdo = self.layout(injector, keytable=KEYTABLE)
+        self.run_cancelled(midixdo, [(NOTEON, 60, 100)])
+        self.assertEqual(injector.events,
+                         [('keydown', 'a'), ('keyup', 'a')])
+
+    def test_group_release_on_cancel(self):
+        injector = FakeInjector()
+        group = MidiToXdoGroup([self.layout(injector, keytable=KEYTABLE),
+                                self.layout(injector, keytable=KEYTABLE)])
+        self.run_cancelled(group, [(NOTEON, 60, 100)])
+        self.assertEqual(injector.events,
+                         [('keydown', 'a'), ('keydown', 'a'),
+                          ('keyup', 'a'), ('keyup', 'a')])
+
+
+class TestClosing(LayoutTest):
+    """the keys held when midievk quits are released"""
+
+    def test_on_closing(self):
+        fake = FakeMidi(os.path.join(self.tmpdir, 'fakemidi'))
+        self.addCleanup(fake.remove)
+        injector = FakeInjector()
+        group = MidiToXdoGroup([self.layout(injector, keytable=KEYTABLE)])
+        group.set_midi_device(MidiKeyboard(fake.path))
+        dispatcher = group.loop_midi_device()
+        self.addCleanup(dispatcher.set)
+        fake.send((NOTEON, 60, 100))
+        deadline = time.monotonic() + 2
+        while not injector.events and time.monotonic() < deadline:
+            time.sleep(0.01)
+        dispatcher.set()
+        with self.assertLogs(level='INFO') as logs:
+            group.on_closing()
+        self.assertEqual(injector.events, [('keydown', 'a'), ('keyup', 'a')])
+        self.assertIn('INFO:root:Events dropped: 0, coalesced: 0',
+                      logs.output)
+
+
+if __name__ == '__main__':
+    unittest.main()